@@ -0,0 +1,231 @@
+# _*_ coding:UTF-8 _*_
+
+"""
+该文件定义了预先计算的每个tick的交易动作。
+calc_tick_action除最后打乱顺序外，对给定的一对截面结果确定，因此将尚未打乱的交易动作按(symbol, datetime)保存在
+market/data/actions/<symbol>/下的.npy文件中，读取时只需打乱顺序，不再求解。
+文件中记录了求解逻辑的版本SOLVER_VERSION与tick数据的标记，任一改变时缓存失效。
+"""
+
+import os
+import shutil
+import time
+
+import numpy as np
+
+from .calculations import SOLVER_VERSION, calc_tick_action, calc_tick_actions_batch, arrange_tick_actions, \
+    is_call_auction_time
+from .models.sim_tick_store import get_tick_columns, tick_store
+from .models.utils import get_int_from_timestamp, price_to_cents, cents_to_price
+
+
+ACTION_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'actions')
+
+# 每个tick的求解状态
+STATUS_SOLVED = 0
+STATUS_UNSOLVED = 1  # 无法计算
+STATUS_AUCTION = 2  # 集合竞价时段，不计算
+
+# 每个tick一项
+ENTRY_FIELDS = {'datetime': np.int64, 'status': np.int8, 'offset': np.int64, 'count': np.int32,
+                'locked': np.int8, 'delta_volume': np.int64}
+# 全部tick的交易动作依次排列，每个动作一项
+ACTION_FIELDS = {'direction': 'S1', 'price': np.int32, 'vol': np.int64}
+
+
+class TickActionCache:
+    """
+    一支股票全部tick的交易动作，以mmap方式打开
+    """
+
+    def __init__(self, symbol, entries, actions):
+        self.symbol = symbol
+        self.entries = entries
+        self.actions = actions
+        self.tick_columns = None  # 载入时核对过的列式tick数据
+
+    def __len__(self):
+        return len(self.entries['datetime'])
+
+    def index_of(self, int_datetime):
+        datetimes = self.entries['datetime']
+        index = int(np.searchsorted(datetimes, int_datetime))
+        if index < len(datetimes) and datetimes[index] == int_datetime:
+            return index
+        return None
+
+    def get(self, index):
+        """
+        :return: (status, actions, action_locked, delta_volume)，actions为尚未打乱的交易动作
+        """
+        status = int(self.entries['status'][index])
+        offset = int(self.entries['offset'][index])
+        count = int(self.entries['count'][index])
+        actions = [(direction.decode(), cents_to_price(price), int(vol)) for direction, price, vol in
+                   zip(self.actions['direction'][offset:offset + count].tolist(),
+                       self.actions['price'][offset:offset + count].tolist(),
+                       self.actions['vol'][offset:offset + count].tolist())]
+        action_locked = None
+        if self.entries['locked'][index]:
+            action_locked = actions.pop()
+        return status, actions, action_locked, int(self.entries['delta_volume'][index])
+
+    def get_tick_action(self, index, rng=None):
+        """
+        与calc_tick_action的返回值相同，无法计算时返回None
+        """
+        status, actions, action_locked, delta_volume = self.get(index)
+        if status != STATUS_SOLVED:
+            return None
+        return arrange_tick_actions(self.entries['datetime'][index], actions, action_locked, delta_volume, rng)
+
+
+def get_cache_path(symbol):
+    return os.path.join(ACTION_CACHE_PATH, symbol)
+
+
+def load_action_cache(symbol):
+    """
+    读取一支股票的交易动作缓存，不存在、求解版本或tick数据不一致时返回None
+    """
+    path = get_cache_path(symbol)
+    if not os.path.exists(os.path.join(path, 'stamp.npy')):
+        return None
+    stamp = np.load(os.path.join(path, 'stamp.npy')).tolist()
+    signature = tick_store.get_signature(symbol)
+    if signature is None or stamp != [SOLVER_VERSION] + list(signature):
+        return None
+    entries = dict((field, np.load(os.path.join(path, field + '.npy'), mmap_mode='r')) for field in ENTRY_FIELDS)
+    actions = dict((field, np.load(os.path.join(path, 'action_' + field + '.npy'), mmap_mode='r'))
+                   for field in ACTION_FIELDS)
+    return TickActionCache(symbol, entries, actions)
+
+
+def save_action_cache(symbol, entries, actions):
+    path = get_cache_path(symbol)
+    temp_path = path + '.tmp'
+    if os.path.exists(temp_path):
+        shutil.rmtree(temp_path)
+    os.makedirs(temp_path)
+    for field, dtype in ENTRY_FIELDS.items():
+        np.save(os.path.join(temp_path, field + '.npy'), np.asarray(entries[field], dtype=dtype))
+    for field, dtype in ACTION_FIELDS.items():
+        np.save(os.path.join(temp_path, 'action_' + field + '.npy'), np.asarray(actions[field], dtype=dtype))
+    stamp = [SOLVER_VERSION] + list(tick_store.get_signature(symbol))
+    np.save(os.path.join(temp_path, 'stamp.npy'), np.asarray(stamp, dtype=np.int64))
+    _action_caches.pop(symbol, None)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(temp_path, path)
+    return True
+
+
+def precompute_tick_actions(symbol, start=None, end=None):
+    """
+    预先计算一支股票在[start, end]之间每个tick的交易动作，按交易日分批求解，与已有的缓存合并后写入
+    """
+    time0 = time.time()
+    tick_columns = get_tick_columns(symbol)
+    left = 0 if start is None else tick_columns.search(start)
+    # 最后一个截面没有下一tick，不计算
+    right = min(left + len(tick_columns.range(start, end)), len(tick_columns) - 1)
+    if right <= left:
+        return False
+
+    entries = dict((field, []) for field in ENTRY_FIELDS)
+    actions = dict((field, []) for field in ACTION_FIELDS)
+    days = tick_columns['datetime'][left:right] // 1000000000
+    day_starts = (np.flatnonzero(days[1:] != days[:-1]) + 1 + left).tolist()
+    for day_left, day_right in zip([left] + day_starts, day_starts + [right]):
+        # 每日的最后一个截面与次日第一个截面之间同样是一个tick
+        slices = [tick_columns.to_slice(i) for i in range(day_left, day_right + 1)]
+        results = calc_tick_actions_batch(slices, arranged=False)
+        for i, result in enumerate(results):
+            entries['datetime'].append(int(tick_columns['datetime'][day_left + i]))
+            entries['offset'].append(len(actions['direction']))
+            if result is None:
+                entries['status'].append(STATUS_AUCTION if is_call_auction_time(slices[i].datetime)
+                                         else STATUS_UNSOLVED)
+                entries['count'].append(0)
+                entries['locked'].append(0)
+                entries['delta_volume'].append(0)
+                continue
+            tick_actions, action_locked, delta_volume = result
+            if action_locked is not None:
+                tick_actions = tick_actions + [action_locked]
+            for direction, price, vol in tick_actions:
+                actions['direction'].append(direction)
+                actions['price'].append(price_to_cents(price))
+                actions['vol'].append(vol)
+            entries['status'].append(STATUS_SOLVED)
+            entries['count'].append(len(tick_actions))
+            entries['locked'].append(action_locked is not None)
+            entries['delta_volume'].append(delta_volume)
+        print('{} actions calculated, cost {:.2f} s.'.format(slices[0].datetime.date(), time.time() - time0))
+
+    cache = load_action_cache(symbol)
+    if cache is not None and len(cache) > 0 and len(entries['datetime']) > 0:
+        # 保留已有缓存中不在本次计算范围内的部分
+        cached_datetimes = cache.entries['datetime']
+        before = int(np.searchsorted(cached_datetimes, entries['datetime'][0], side='left'))
+        after = int(np.searchsorted(cached_datetimes, entries['datetime'][-1], side='right'))
+        num_before_actions = int(cache.entries['offset'][before]) if before < len(cache) \
+            else len(cache.actions['direction'])
+        num_after_actions = int(cache.entries['offset'][after]) if after < len(cache) \
+            else len(cache.actions['direction'])
+        shift = len(actions['direction']) - (num_after_actions - num_before_actions)
+        merged_entries = {}
+        for field in ENTRY_FIELDS:
+            new_part = np.asarray(entries[field], dtype=ENTRY_FIELDS[field])
+            after_part = np.asarray(cache.entries[field][after:])
+            if field == 'offset':
+                new_part = new_part + num_before_actions
+                after_part = after_part + shift
+            merged_entries[field] = np.concatenate((cache.entries[field][:before], new_part, after_part))
+        merged_actions = {}
+        for field in ACTION_FIELDS:
+            merged_actions[field] = np.concatenate((cache.actions[field][:num_before_actions],
+                                                    np.asarray(actions[field], dtype=ACTION_FIELDS[field]),
+                                                    cache.actions[field][num_after_actions:]))
+        entries, actions = merged_entries, merged_actions
+    save_action_cache(symbol, entries, actions)
+    print('{}: {} ticks precomputed, cost {:.2f} s.'.format(symbol, right - left, time.time() - time0))
+    return True
+
+
+# 本进程中已打开的缓存，symbol -> TickActionCache
+_action_caches = {}
+
+
+def get_action_cache(symbol, build=False):
+    """
+    获得一支股票的交易动作缓存，tick数据被重新导出（invalidate_tick_columns）后重新核对
+    :param build: 缓存不存在或已失效时，是否对该股票的全部tick预先计算
+    """
+    tick_columns = get_tick_columns(symbol)
+    cache = _action_caches.get(symbol)
+    if cache is not None and cache.tick_columns is not tick_columns:
+        del _action_caches[symbol]
+        cache = None
+    if cache is None:
+        cache = load_action_cache(symbol)
+        if cache is None and build:
+            precompute_tick_actions(symbol)
+            tick_columns = get_tick_columns(symbol)
+            cache = load_action_cache(symbol)
+        if cache is not None:
+            cache.tick_columns = tick_columns
+            _action_caches[symbol] = cache
+    return cache
+
+
+def get_tick_action(symbol, cur_datetime, cur_slice=None, next_slice=None, build=False, rng=None):
+    """
+    与calc_tick_action相同，优先从缓存中读取，缓存中没有时再求解
+    """
+    cache = get_action_cache(symbol, build)
+    if cache is not None:
+        index = cache.index_of(get_int_from_timestamp(cur_datetime))
+        if index is not None:
+            return cache.get_tick_action(index, rng)
+    return calc_tick_action(symbol, cur_datetime, cur_slice, next_slice, rng)
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from baselines.common.tile_images import tile_images
+from market.baselines.baselines.common.tile_images import tile_images
 
 class AlreadySteppingError(Exception):
     """
@@ -6,7 +6,7 @@ from multiprocessing import Pipe, Array, Process
 import numpy as np
 from . import VecEnv, CloudpickleWrapper
 import ctypes
-from baselines import logger
+from market.baselines.baselines import logger
 
 from .util import dict_to_obs, obs_space_info, obs_to_dict
 
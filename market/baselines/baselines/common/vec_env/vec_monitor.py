@@ -1,5 +1,5 @@
 from . import VecEnvWrapper
-from baselines.bench.monitor import ResultsWriter
+from market.baselines.baselines.bench.monitor import ResultsWriter
 import numpy as np
 import time
 
@@ -3,114 +3,75 @@ This file implements the generation of the expert data used in gail
 """
 
 import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
+import django
+from django.db import connections
 
 from market.baselines.baselines import logger
-from market.models.sim_stocks import SimStockSlice
 from market.models.sim_market import SimMarket
-from market.simulator_main import calc_tick_action
+from market.models.sim_tick_store import get_tick_columns
+from market.action_cache import get_tick_action, get_action_cache
 
 
-def generate_expert_data(stock, traj_length, track_length, traj_num=-1):
+def generate_expert_data(stock, traj_length, track_length, traj_num=-1, max_workers=None):
+    """
+    从market的当前时间开始生成专家数据。各交易日的轨迹互不相关（开盘和收盘竞价时段会清空当前轨迹），
+    因此按交易日拆分为独立的任务在进程池中并行生成，再按日期顺序合并
+    :param max_workers: 进程数，默认为CPU数目，为1时在当前进程中依次生成
+    """
     logger.set_level(20)
     file_name = stock + '_traj_length' + str(traj_length) + '.npz'
     save_path = os.path.join(os.path.split(os.path.abspath(os.curdir))[0], 'VirtualStockMarket', 'market',
                              'baselines', 'baselines', 'gail', 'data', file_name)
     market = SimMarket.objects.get(id=1)
-    datetime = market.datetime
+    tick_columns = get_tick_columns(stock)
+    # 先在主进程中准备好交易动作的缓存，子进程直接读取
+    get_action_cache(stock, build=True)
+    start = tick_columns.index_of(market.datetime)
+    days = tick_columns['datetime'][start:] // 1000000000
+    day_starts = (np.flatnonzero(days[1:] != days[:-1]) + 1 + start).tolist()
+    day_ranges = list(zip([start] + day_starts, day_starts + [len(tick_columns)]))
 
     trajectory_obs = []
     trajectory_acs = []
     trajectory_trk = []
     trajectory_dts = []
-    cur_batch_obs = []
-    cur_batch_acs = []
-    cur_batch_trk = []
-    cur_batch_dts = []
-
-    while True:
-        cur_slice = SimStockSlice.objects.get(stock_symbol=stock, datetime=datetime)
-        next_slice = SimStockSlice.objects.filter(id=cur_slice.id + 1)
-
-        if (datetime.hour == 9 and datetime.minute <= 30) or (datetime.hour == 14 and datetime.minute >= 57):
-            # 开盘和收盘竞价略过
-            if next_slice.exists():
-                datetime = next_slice[0].datetime
-            else:
+    if max_workers == 1:
+        executor = None
+        day_results = (generate_day_trajectories(stock, left, right, traj_length, track_length)
+                       for left, right in day_ranges)
+    else:
+        # 子进程各自建立数据库连接，不能继承父进程的连接
+        connections.close_all()
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=django.setup)
+        futures = [executor.submit(generate_day_trajectories, stock, left, right, traj_length, track_length)
+                   for left, right in day_ranges]
+        day_results = (future.result() for future in futures)
+    try:
+        # 按日期顺序合并
+        for day_obs, day_acs, day_trk, day_dts in day_results:
+            trajectory_obs.extend(day_obs)
+            trajectory_acs.extend(day_acs)
+            trajectory_trk.extend(day_trk)
+            trajectory_dts.extend(day_dts)
+            if day_dts:
+                logger.info('trajectory add, number: {1}, datetime: {0},'.format(day_dts[-1][-1],
+                                                                                 len(trajectory_obs)))
+            # 获取了足够的轨迹数目，结束
+            if traj_num != -1 and len(trajectory_obs) >= traj_num:
+                del trajectory_obs[traj_num:]
+                del trajectory_acs[traj_num:]
+                del trajectory_trk[traj_num:]
+                del trajectory_dts[traj_num:]
                 break
-            cur_batch_obs = []
-            cur_batch_acs = []
-            cur_batch_trk = []
-            continue
-
-        if next_slice.exists():
-            assert len(next_slice) == 1
-            next_slice = next_slice[0]
-            result = calc_tick_action(datetime)
-
-            if result is not None:
-                # 获取盘口数据，level 5
-                level5_data = cur_slice.get_level5_data(to_list=True)
-                # 计算上一tick至当前tick的交易额、交易量
-                prev_slice = SimStockSlice.objects.get(id=cur_slice.id - 1)
-                tick_volume = cur_slice.volume - prev_slice.volume
-                tick_amount = cur_slice.amount - prev_slice.amount
-                last_price = cur_slice.last_price
-                high = cur_slice.high
-                low = cur_slice.low
-
-                # 将order book、最新、最高、最低价、当前tick的交易额、量加入observation
-                temp_obs = []
-                for piece_info in level5_data:
-                    temp_obs.append(piece_info)
-                temp_obs.append(last_price)
-                temp_obs.append(high)
-                temp_obs.append(low)
-                temp_obs.append(tick_volume)
-                temp_obs.append(tick_amount)
-
-                # 将前n个tick的价格走势加入observation
-                cur_batch_trk.append(temp_obs)
-
-                # 获得足够的track tick后，开始记入专家数据
-                if len(cur_batch_trk) >= track_length + 1:
-                    if len(cur_batch_trk) > track_length + traj_length:
-                        del cur_batch_trk[0]
-                    cur_batch_obs.append(temp_obs.copy())
-
-                    a5_price = cur_slice.a5
-                    b5_price = cur_slice.b5
-                    level5_ask, level5_bid = cur_slice.get_level5_volume()
-                    level5_vol = level5_ask + level5_bid
-                    # 忽略level浮出、沉没造成的巨量action
-                    for i in range(len(result) - 1, -1, -1):
-                        if (result[i][0] == 'a' and result[i][1] > a5_price) or \
-                                (result[i][0] == 'b' and result[i][1] < b5_price):
-                            del result[i]
-                    actions = trans_actions_form_for_training(result, a5_price, b5_price, level5_vol)
-                    cur_batch_acs.append(actions)
-                    cur_batch_dts.append(datetime)
-
-                # 达到预定轨迹长度，保存轨迹记录，重新计数, n: traj_length, m: track_length
-                if len(cur_batch_obs) == traj_length:
-                    trajectory_obs.append(cur_batch_obs)  # shape: (n, 25)
-                    trajectory_acs.append(cur_batch_acs)  # shape: (n, )
-                    trajectory_dts.append(cur_batch_dts)  # shape: (n, )
-                    trajectory_trk.append(cur_batch_trk[0:track_length])  # shape: (n + m - 1, 25)
-                    logger.info('trajectory add, number: {1}, datetime: {0},'.format(datetime, len(trajectory_obs)))
-                    cur_batch_obs = []
-                    cur_batch_acs = []
-                    cur_batch_dts = []
-
-                    # 获取了足够的轨迹数目，结束循环
-                    if len(trajectory_obs) == traj_num and traj_num != -1:
-                        break
-
-            datetime = next_slice.datetime
-
-        else:
-            # 遍历完所有记录，结束
-            break
+    finally:
+        if executor is not None:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
 
     # 存储
     trajectory_obs = np.array(trajectory_obs)
@@ -135,6 +96,97 @@ def generate_expert_data(stock, traj_length, track_length, traj_num=-1):
     return True
 
 
+def generate_day_trajectories(stock, left, right, traj_length, track_length):
+    """
+    生成一个交易日（截面下标[left, right)）内的全部专家轨迹
+    打乱交易动作使用以日期为种子的局部随机数，结果与进程数、执行顺序无关，也不改变全局的随机数状态
+    :return: (obs, acs, trk, dts)，各为该日轨迹的列表
+    """
+    tick_columns = get_tick_columns(stock)
+    rng = random.Random(int(tick_columns['datetime'][left]) // 1000000000)
+
+    trajectory_obs = []
+    trajectory_acs = []
+    trajectory_trk = []
+    trajectory_dts = []
+    cur_batch_obs = []
+    cur_batch_acs = []
+    cur_batch_trk = []
+    cur_batch_dts = []
+
+    for index in range(left, right):
+        cur_slice = tick_columns.to_slice(index)
+        datetime = cur_slice.datetime
+
+        if (datetime.hour == 9 and datetime.minute <= 30) or (datetime.hour == 14 and datetime.minute >= 57):
+            # 开盘和收盘竞价略过
+            cur_batch_obs = []
+            cur_batch_acs = []
+            cur_batch_trk = []
+            cur_batch_dts = []
+            continue
+
+        if index + 1 >= len(tick_columns):
+            # 遍历完所有记录，结束
+            break
+        next_slice = tick_columns.to_slice(index + 1)
+        result = get_tick_action(stock, datetime, cur_slice, next_slice, rng=rng)
+
+        if result is not None:
+            # 获取盘口数据，level 5
+            level5_data = cur_slice.get_level5_data(to_list=True)
+            # 计算上一tick至当前tick的交易额、交易量
+            tick_volume = cur_slice.volume - int(tick_columns['volume'][index - 1])
+            tick_amount = cur_slice.amount - float(tick_columns['amount'][index - 1])
+            last_price = cur_slice.last_price
+            high = cur_slice.high
+            low = cur_slice.low
+
+            # 将order book、最新、最高、最低价、当前tick的交易额、量加入observation
+            temp_obs = []
+            for piece_info in level5_data:
+                temp_obs.append(piece_info)
+            temp_obs.append(last_price)
+            temp_obs.append(high)
+            temp_obs.append(low)
+            temp_obs.append(tick_volume)
+            temp_obs.append(tick_amount)
+
+            # 将前n个tick的价格走势加入observation
+            cur_batch_trk.append(temp_obs)
+
+            # 获得足够的track tick后，开始记入专家数据
+            if len(cur_batch_trk) >= track_length + 1:
+                if len(cur_batch_trk) > track_length + traj_length:
+                    del cur_batch_trk[0]
+                cur_batch_obs.append(temp_obs.copy())
+
+                a5_price = cur_slice.a5
+                b5_price = cur_slice.b5
+                level5_ask, level5_bid = cur_slice.get_level5_volume()
+                level5_vol = level5_ask + level5_bid
+                # 忽略level浮出、沉没造成的巨量action
+                for i in range(len(result) - 1, -1, -1):
+                    if (result[i][0] == 'a' and result[i][1] > a5_price) or \
+                            (result[i][0] == 'b' and result[i][1] < b5_price):
+                        del result[i]
+                actions = trans_actions_form_for_training(result, a5_price, b5_price, level5_vol)
+                cur_batch_acs.append(actions)
+                cur_batch_dts.append(datetime)
+
+            # 达到预定轨迹长度，保存轨迹记录，重新计数, n: traj_length, m: track_length
+            if len(cur_batch_obs) == traj_length:
+                trajectory_obs.append(cur_batch_obs)  # shape: (n, 25)
+                trajectory_acs.append(cur_batch_acs)  # shape: (n, )
+                trajectory_dts.append(cur_batch_dts)  # shape: (n, )
+                trajectory_trk.append(cur_batch_trk[0:track_length])  # shape: (n + m - 1, 25)
+                cur_batch_obs = []
+                cur_batch_acs = []
+                cur_batch_dts = []
+
+    return trajectory_obs, trajectory_acs, trajectory_trk, trajectory_dts
+
+
 def trans_actions_form_for_training(actions, a5, b5, total_level5_volume):
     """
     将计算出来的actions转化成神经网络目标输出格式
@@ -0,0 +1,86 @@
+'''
+向量化的市场环境：N个相互独立的SimMarketSession分别锚定在专家轨迹中不同的起始时间，同步前进。
+MarketEnv是单个环境，接口与gym一致（reset()/step(action)），可直接交给common.vec_env中的SubprocVecEnv/ShmemVecEnv，
+每个子进程持有自己的会话，rollout过程中不访问数据库。
+'''
+
+import functools
+import datetime as dt
+
+import numpy as np
+from django.db import connections
+
+from market.models.clients import BaseClient
+from market.models.sim_tick_store import get_tick_columns
+from market.sim_session import SimMarketSession
+from market.baselines.baselines.gail.run_mujoco import Enviroment
+
+
+class MarketEnv(Enviroment):
+    """
+    依次在给定的专家轨迹上展开episode：reset()锚定到一条轨迹的第一个时间，每次step()前进到轨迹中的下一个时间，
+    走完整条轨迹时episode结束
+    """
+    def __init__(self, super_client_id, stock, tracks, rank=0, stride=1):
+        """
+        :param super_client_id: 超级用户的ID
+        :param tracks: 专家轨迹的时间序列列表，见get_expert_tracks
+        :param rank: 第一次reset使用的轨迹下标
+        :param stride: 每次reset跳过的轨迹数，通常为环境的数目，使各环境使用不同的轨迹
+        """
+        Enviroment.__init__(self)
+        self.observation_space = np.zeros((25, ), dtype=np.float32)
+        self.action_space = np.zeros((3, ), dtype=np.float32)
+        self.stock = stock
+        self.session = SimMarketSession(super_client_id)
+        self.tracks = tracks
+        self.next_track = rank
+        self.stride = stride
+        self.track = None
+        self.t = 0
+
+    def reset(self):
+        self.track = self.tracks[self.next_track % len(self.tracks)]
+        self.next_track += self.stride
+        self.t = 0
+        ob = Enviroment.reset(self, self.stock, self.track[0])
+        return ob.astype(np.float32)
+
+    def step(self, action):
+        self.t += 1
+        if self.t < len(self.track):
+            next_datetime = self.track[self.t]
+        else:
+            next_datetime = self.track[-1] + dt.timedelta(seconds=3)
+        ob, true_rew, _, _ = Enviroment.step(self, np.asarray(action, dtype=np.float64), next_datetime)
+        done = self.t >= len(self.track)
+        return ob.astype(np.float32), true_rew, done, {}
+
+
+def get_expert_tracks(dts, traj_length):
+    """
+    将专家数据中的时间（Mujoco_Dset.dts，形如(N, 1)）按轨迹长度切分为各条轨迹的时间序列
+    """
+    dts = np.reshape(dts, [-1])
+    return [dts[i:i + traj_length] for i in range(0, len(dts) - traj_length + 1, traj_length)]
+
+
+def make_market_vec_env(stock, tracks, num_envs, manager='Amadeus', vec_env_class=None):
+    """
+    建立num_envs个并行的MarketEnv
+    :param tracks: 专家轨迹的时间序列列表，第i个环境从第i条轨迹开始
+    :param manager: 超级用户的名字，只在父进程中查询一次
+    :param vec_env_class: 接受env_fns的VecEnv，默认为SubprocVecEnv
+    """
+    super_client = BaseClient.objects.get(name=manager)
+    assert super_client.driver is not None
+    # 在父进程中核对列式tick数据，fork出的子进程无需再访问数据库
+    get_tick_columns(stock)
+    # 数据库连接不能跨进程共享
+    connections.close_all()
+    if vec_env_class is None:
+        from market.baselines.baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
+        vec_env_class = SubprocVecEnv
+    env_fns = [functools.partial(MarketEnv, super_client.id, stock, tracks, rank, num_envs)
+               for rank in range(num_envs)]
+    return vec_env_class(env_fns)
@@ -60,6 +60,9 @@ class MlpPolicy(object):
         ac1, vpred1 = self._act(stochastic, ob)
         return ac1[0], vpred1[0]
 
+    def act_batch(self, stochastic, obs):
+        return self._act(stochastic, obs)
+
     def get_variables(self):
         return tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, self.scope)
 
@@ -11,6 +11,7 @@ from tqdm import tqdm
 import numpy as np
 import os
 import datetime as dt
+from collections import OrderedDict
 from decimal import Decimal
 
 from market.baselines.baselines.gail import mlp_policy
@@ -21,9 +22,8 @@ from market.baselines.baselines import logger
 from market.baselines.baselines.gail.dataset.mujoco_dset import Mujoco_Dset
 from market.baselines.baselines.gail.adversary import TransitionClassifier
 
-from market.models import sim_market, sim_stocks, sim_trades
 from market.models.clients import BaseClient
-from market import simulator_main
+from market.sim_session import SimMarketSession
 
 
 class GailArgs:
@@ -46,6 +46,8 @@ class GailArgs:
         self.traj_limitation = -1
         self.adversary_hidden_size = 64
         self.policy_hidden_size = 64
+        # 并行展开的环境数目，大于1时使用market_vec_env中的向量化环境
+        self.num_env = 1
 
     def set_args(self, seed, task, algo, g_step, d_step):
         self.seed = seed
@@ -70,9 +72,15 @@ class Enviroment:
     def __init__(self):
         self.env_id = 'Market-v0'
         self.manager = 'Amadeus'
+        self.stock = '000009.XSHE'
         self.observation_space = np.zeros((25, ))
         self.action_space = np.zeros((3, ))
         self.horizon = 1024
+        # 纯内存的市场会话，rollout过程中不访问数据库
+        self.session = None
+        # (stock, datetime) -> 锚定后的会话检查点，再次reset到同一时间时直接恢复，只保留最近使用的max_anchored个
+        self.anchored = OrderedDict()
+        self.max_anchored = 16
 
     def seed(self, seed):
         pass
@@ -81,18 +89,12 @@ class Enviroment:
         """
         目前默认标的股票是000009.XSHE
         """
-        try:
-            super_client = BaseClient.objects.get(name=self.manager)
-            assert super_client.driver is not None
-        except:
-            logger.error('Environment Reset Error.')
+        if self.session is None:
+            logger.error('Environment Step Error. Reset the environment first.')
             return False
         action = self.revert_action(action)
-        simulator_main.act_according_to_calculated_actions(super_client, [action])
-        market = sim_market.SimMarket.objects.get(id=1)
-        market.datetime = next_datetime
-        market.tick += 1
-        market.save()
+        self.session.act([action], self.stock)
+        self.session.advance(next_datetime)
         ob = self.get_ob()
         true_rew = 1.0
         new = False
@@ -100,18 +102,27 @@ class Enviroment:
         return ob, true_rew, new, None
 
     def reset(self, stock, datetime):
-        try:
-            super_client = BaseClient.objects.get(name=self.manager)
-            assert super_client.driver is not None
-        except:
-            logger.error('Environment Reset Error.')
-            return False
-        simulator_main.simulator_resetter(super_client)
-        simulator_main.anchor_one_stock(stock, datetime, super_client)
-        market = sim_market.SimMarket.objects.get(id=1)
-        market.datetime = datetime
-        market.tick = 0
-        market.save()
+        if self.session is None:
+            try:
+                super_client = BaseClient.objects.get(name=self.manager)
+                assert super_client.driver is not None
+            except:
+                logger.error('Environment Reset Error.')
+                return False
+            self.session = SimMarketSession(super_client.id)
+        self.stock = stock
+        checkpoint = self.anchored.get((stock, datetime))
+        if checkpoint is not None:
+            self.anchored.move_to_end((stock, datetime))
+            self.session.restore(checkpoint)
+        else:
+            self.session.reset()
+            self.session.anchor(stock, datetime)
+            self.session.datetime = datetime
+            self.session.tick = 0
+            self.anchored[(stock, datetime)] = self.session.checkpoint()
+            if len(self.anchored) > self.max_anchored:
+                self.anchored.popitem(last=False)
         ob = self.get_ob()
         return ob
 
@@ -120,6 +131,8 @@ class Enviroment:
 
     def set_manager(self, manager):
         self.manager = manager
+        self.session = None
+        self.anchored = OrderedDict()
 
     def set_space(self, ob_shape, ac_shape, horizon):
         self.observation_space = np.zeros((ob_shape, ))
@@ -134,10 +147,8 @@ class Enviroment:
             logger.debug(self.action_space.shape)
             raise NotImplementedError
 
-    @staticmethod
-    def revert_action(action):
+    def revert_action(self, action):
         policy_action = action.copy()
-        stock = sim_stocks.SimStock.objects.get(symbol='000009.XSHE')
         direction = np.clip(round(action[0]), 0, 2)
         if direction == 0:
             direction = 'a'
@@ -148,7 +159,7 @@ class Enviroment:
         price = np.clip(action[1], 0, 1)
         volume = np.clip(action[2], 0, 1)
 
-        level5_data = stock.get_order_book_data(level=5, to_list=True)
+        level5_data = self.session.get_order_book_data(self.stock, level=5, to_list=True)
         total_volume = 0
         for i in range(len(level5_data)):
             if i % 2 == 0:
@@ -164,16 +175,8 @@ class Enviroment:
         logger.debug('Market revert action. From {} to {}'.format(policy_action, (direction, price, vol)))
         return direction, price, vol
 
-    @staticmethod
-    def get_ob():
-        stock = sim_stocks.SimStock.objects.get(symbol='000009.XSHE')
-        ob = stock.get_order_book_data(level=5, to_list=True)
-        ob.append(stock.last_price)
-        ob.append(stock.high)
-        ob.append(stock.low)
-        ob.append(stock.volume)
-        ob.append(stock.amount)
-        return np.array(ob)
+    def get_ob(self):
+        return np.array(self.session.observe(self.stock))
 
 
 def main(args):
@@ -208,6 +211,11 @@ def main(args):
         logger.debug('Environment Set: {} Manager: {} \nob shape: {}, ac shape: {}, horizon: {}'.
                      format(env.env_id, env.manager, env.observation_space.shape, env.action_space.shape, env.horizon))
         reward_giver = TransitionClassifier(env, args.adversary_hidden_size, entcoeff=args.adversary_entcoeff)
+        venv = None
+        if args.num_env > 1:
+            from market.baselines.baselines.gail.market_vec_env import make_market_vec_env, get_expert_tracks
+            venv = make_market_vec_env('000009.XSHE', get_expert_tracks(dataset.dts, dataset.traj_length),
+                                       args.num_env, env.manager)
         train(env,
               args.seed,
               policy_fn,
@@ -223,8 +231,11 @@ def main(args):
               args.log_dir,
               args.pretrained,
               args.BC_max_iter,
-              task_name
+              task_name,
+              venv
               )
+        if venv is not None:
+            venv.close()
     elif args.task == 'evaluate':
         runner(env,
                policy_fn,
@@ -241,7 +252,7 @@ def main(args):
 
 def train(env, seed, policy_fn, reward_giver, dataset, algo,
           g_step, d_step, policy_entcoeff, num_timesteps, save_per_iter,
-          checkpoint_dir, log_dir, pretrained, BC_max_iter, task_name=None):
+          checkpoint_dir, log_dir, pretrained, BC_max_iter, task_name=None, venv=None):
 
     pretrained_weight = None
     if pretrained and (BC_max_iter > 0):
@@ -270,7 +281,7 @@ def train(env, seed, policy_fn, reward_giver, dataset, algo,
                        max_kl=0.01, cg_iters=10, cg_damping=0.1,
                        gamma=0.995, lam=0.97,
                        vf_iters=5, vf_stepsize=1e-3,
-                       task_name=task_name)
+                       task_name=task_name, venv=venv)
     else:
         raise NotImplementedError
 
@@ -88,17 +88,85 @@ def generate_traj_segment(pi, env, reward_giver, horizon, datetime_expert, stoch
             "ep_rets": ep_rets, "ep_lens": ep_lens, "ep_true_rets": ep_true_rets}
 
 
+def generate_traj_segment_vec(pi, venv, reward_giver, horizon, stochastic):
+    """
+    与generate_traj_segment相同，但在venv的num_envs个环境上同步展开horizon步，策略和判别器都按批计算。
+    返回的各数组按环境依次拼接（每个环境horizon步），nextvpred为每个环境最后一步之后的价值估计，
+    add_vtarg_and_adv对每个环境分别计算优势，被截断的最后一步以各自的nextvpred自举，不视为终止。
+    """
+    nenvs = venv.num_envs
+    ob = venv.reset()
+    ac, _ = pi.act_batch(stochastic, ob)
+    new = np.ones(nenvs, 'int32')
+
+    cur_ep_ret = np.zeros(nenvs, 'float32')
+    cur_ep_len = np.zeros(nenvs, 'int32')
+    cur_ep_true_ret = np.zeros(nenvs, 'float32')
+    ep_true_rets = []
+    ep_rets = []
+    ep_lens = []
+
+    # 历史数组，形如(horizon, nenvs, ...)
+    obs = np.zeros((horizon, ) + ob.shape, ob.dtype)
+    true_rews = np.zeros((horizon, nenvs), 'float32')
+    rews = np.zeros((horizon, nenvs), 'float32')
+    vpreds = np.zeros((horizon, nenvs), 'float32')
+    news = np.zeros((horizon, nenvs), 'int32')
+    acs = np.zeros((horizon, ) + ac.shape, ac.dtype)
+    prevacs = acs.copy()
+
+    for i in range(horizon):
+        prevac = ac
+        ac, vpred = pi.act_batch(stochastic, ob)
+        obs[i] = ob
+        vpreds[i] = vpred
+        news[i] = new
+        acs[i] = ac
+        prevacs[i] = prevac
+
+        rews[i] = np.reshape(reward_giver.get_reward(ob, ac), [-1])
+        ob, true_rew, done, _ = venv.step(ac)
+        new = done.astype('int32')
+        true_rews[i] = true_rew
+
+        cur_ep_ret += rews[i]
+        cur_ep_true_ret += true_rews[i]
+        cur_ep_len += 1
+        for e in np.flatnonzero(new):
+            ep_rets.append(cur_ep_ret[e])
+            ep_true_rets.append(cur_ep_true_ret[e])
+            ep_lens.append(cur_ep_len[e])
+            cur_ep_ret[e] = 0
+            cur_ep_true_ret[e] = 0
+            cur_ep_len[e] = 0
+
+    _, vpred = pi.act_batch(stochastic, ob)
+
+    def flatten(arr):
+        return arr.swapaxes(0, 1).reshape((-1, ) + arr.shape[2:])
+
+    return {"ob": flatten(obs), "rew": flatten(rews), "vpred": flatten(vpreds), "new": flatten(news),
+            "ac": flatten(acs), "prevac": flatten(prevacs), "nextvpred": vpred * (1 - new),
+            "ep_rets": ep_rets, "ep_lens": ep_lens, "ep_true_rets": ep_true_rets}
+
+
 def add_vtarg_and_adv(seg, gamma, lam):
-    new = np.append(seg["new"], 0)  # last element is only used for last vtarg, but we already zeroed it if last new = 1
-    vpred = np.append(seg["vpred"], seg["nextvpred"])
-    T = len(seg["rew"])
-    seg["adv"] = gaelam = np.empty(T, 'float32')
-    rew = seg["rew"]
+    # nextvpred为数组时，seg中的数组由多个环境依次拼接而成，每个环境分别计算
+    nextvpred = np.reshape(seg["nextvpred"], [-1])
+    nenvs = len(nextvpred)
+    new = np.reshape(seg["new"], (nenvs, -1))
+    # last element is only used for last vtarg, but we already zeroed it if last new = 1
+    new = np.append(new, np.zeros((nenvs, 1), new.dtype), axis=1)
+    vpred = np.append(np.reshape(seg["vpred"], (nenvs, -1)), nextvpred[:, None], axis=1)
+    rew = np.reshape(seg["rew"], (nenvs, -1))
+    T = rew.shape[1]
+    gaelam = np.empty((nenvs, T), 'float32')
     lastgaelam = 0
     for t in reversed(range(T)):
-        nonterminal = 1-new[t+1]
-        delta = rew[t] + gamma * vpred[t+1] * nonterminal - vpred[t]
-        gaelam[t] = lastgaelam = delta + gamma * lam * nonterminal * lastgaelam
+        nonterminal = 1-new[:, t+1]
+        delta = rew[:, t] + gamma * vpred[:, t+1] * nonterminal - vpred[:, t]
+        gaelam[:, t] = lastgaelam = delta + gamma * lam * nonterminal * lastgaelam
+    seg["adv"] = gaelam.reshape(-1)
     seg["tdlamret"] = seg["adv"] + seg["vpred"]
 
 
@@ -110,7 +178,7 @@ def learn(env, policy_func, reward_giver, expert_dataset, rank,
           max_kl, cg_iters, cg_damping=1e-2,
           vf_stepsize=3e-4, d_stepsize=3e-4, vf_iters=3,
           max_timesteps=0, max_episodes=0, max_iters=0,
-          callback=None
+          callback=None, venv=None
           ):
 
     writer = tf.summary.FileWriter("D:/baselines")
@@ -251,8 +319,13 @@ def learn(env, policy_func, reward_giver, expert_dataset, rank,
         ob_expert, ac_expert, datetime_expert = expert_dataset.get_next_batch(expert_dataset.traj_length)
         for _ in range(g_step):
             with timed("sampling"):
-                seg = generate_traj_segment(pi, env, reward_giver, timesteps_per_batch, datetime_expert,
-                                            stochastic=True)
+                if venv is None:
+                    seg = generate_traj_segment(pi, env, reward_giver, timesteps_per_batch, datetime_expert,
+                                                stochastic=True)
+                else:
+                    # 多个环境并行展开，每个环境的步数使总步数不少于timesteps_per_batch
+                    seg = generate_traj_segment_vec(pi, venv, reward_giver, -(-timesteps_per_batch // venv.num_envs),
+                                                    stochastic=True)
             add_vtarg_and_adv(seg, gamma, lam)
             # ob, ac, atarg, ret, td1ret = map(np.concatenate, (obs, acs, atargs, rets, td1rets))
             ob, ac, atarg, tdlamret = seg["ob"], seg["ac"], seg["adv"], seg["tdlamret"]
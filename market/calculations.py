@@ -7,26 +7,104 @@
 """
 
 
-import sympy
 from decimal import Decimal
 from random import shuffle
 
-from .models import sim_market, sim_stocks
-from .models.utils import get_int_from_timestamp
+import numpy as np
+
+from .models import sim_market
+from .models.utils import get_int_from_timestamp, price_to_cents
+from .models.sim_tick_store import get_tick_columns
 from .baselines.baselines import logger
 
 
-def calc_tick_action(cur_datetime):
-    cur_int_datetime = get_int_from_timestamp(cur_datetime)
-    if str(cur_int_datetime)[9:11] == '91' or str(cur_int_datetime)[9:11] == '92' or str(cur_int_datetime)[9:12] == '457' \
-            or str(cur_int_datetime)[9:12] == '458' or str(cur_int_datetime)[9:12] == '459':
+# 求解逻辑的版本，修改求解或推导交易动作的逻辑后须增加，使预先计算的交易动作失效
+SOLVER_VERSION = 1
+
+
+def is_call_auction_time(cur_datetime):
+    """
+    判断是否处于开盘(9:15-9:29)或收盘(14:57之后)的集合竞价时段
+    """
+    cur_int_datetime = str(get_int_from_timestamp(cur_datetime))
+    return cur_int_datetime[9:11] == '91' or cur_int_datetime[9:11] == '92' or cur_int_datetime[9:12] == '457' \
+        or cur_int_datetime[9:12] == '458' or cur_int_datetime[9:12] == '459'
+
+
+def solve_tick_trades_batch(prices, num_prices, amounts, volumes, integer=False):
+    """
+    批量求解每个tick的成交方程组 sum(p_i * x_i) = amount, sum(x_i) = volume, x_i >= 0，
+    每个tick至多两个未知价格，全部以分为单位做整数运算，两个未知数时直接使用闭式解
+    :param prices: shape (N, 2)，每个tick的候选成交价（分），升序，只有一个价格时第二列被忽略
+    :param num_prices: shape (N, )，每个tick的候选价格数目，1或2
+    :param amounts: shape (N, )，每个tick的成交额（分）
+    :param volumes: shape (N, )，每个tick的成交量
+    :param integer: 是否要求整数解，否则非整数解向零取整
+    :return: (vols, solved)，vols shape (N, 2)为各价格的成交量，solved shape (N, )标记是否有非负解
+    """
+    prices = np.asarray(prices, dtype=np.int64).reshape(-1, 2)
+    num_prices = np.asarray(num_prices, dtype=np.int64)
+    amounts = np.asarray(amounts, dtype=np.int64)
+    volumes = np.asarray(volumes, dtype=np.int64)
+    low, high = prices[:, 0], prices[:, 1]
+    vols = np.zeros(prices.shape, dtype=np.int64)
+
+    # 只有一个价格，方程组超定，成交额须恰好等于价格乘成交量
+    single = num_prices == 1
+    solved_single = single & (volumes >= 0) & (low * volumes == amounts)
+    vols[single, 0] = volumes[single]
+
+    # 两个价格，x_low = (p_high * V - A) / (p_high - p_low)
+    pair = num_prices == 2
+    denominator = np.where(pair, high - low, 1)
+    numerator = np.where(pair, high * volumes - amounts, 0)
+    solved_pair = pair & (denominator > 0) & (numerator >= 0) & (numerator <= denominator * volumes)
+    if integer:
+        solved_pair &= numerator % denominator == 0
+    low_vols = numerator // denominator
+    high_vols = volumes + (-numerator // denominator)
+    vols[pair, 0] = low_vols[pair]
+    vols[pair, 1] = high_vols[pair]
+
+    solved = solved_single | solved_pair
+    vols[~solved] = 0
+    return vols, solved
+
+
+def solve_tick_trades(coefficients, delta_amount, delta_volume, integer=False):
+    """
+    求解单个tick的成交方程组
+    :param coefficients: 升序的候选成交价，Decimal
+    :return: 各价格对应的成交量列表，无非负解时返回None，未知数超过两个时方程组不定，同样返回None
+    """
+    if len(coefficients) == 0 or len(coefficients) > 2:
         return None
-    actions = []
+    prices = [price_to_cents(price) for price in coefficients]
+    prices.extend([0] * (2 - len(prices)))
+    vols, solved = solve_tick_trades_batch([prices], [len(coefficients)], [int(round(delta_amount * 100))],
+                                           [delta_volume], integer=integer)
+    if not solved[0]:
+        return None
+    return [int(vol) for vol in vols[0, :len(coefficients)]]
+
+
+class TickCalculation:
+    """
+    一对相邻tick截面计算交易动作时所需的中间数据
+    """
+    __slots__ = ('datetime', 'cur_ask5', 'cur_bid5', 'next_ask5', 'next_bid5', 'next_last',
+                 'cur_dic_ask5', 'cur_dic_bid5', 'next_dic_ask5', 'next_dic_bid5', 'gap_dic_ask5', 'gap_dic_bid5',
+                 'delta_volume', 'delta_amount', 'coefficients')
+
+
+def prepare_tick_calculation(cur_datetime, cur_stick_snap, next_tick_snap):
+    """
+    读取两个相邻tick截面的信息，确定可能形成交易的价格（方程的系数）
+    """
+    tick = TickCalculation()
+    tick.datetime = cur_datetime
 
     # 先读取需要的数据信息
-    cur_stick_snap = sim_stocks.SimStockSlice.objects.filter(stock_symbol='000009.XSHE', datetime=cur_datetime)
-    if cur_stick_snap.exists():
-        cur_stick_snap = cur_stick_snap[0]
     cur_high = cur_stick_snap.high
     cur_low = cur_stick_snap.low
     cur_volume = cur_stick_snap.volume
@@ -42,10 +120,6 @@ def calc_tick_action(cur_datetime):
         gap_dic_ask5[cur_ask5[i][0]] = cur_ask5[i][1]
         gap_dic_bid5[cur_bid5[i][0]] = cur_bid5[i][1]
 
-    next_tick_snap = sim_stocks.SimStockSlice.objects.filter(id=cur_stick_snap.id + 1)
-    if not next_tick_snap.exists():
-        return
-    next_tick_snap = next_tick_snap[0]
     next_last = next_tick_snap.last_price
     next_high = next_tick_snap.high
     next_low = next_tick_snap.low
@@ -99,18 +173,34 @@ def calc_tick_action(cur_datetime):
 
     coefficients = list(coefficients)
     coefficients.sort()
-    constants_coefficients = [1] * len(coefficients)
-    A = sympy.Matrix([coefficients, constants_coefficients])
-    B = sympy.Matrix([delta_amount, delta_volume])
-    x = sympy.Matrix(sympy.symarray('x', len(coefficients), negative=False))
-    # print('寻找actions，正在尝试解出Ax=B... A: {} x: {} B: {} '.format(A, x, B))
-    result = sympy.solve(A * x - B)
+
+    tick.cur_ask5, tick.cur_bid5, tick.next_ask5, tick.next_bid5 = cur_ask5, cur_bid5, next_ask5, next_bid5
+    tick.next_last = next_last
+    tick.cur_dic_ask5, tick.cur_dic_bid5 = cur_dic_ask5, cur_dic_bid5
+    tick.next_dic_ask5, tick.next_dic_bid5 = next_dic_ask5, next_dic_bid5
+    tick.gap_dic_ask5, tick.gap_dic_bid5 = gap_dic_ask5, gap_dic_bid5
+    tick.delta_volume, tick.delta_amount = delta_volume, delta_amount
+    tick.coefficients = coefficients
+    return tick
+
+
+def solve_tick_calculation(tick, result=None):
+    """
+    求解一个tick的成交量，无解时扩展系数重新计算
+    :param result: 已经批量求得的首次求解结果，为None时在此求解
+    :return: 各系数价格对应的成交量，无法计算时返回None
+    """
+    cur_ask5, cur_bid5 = tick.cur_ask5, tick.cur_bid5
+    coefficients = tick.coefficients
+    if result is None:
+        result = solve_tick_trades(coefficients, tick.delta_amount, tick.delta_volume)
 
     # 计算不出结果时，扩展系数重新计算，先扩展大价格方向
+    # 系数超过两个时方程组不定，结果必然被舍弃，因此不再求解
     append_direction = 1
     failed = 0
     gap_added = False
-    while len(result) == 0:
+    while result is None and len(coefficients) <= 2:
 
         failed += 1
         if failed >= 3:
@@ -139,11 +229,7 @@ def calc_tick_action(cur_datetime):
             coefficients.insert(0, Decimal(coefficients[0] - Decimal(0.01)).quantize(Decimal('0.00')))
             append_direction = 1
 
-        constants_coefficients = [1] * len(coefficients)
-        A = sympy.Matrix([coefficients, constants_coefficients])
-        x = sympy.Matrix(sympy.symarray('x', len(coefficients), integer=True, negative=False))
-        # print('寻找actions，正在尝试解出Ax=B... A: {} x: {} B: {}'.format(A, x, B))
-        result = sympy.solve(A * x - B)
+        result = solve_tick_trades(coefficients, tick.delta_amount, tick.delta_volume, integer=True)
 
     if len(coefficients) <= 2:
         # 系数矩阵和增广矩阵秩都为2，可得唯一解
@@ -151,21 +237,124 @@ def calc_tick_action(cur_datetime):
         pass
     elif len(coefficients) == 3:
         # 得到通解，自由变量数目为1
-        logger.info('{} Calculated. Result: {} (prices {})'.format(str(cur_datetime), result, coefficients))
+        logger.info('{} Underdetermined. (prices {})'.format(str(tick.datetime), coefficients))
         return None
     else:
         # 自由变量数目太多，舍弃
-        logger.info('{} Too Much Coefficients. Unable to calculate.'.format(str(cur_datetime)))
+        logger.info('{} Too Much Coefficients. Unable to calculate.'.format(str(tick.datetime)))
         return None
     logger.debug('Actions Calculated: {}'.format(result))
+    if result is None:
+        result = []
+    return result
+
+
+def calc_tick_action(symbol, cur_datetime, cur_slice=None, next_slice=None, rng=None):
+    """
+    根据相邻两个tick截面计算出该tick内的交易动作
+    :param symbol: 股票代码
+    :param cur_datetime: 当前tick的时间
+    :param cur_slice: 当前tick截面，为None时从数据库读取
+    :param next_slice: 下一tick截面，为None时从数据库读取
+    :param rng: 打乱交易动作所用的随机数，见arrange_tick_actions
+    """
+    if is_call_auction_time(cur_datetime):
+        return None
+
+    # 先读取需要的数据信息，未给出的截面从列式tick数据中读取
+    if cur_slice is None or next_slice is None:
+        tick_columns = get_tick_columns(symbol)
+        index = tick_columns.index_of(cur_datetime)
+        if index is None or index + 1 >= len(tick_columns):
+            return
+        if cur_slice is None:
+            cur_slice = tick_columns.to_slice(index)
+        if next_slice is None:
+            next_slice = tick_columns.to_slice(index + 1)
+
+    tick = prepare_tick_calculation(cur_datetime, cur_slice, next_slice)
+    result = solve_tick_calculation(tick)
+    if result is None:
+        return None
+    return derive_tick_actions(tick, result, rng)
+
+
+def calc_tick_actions_batch(slices, arranged=True):
+    """
+    批量计算一段连续tick截面（如一整天）的交易动作，首次求解对全部tick一次性向量化完成
+    :param slices: 同一股票按时间排序的连续截面
+    :param arranged: 是否打乱交易动作的顺序，为False时每项为尚未打乱的(actions, action_locked, delta_volume)
+    :return: 长度为len(slices) - 1的列表，第i项为slices[i]到slices[i + 1]的交易动作（或None）
+    """
+    ticks = []
+    for i in range(len(slices) - 1):
+        if is_call_auction_time(slices[i].datetime):
+            ticks.append(None)
+        else:
+            ticks.append(prepare_tick_calculation(slices[i].datetime, slices[i], slices[i + 1]))
+
+    # 首次求解：系数不超过两个的tick放在一起向量化求解
+    batch = [i for i, tick in enumerate(ticks) if tick is not None and 0 < len(tick.coefficients) <= 2]
+    first_results = {}
+    if batch:
+        prices = np.zeros((len(batch), 2), dtype=np.int64)
+        num_prices = np.zeros(len(batch), dtype=np.int64)
+        amounts = np.zeros(len(batch), dtype=np.int64)
+        volumes = np.zeros(len(batch), dtype=np.int64)
+        for row, i in enumerate(batch):
+            coefficients = ticks[i].coefficients
+            num_prices[row] = len(coefficients)
+            for col, price in enumerate(coefficients):
+                prices[row, col] = price_to_cents(price)
+            amounts[row] = int(round(ticks[i].delta_amount * 100))
+            volumes[row] = ticks[i].delta_volume
+        vols, solved = solve_tick_trades_batch(prices, num_prices, amounts, volumes)
+        for row, i in enumerate(batch):
+            if solved[row]:
+                first_results[i] = [int(vol) for vol in vols[row, :num_prices[row]]]
+
+    all_actions = []
+    for i, tick in enumerate(ticks):
+        if tick is None:
+            all_actions.append(None)
+            continue
+        result = solve_tick_calculation(tick, first_results.get(i))
+        if result is None:
+            all_actions.append(None)
+        elif arranged:
+            all_actions.append(derive_tick_actions(tick, result))
+        else:
+            actions, action_locked = aggregate_tick_actions(tick, result)
+            all_actions.append((actions, action_locked, tick.delta_volume))
+    return all_actions
+
+
+def derive_tick_actions(tick, result, rng=None):
+    """
+    根据求得的成交量，推导出使order book与下一tick吻合的全部交易动作
+    """
+    actions, action_locked = aggregate_tick_actions(tick, result)
+    return arrange_tick_actions(tick.datetime, actions, action_locked, tick.delta_volume, rng)
+
+
+def aggregate_tick_actions(tick, result):
+    """
+    推导并聚合交易动作，尚未打乱顺序
+    :return: (actions, action_locked)，action_locked为须放在最后、形成最新价的交易动作，可能为None
+    """
+    coefficients = tick.coefficients
+    next_last = tick.next_last
+    next_ask5, next_bid5 = tick.next_ask5, tick.next_bid5
+    cur_dic_ask5, cur_dic_bid5 = tick.cur_dic_ask5, tick.cur_dic_bid5
+    next_dic_ask5, next_dic_bid5 = tick.next_dic_ask5, tick.next_dic_bid5
+    gap_dic_ask5, gap_dic_bid5 = tick.gap_dic_ask5, tick.gap_dic_bid5
+    actions = []
 
     # 计算出交易动作
     trades = {}
-    index = 0
-    for key in result:
-        if int(result[key]) != 0:
-            trades[coefficients[index]] = int(result[key])
-        index += 1
+    for price, vol in zip(coefficients, result):
+        if vol != 0:
+            trades[price] = vol
     for price in trades.keys():
         if price in cur_dic_ask5.keys():
             actions.append(('b', price, trades[price]))
@@ -313,7 +502,19 @@ def calc_tick_action(cur_datetime):
     for cancel_price in cancel_actions.keys():
         if cancel_actions[cancel_price] != 0:
             actions.append(('c', cancel_price, cancel_actions[cancel_price]))
-    shuffle(actions)
+    return actions, action_locked
+
+
+def arrange_tick_actions(cur_datetime, actions, action_locked, delta_volume, rng=None):
+    """
+    随机打乱交易动作的顺序，形成最新价的交易动作放在最后
+    :param rng: random.Random，为None时使用全局的随机数
+    """
+    actions = list(actions)
+    if rng is None:
+        shuffle(actions)
+    else:
+        rng.shuffle(actions)
     if action_locked is None:
         if delta_volume != 0:
             logger.warn('**********Trade actions Does not cover Last Price.**********')
@@ -321,7 +522,3 @@ def calc_tick_action(cur_datetime):
         actions.append(action_locked)
     logger.debug('Datetime {}, Finally Returned Actions: {}\n'.format(cur_datetime, actions))
     return actions
-
-
-
-
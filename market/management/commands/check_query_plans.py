@@ -0,0 +1,62 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from market.models.sim_stocks import SimStock, SimStockSlice, SimStockDailyInfo, SimOrderBookEntry, \
+    SimOrderBookElem, SimTradeHistory
+from market.models.sim_clients import SimHoldingElem, SimCommissionElem, SimTransactionElem
+
+
+SYMBOL = '000009.XSHE'
+DATETIME = dt.datetime(2018, 1, 2, 9, 30, 3)
+
+
+def get_hot_queries():
+    """
+    模拟器热点路径上的查询，参数只用于生成查询计划
+    :return: [(名称, QuerySet)]，删除/更新语句以相同条件的查询代替
+    """
+    return [
+        ('SimStock by symbol', SimStock.objects.filter(symbol=SYMBOL)),
+        ('SimStockSlice by datetime', SimStockSlice.objects.filter(stock_symbol=SYMBOL, datetime=DATETIME)),
+        ('SimStockSlice range', SimStockSlice.objects.filter(stock_symbol=SYMBOL, datetime__gte=DATETIME,
+                                                             datetime__lte=DATETIME + dt.timedelta(days=1))),
+        ('SimStockDailyInfo by symbol', SimStockDailyInfo.objects.filter(stock_symbol=SYMBOL, date__lt=DATETIME.date())),
+        ('SimOrderBookEntry by symbol', SimOrderBookEntry.objects.filter(stock_symbol=SYMBOL)),
+        ('SimOrderBookEntry by price', SimOrderBookEntry.objects.filter(stock_symbol=SYMBOL, entry_direction='a',
+                                                                        entry_price=7)),
+        ('SimOrderBookElem by entries', SimOrderBookElem.objects.filter(entry_belonged__in=[1, 2, 3])),
+        ('SimOrderBookElem by id', SimOrderBookElem.objects.filter(unique_id=1)),
+        ('SimHoldingElem by owner and symbol', SimHoldingElem.objects.filter(owner=1, stock_symbol=SYMBOL)),
+        ('SimHoldingElem by owner', SimHoldingElem.objects.filter(owner=1)),
+        ('SimCommissionElem by id', SimCommissionElem.objects.filter(unique_id=1)),
+        ('SimCommissionElem by ids', SimCommissionElem.objects.filter(unique_id__in=[1, 2, 3])),
+        ('SimCommissionElem by owner', SimCommissionElem.objects.filter(owner=1)),
+        ('SimTransactionElem by owner', SimTransactionElem.objects.filter(one_side=1)),
+        ('SimTradeHistory by symbol', SimTradeHistory.objects.filter(stock_symbol=SYMBOL).order_by('tick', 'id')),
+    ]
+
+
+def find_full_scans(plan):
+    """
+    从SQLite的EXPLAIN QUERY PLAN结果中找出全表扫描，使用索引的扫描（SCAN ... USING INDEX）不算在内
+    """
+    return [line for line in plan.splitlines() if ' SCAN ' in ' ' + line + ' ' and 'USING' not in line]
+
+
+class Command(BaseCommand):
+    help = '记录模拟器热点查询的查询计划，存在全表扫描时报错'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Only sqlite query plans are checked, current database: {}.'.format(connection.vendor))
+        full_scans = []
+        for name, queryset in get_hot_queries():
+            plan = queryset.explain()
+            self.stdout.write('{}:\n{}\n'.format(name, plan))
+            if find_full_scans(plan):
+                full_scans.append(name)
+        if full_scans:
+            raise CommandError('Full table scans in: {}.'.format(', '.join(full_scans)))
+        self.stdout.write('{} queries checked, no full table scans.'.format(len(get_hot_queries())))
@@ -0,0 +1,35 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.models.sim_import import import_stock_data, IMPORT_BATCH_SIZE
+
+
+def parse_datetime(value):
+    for datetime_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return dt.datetime.strptime(value, datetime_format)
+        except ValueError:
+            continue
+    raise CommandError('Invalid datetime: {}, expected "YYYY-mm-dd[ HH:MM:SS]".'.format(value))
+
+
+class Command(BaseCommand):
+    help = '将HDF5 tick数据导入模拟器'
+
+    def add_arguments(self, parser):
+        parser.add_argument('symbol', help='股票代码，如000009.XSHE')
+        parser.add_argument('start', help='起始时间，YYYY-mm-dd[ HH:MM:SS]')
+        parser.add_argument('end', help='截止时间，YYYY-mm-dd[ HH:MM:SS]')
+        parser.add_argument('--interval', choices=['t', 'm'], default='t', help='数据级别，t: tick，m: minute')
+        parser.add_argument('--path', default=None, help='HDF5文件路径，默认为market/data/<symbol>')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        start = parse_datetime(options['start'])
+        end = parse_datetime(options['end'])
+        if options['end'].find(':') < 0:
+            # 只给出日期时，包含截止日当天
+            end = end + dt.timedelta(days=1) - dt.timedelta(seconds=1)
+        import_stock_data(options['symbol'], start, end, options['interval'], path=options['path'],
+                          batch_size=options['batch_size'])
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from market.action_cache import precompute_tick_actions
+from .import_stock_data import parse_datetime
+
+
+class Command(BaseCommand):
+    help = '预先计算每个tick的交易动作并写入缓存'
+
+    def add_arguments(self, parser):
+        parser.add_argument('symbol', help='股票代码，如000009.XSHE')
+        parser.add_argument('--start', default=None, help='起始时间，YYYY-mm-dd[ HH:MM:SS]，默认为第一个截面')
+        parser.add_argument('--end', default=None, help='截止时间，YYYY-mm-dd[ HH:MM:SS]，默认为最后一个截面')
+
+    def handle(self, *args, **options):
+        start = parse_datetime(options['start']) if options['start'] else None
+        end = parse_datetime(options['end']) if options['end'] else None
+        precompute_tick_actions(options['symbol'], start, end)
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-18 21:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimCommissionRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_symbol', models.CharField(max_length=12)),
+                ('commit_client', models.IntegerField(verbose_name='委托的client的ID')),
+                ('commit_direction', models.CharField(default='b', max_length=1)),
+                ('commit_price', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('commit_vol', models.IntegerField(default=0)),
+                ('commit_date', models.DateTimeField(blank=True, null=True)),
+                ('commission_to_cancel', models.UUIDField(blank=True, null=True, verbose_name='委托取消的目标委托本身的uuid')),
+            ],
+        ),
+        migrations.DeleteModel(
+            name='SimCommissionMsg',
+        ),
+        migrations.DeleteModel(
+            name='SimTradeMsg',
+        ),
+        migrations.AlterModelOptions(
+            name='simstockslice',
+            options={'ordering': ['stock_symbol', 'datetime']},
+        ),
+    ]
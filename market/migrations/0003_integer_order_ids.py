@@ -0,0 +1,94 @@
+# Generated by Django 2.2.28 on 2026-10-18 21:22
+
+from django.db import migrations, models
+
+
+def assign_order_ids(apps, schema_editor):
+    """
+    按委托的先后为已有的委托和挂单分配整数编号，同一个uuid的委托与挂单得到相同的编号
+    """
+    SimCommissionElem = apps.get_model('market', 'SimCommissionElem')
+    SimOrderBookElem = apps.get_model('market', 'SimOrderBookElem')
+    SimCommissionRecord = apps.get_model('market', 'SimCommissionRecord')
+
+    order_ids = {}
+    for model in (SimCommissionElem, SimOrderBookElem):
+        for unique_id in model.objects.order_by('date_committed', 'id').values_list('unique_id', flat=True):
+            if unique_id not in order_ids:
+                order_ids[unique_id] = len(order_ids) + 1
+    for model in (SimCommissionElem, SimOrderBookElem):
+        for element in model.objects.all():
+            element.order_id = order_ids[element.unique_id]
+            element.save(update_fields=['order_id'])
+    # 审计记录中已不存在的委托无法对应，置为空
+    for record in SimCommissionRecord.objects.exclude(commission_to_cancel=None):
+        record.cancel_order_id = order_ids.get(record.commission_to_cancel)
+        record.save(update_fields=['cancel_order_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0002_sim_message_value_objects'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simcommissionelem',
+            name='order_id',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='simorderbookelem',
+            name='order_id',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='simcommissionrecord',
+            name='cancel_order_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(assign_order_ids, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='simcommissionelem',
+            name='unique_id',
+        ),
+        migrations.RemoveField(
+            model_name='simorderbookelem',
+            name='unique_id',
+        ),
+        migrations.RemoveField(
+            model_name='simcommissionrecord',
+            name='commission_to_cancel',
+        ),
+        migrations.RenameField(
+            model_name='simcommissionelem',
+            old_name='order_id',
+            new_name='unique_id',
+        ),
+        migrations.RenameField(
+            model_name='simorderbookelem',
+            old_name='order_id',
+            new_name='unique_id',
+        ),
+        migrations.RenameField(
+            model_name='simcommissionrecord',
+            old_name='cancel_order_id',
+            new_name='commission_to_cancel',
+        ),
+        migrations.AlterField(
+            model_name='simcommissionelem',
+            name='unique_id',
+            field=models.BigIntegerField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='simcommissionrecord',
+            name='commission_to_cancel',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='委托取消的目标委托的编号'),
+        ),
+        migrations.AlterField(
+            model_name='simorderbookelem',
+            name='unique_id',
+            field=models.BigIntegerField(db_index=True),
+        ),
+    ]
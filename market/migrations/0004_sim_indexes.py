@@ -0,0 +1,131 @@
+# Generated by Django 2.2.28 on 2026-10-18 21:23
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+PRICE_QUANTUM = Decimal('0.01')
+
+
+def keep_latest(model, *fields):
+    """
+    同一组fields只保留id最大（最后导入）的一行，其余删除
+    """
+    seen = set()
+    stale = []
+    for row in model.objects.order_by('-id').values_list('id', *fields):
+        if row[1:] in seen:
+            stale.append(row[0])
+        else:
+            seen.add(row[1:])
+    for k in range(0, len(stale), 500):
+        model.objects.filter(id__in=stale[k:k + 500]).delete()
+
+
+def dedupe_sim_data(apps, schema_editor):
+    """
+    添加唯一约束之前合并已有的重复数据：
+    重复导入产生的行情截面和日线只保留最后一次导入的，重复的股票保留最后一行；
+    同一client同一股票的多条持仓合并为一条，数量相加，成本价按数量加权；
+    同一价格的多个order book条目合并为一个，挂单改挂到保留的条目上。
+    委托与挂单的编号由0003按uuid分配，同一张表中不会重复，不需处理
+    """
+    SimStock = apps.get_model('market', 'SimStock')
+    SimStockSlice = apps.get_model('market', 'SimStockSlice')
+    SimStockDailyInfo = apps.get_model('market', 'SimStockDailyInfo')
+    SimHoldingElem = apps.get_model('market', 'SimHoldingElem')
+    SimOrderBookEntry = apps.get_model('market', 'SimOrderBookEntry')
+    SimOrderBookElem = apps.get_model('market', 'SimOrderBookElem')
+
+    keep_latest(SimStock, 'symbol')
+    keep_latest(SimStockSlice, 'stock_symbol', 'datetime')
+    keep_latest(SimStockDailyInfo, 'stock_symbol', 'date')
+
+    kept = {}
+    for holding in SimHoldingElem.objects.order_by('date_bought', 'id'):
+        key = (holding.owner, holding.stock_symbol)
+        target = kept.get(key)
+        if target is None:
+            kept[key] = holding
+            continue
+        vol = target.vol + holding.vol
+        if vol > 0:
+            target.cost = Decimal((target.cost * target.vol + holding.cost * holding.vol) / vol).quantize(PRICE_QUANTUM)
+        target.price_guaranteed = target.cost
+        target.vol = vol
+        target.frozen_vol += holding.frozen_vol
+        target.available_vol += holding.available_vol
+        target.profit += holding.profit
+        target.value += holding.value
+        target.save()
+        holding.delete()
+
+    kept = {}
+    for entry in SimOrderBookEntry.objects.order_by('id'):
+        key = (entry.stock_symbol, entry.entry_direction, entry.entry_price)
+        target = kept.get(key)
+        if target is None:
+            kept[key] = entry
+            continue
+        SimOrderBookElem.objects.filter(entry_belonged=entry.id).update(entry_belonged=target.id)
+        target.total_vol += entry.total_vol
+        target.save()
+        entry.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0003_integer_order_ids'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_sim_data, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='simcommissionelem',
+            name='unique_id',
+            field=models.BigIntegerField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='simorderbookelem',
+            name='unique_id',
+            field=models.BigIntegerField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='simstock',
+            name='symbol',
+            field=models.CharField(max_length=12, unique=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='simholdingelem',
+            unique_together={('owner', 'stock_symbol')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='simorderbookentry',
+            unique_together={('stock_symbol', 'entry_direction', 'entry_price')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='simstockdailyinfo',
+            unique_together={('stock_symbol', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='simstockslice',
+            unique_together={('stock_symbol', 'datetime')},
+        ),
+        migrations.AddIndex(
+            model_name='simcommissionelem',
+            index=models.Index(fields=['owner', 'stock_symbol'], name='sim_commission_owner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='simorderbookelem',
+            index=models.Index(fields=['entry_belonged', 'date_committed'], name='sim_ob_elem_entry_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='simtradehistory',
+            index=models.Index(fields=['stock_symbol', 'tick'], name='sim_trade_symbol_tick_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='simtransactionelem',
+            index=models.Index(fields=['one_side', 'date_traded'], name='sim_transaction_side_idx'),
+        ),
+    ]
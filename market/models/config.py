@@ -1,7 +1,14 @@
+from decimal import Decimal
+
 # PRICE CONFIG
 # Maximum price allowed: 999.99
 MAX_DIGITS = 5
 DECIMAL_PLACES = 2
+PRICE_QUANTUM = Decimal(1).scaleb(-DECIMAL_PLACES)  # 0.01
+
+# 内存中的模拟会话是否以分为单位的整数表示价格，见SimMarketSession
+# 基于数据库的撮合与结算（sim_trades）不受影响，始终使用Decimal
+INTEGER_PRICE_TICKS = False
 
 # Default holding created (virtual stock)
 DEFAULT_HOLD_SYMBOL = '009999.XSHG'
@@ -14,6 +21,10 @@ CASH = 10000000000
 
 # tax
 TAX_RATE = 0.002
+TAX_FACTOR = Decimal(1 + TAX_RATE)  # 冻结资金时计入税费的系数
 
+# 是否将处理过的委托批量写入SimCommissionRecord，用于审计
+RECORD_COMMISSIONS = False
 
-
+# 内存中成交记录（SimTradeTape）的容量，写满时批量写入SimTradeHistory
+TRADE_TAPE_SIZE = 4096
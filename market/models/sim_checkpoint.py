@@ -0,0 +1,96 @@
+# _*_ coding:UTF-8 _*_
+
+"""
+该文件定义了基于数据库的模拟器状态的检查点。
+检查点记录市场时钟、下一个挂单编号、全部股票的状态、处于集合竞价期间的股票、client的资金、虚拟client，
+以及模拟器各表（持仓、委托、成交、order book、交易历史）的全部行，
+每个表保存为字段名与值元组的列表，可以留在内存中反复恢复，也可以用save_checkpoint写入磁盘。
+恢复时清空这些表后批量写回，不经过撮合流程，所需的语句数与状态的规模无关。
+"""
+
+import pickle
+
+from django.db import transaction
+
+from .clients import BaseClient
+from .sim_market import SimMarket
+from .sim_stocks import SimStock
+from .sim_order_book import flush_order_books, discard_order_books, peek_next_order_id, set_next_order_id, \
+    get_order_book, get_auction_symbols
+from .sim_trade_tape import flush_trade_tapes, discard_trade_tapes
+from .sim_risk import discard_risk_view
+from .sim_trades import flush_commission_records
+from .sim_reset import RESET_MODELS, flush_simulation_tables
+
+# 检查点中记录的股票状态与client资金
+STOCK_STATE_FIELDS = ('last_price', 'low', 'high', 'limit_up', 'limit_down', 'volume', 'amount')
+CLIENT_CASH_FIELDS = ('cash', 'frozen_cash', 'flexible_cash', 'profit')
+MARKET_FIELDS = ('datetime', 'anchored_datetime', 'tick', 'num_v_clients')
+
+
+def get_field_names(model):
+    return tuple(field.attname for field in model._meta.concrete_fields)
+
+
+def dump_rows(queryset, fields):
+    return fields, list(queryset.order_by('id').values_list(*fields))
+
+
+def checkpoint_simulation():
+    """
+    记录当前的模拟器状态，内存中的order book、成交记录与委托的审计记录先写回数据库
+    :return: 检查点，一个只包含基本类型的dict
+    """
+    flush_order_books()
+    flush_trade_tapes()
+    flush_commission_records()
+    market = SimMarket.objects.filter(id=1).values(*MARKET_FIELDS).first()
+    return {
+        'market': market,
+        'next_order_id': peek_next_order_id(),
+        'auctions': get_auction_symbols(),
+        'stocks': dump_rows(SimStock.objects.all(), ('id', ) + STOCK_STATE_FIELDS),
+        'clients': dump_rows(BaseClient.objects.exclude(driver=None), ('id', ) + CLIENT_CASH_FIELDS),
+        'virtual_clients': dump_rows(BaseClient.objects.filter(driver=None), get_field_names(BaseClient)),
+        'tables': dict((model._meta.label, dump_rows(model.objects.all(), get_field_names(model)))
+                       for model in RESET_MODELS),
+    }
+
+
+def load_rows(model, rows):
+    fields, values = rows
+    return [model(**dict(zip(fields, value))) for value in values]
+
+
+def restore_simulation(checkpoint):
+    """
+    将模拟器恢复到检查点的状态，检查点本身不会被修改，可以多次恢复
+    """
+    with transaction.atomic():
+        flush_simulation_tables()
+        for model in RESET_MODELS:
+            model.objects.bulk_create(load_rows(model, checkpoint['tables'][model._meta.label]))
+        # 虚拟client的注册时间（auto_now_add）会被更新为恢复的时间
+        BaseClient.objects.bulk_create(load_rows(BaseClient, checkpoint['virtual_clients']))
+        BaseClient.objects.bulk_update(load_rows(BaseClient, checkpoint['clients']), CLIENT_CASH_FIELDS)
+        SimStock.objects.bulk_update(load_rows(SimStock, checkpoint['stocks']), STOCK_STATE_FIELDS)
+        if checkpoint['market'] is not None:
+            SimMarket.objects.filter(id=1).update(**checkpoint['market'])
+    discard_order_books()
+    discard_trade_tapes()
+    discard_risk_view()
+    set_next_order_id(checkpoint['next_order_id'])
+    for symbol in checkpoint.get('auctions', ()):
+        get_order_book(symbol).auction = True
+    return True
+
+
+def save_checkpoint(checkpoint, path):
+    with open(path, 'wb') as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return True
+
+
+def load_checkpoint(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
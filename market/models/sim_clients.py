@@ -6,7 +6,6 @@
 """
 
 from django.db import models
-import uuid
 from .config import *
 
 
@@ -37,6 +36,7 @@ class SimHoldingElem(models.Model):
 
     class Meta:
         ordering = ['owner', '-date_bought', 'id']
+        unique_together = ('owner', 'stock_symbol')
 
     def __str__(self):
         return self.stock_symbol + '-' + str(self.vol) + 'shares'
@@ -48,7 +48,7 @@ class SimCommissionElem(models.Model):
     """
     owner = models.IntegerField()  # 委托者的ID
     stock_symbol = models.CharField(max_length=12)  # 股票代码
-    unique_id = models.UUIDField(blank=False, default=uuid.uuid4)
+    unique_id = models.BigIntegerField(unique=True)  # 委托编号，与order book中的挂单相同
 
     # date info
     date_committed = models.DateTimeField()
@@ -68,6 +68,7 @@ class SimCommissionElem(models.Model):
 
     class Meta:
         ordering = ['owner', '-date_committed']
+        indexes = [models.Index(fields=['owner', 'stock_symbol'], name='sim_commission_owner_idx')]
 
     def __str__(self):
         return self.stock_symbol + '-' + self.operation + '-' + str(self.vol_committed) + 'shares'
@@ -97,6 +98,7 @@ class SimTransactionElem(models.Model):
 
     class Meta:
         ordering = ['one_side', '-date_traded']
+        indexes = [models.Index(fields=['one_side', 'date_traded'], name='sim_transaction_side_idx')]
 
     def __str__(self):
         return str(self.one_side) + self.operation + '-' + self.stock_symbol + '-' + str(self.vol_traded) + 'shares'
@@ -0,0 +1,158 @@
+# _*_ coding:UTF-8 _*_
+
+"""
+该文件定义了将HDF5 tick数据导入模拟器的流程。
+时间转换、集合竞价与分钟级别的过滤、日级别信息的计算都以numpy数组整体完成，截面以bulk_create分批写入。
+"""
+
+import os
+import time
+import datetime as dt
+
+import numpy as np
+from django.db import connection, transaction
+
+from .sim_stocks import SimStock, SimStockSlice, SimStockDailyInfo
+from .sim_tick_store import invalidate_tick_columns
+from .utils import TickTable, get_int_from_timestamp, int_to_datetime64
+
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+IMPORT_BATCH_SIZE = 5000
+# 每次从HDF5文件中读取的记录数，按交易日对齐
+IMPORT_CHUNK_SIZE = 200000
+
+# TickTable中的字段 -> SimStockSlice中的字段
+SLICE_FIELDS = {'last': 'last_price', 'high': 'high', 'low': 'low', 'volume': 'volume', 'amount': 'amount',
+                'a1': 'a1', 'a2': 'a2', 'a3': 'a3', 'a4': 'a4', 'a5': 'a5',
+                'b1': 'b1', 'b2': 'b2', 'b3': 'b3', 'b4': 'b4', 'b5': 'b5',
+                'a1_v': 'a1_v', 'a2_v': 'a2_v', 'a3_v': 'a3_v', 'a4_v': 'a4_v', 'a5_v': 'a5_v',
+                'b1_v': 'b1_v', 'b2_v': 'b2_v', 'b3_v': 'b3_v', 'b4_v': 'b4_v', 'b5_v': 'b5_v'}
+
+
+def filter_tick_records(int_datetimes, interval):
+    """
+    计算需要导入的记录
+    :param int_datetimes: 按时间排序的整数形式时间
+    :param interval: 't'导入全部tick，'m'导入每分钟的第一条记录（同步到整分钟）
+    :return: 布尔数组，标记各条记录是否导入
+    """
+    hour_minute = int_datetimes // 100000 % 10000
+    # 集合竞价阶段不导入（开盘）
+    selected = (hour_minute < 910) | (hour_minute >= 930)
+    if interval == 'm':
+        minutes = int_datetimes // 100000
+        first_of_minute = np.ones(len(minutes), dtype=bool)
+        first_of_minute[1:] = minutes[1:] != minutes[:-1]
+        selected &= first_of_minute
+    elif interval != 't':
+        raise ValueError('Invalid interval: {}'.format(interval))
+    return selected
+
+
+def split_days(int_datetimes):
+    """
+    按日将排序的记录分组
+    :return: (各日第一条记录下标, 各日最后一条记录下标)
+    """
+    days = int_datetimes // 1000000000
+    boundaries = np.flatnonzero(days[1:] != days[:-1]) + 1
+    day_first = np.concatenate(([0], boundaries))
+    day_last = np.concatenate((boundaries - 1, [len(days) - 1]))
+    return day_first, day_last
+
+
+def get_batch_size(model, objs, batch_size):
+    """
+    bulk_create每批的数目，不超过数据库单条语句允许的上限（如sqlite的参数个数限制）
+    """
+    return max(min(batch_size, connection.ops.bulk_batch_size(model._meta.concrete_fields, objs)), 1)
+
+
+def import_tick_records(symbol, records, interval, complete=True, batch_size=IMPORT_BATCH_SIZE):
+    """
+    将一段按时间排序、包含完整交易日的tick记录导入为SimStockSlice与SimStockDailyInfo
+    :param records: TickTable.stream读出的structured array，包含datetime与SLICE_FIELDS中的字段
+    :param complete: 最后一日是否完整，不完整时（可能被截止时间截断）不加入其日级别信息
+    :return: (导入的截面数, 导入的日级别信息数)
+    """
+    records = records[filter_tick_records(records['datetime'], interval)]
+    if len(records) == 0:
+        return 0, 0
+    int_datetimes = records['datetime'].astype(np.int64)
+    columns = dict((key, records[key]) for key in SLICE_FIELDS)
+
+    # 开盘价为当日第一条导入记录的最新价，日级别信息的其余字段取当日最后一条导入记录
+    day_first, day_last = split_days(int_datetimes)
+    day_lengths = day_last - day_first + 1
+    opens = np.repeat(columns['last'][day_first], day_lengths)
+    timestamps = int_to_datetime64(int_datetimes).astype(dt.datetime)
+
+    # 跳过已经导入的截面
+    existing = SimStockSlice.objects.filter(stock_symbol=symbol, datetime__gte=timestamps[0],
+                                            datetime__lte=timestamps[-1]).values_list('datetime', flat=True)
+    existing = np.array([get_int_from_timestamp(timestamp) for timestamp in existing], dtype=np.int64)
+    new_records = np.flatnonzero(~np.isin(int_datetimes, existing))
+
+    values = dict((field, columns[key].tolist()) for key, field in SLICE_FIELDS.items())
+    values['open'] = opens.tolist()
+    slices = []
+    for i in new_records.tolist():
+        stick = SimStockSlice(stock_symbol=symbol, datetime=timestamps[i])
+        for field, field_values in values.items():
+            setattr(stick, field, field_values[i])
+        slices.append(stick)
+    SimStockSlice.objects.bulk_create(slices, batch_size=get_batch_size(SimStockSlice, slices, batch_size),
+                                      ignore_conflicts=True)
+
+    # 加入日间截面信息
+    existing_dates = set(SimStockDailyInfo.objects.filter(stock_symbol=symbol).values_list('date', flat=True))
+    num_days = len(day_first) if complete else len(day_first) - 1
+    daily_infos = []
+    for first, last in zip(day_first[:num_days].tolist(), day_last[:num_days].tolist()):
+        date = timestamps[last].date()
+        if date in existing_dates:
+            continue
+        daily_infos.append(SimStockDailyInfo(stock_symbol=symbol, date=date, open=values['open'][first],
+                                             high=values['high'][last], low=values['low'][last],
+                                             close=values['last_price'][last], volume=values['volume'][last],
+                                             amount=values['amount'][last]))
+    SimStockDailyInfo.objects.bulk_create(daily_infos,
+                                          batch_size=get_batch_size(SimStockDailyInfo, daily_infos, batch_size))
+    return len(slices), len(daily_infos)
+
+
+def import_stock_data(symbol, start_date, end_date, interval, path=None, batch_size=IMPORT_BATCH_SIZE,
+                      chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    从HDF5文件中导入一支股票在[start_date, end_date]之间的数据，按交易日对齐分块读取，内存占用与chunk_size成正比
+    :param path: HDF5文件路径，默认为market/data/<symbol>
+    :param interval: 't'或'm'，见filter_tick_records
+    """
+    if path is None:
+        path = os.path.join(DATA_PATH, symbol)
+    time0 = time.time()
+    tb = TickTable(path)
+    chunks = tb.stream(symbol, get_int_from_timestamp(start_date), get_int_from_timestamp(end_date),
+                       keys=list(SLICE_FIELDS.keys()), chunk_size=chunk_size, by_day=True)
+
+    SimStock.objects.get_or_create(symbol=symbol)
+    num_slices = 0
+    num_days = 0
+    with transaction.atomic():
+        # 推迟一块导入，以便得知当前块是否为最后一块
+        prev_chunk = None
+        for _, chunk in chunks:
+            if prev_chunk is not None:
+                imported = import_tick_records(symbol, prev_chunk, interval, True, batch_size)
+                num_slices += imported[0]
+                num_days += imported[1]
+                print('{} imported, cost {:.2f} s.'.format(str(prev_chunk['datetime'][-1])[:8], time.time() - time0))
+            prev_chunk = chunk
+        if prev_chunk is not None:
+            imported = import_tick_records(symbol, prev_chunk, interval, False, batch_size)
+            num_slices += imported[0]
+            num_days += imported[1]
+    invalidate_tick_columns(symbol)
+    print('{}: {} slices, {} days imported, cost {:.2f} s.'.format(symbol, num_slices, num_days, time.time() - time0))
+    return True
@@ -0,0 +1,224 @@
+# _*_ coding:UTF-8 _*_
+
+"""
+该文件定义了模拟器的委托日志。
+打开日志后，模拟器接受的每个委托（SimCommissionMsg通过合法性检查、尚未撮合时）以定长的二进制记录追加到日志文件中，
+超级用户在委托前注入的持仓和资金、锚定和重置同样记为一条记录，因此从日志可以确定地重建全部状态：
+replay_journal在内存中的SimMarketSession上按顺序重放日志，不经过数据库，分配的挂单编号与原来相同，
+可以用于长时间模拟的崩溃恢复，也可以不重新求解tick而重新生成成交记录。
+日志先写入内存缓冲，每个tick结束时（flush_commission_records）写入文件。
+日志应从一次重置开始记录，恢复数据库检查点（restore_simulation）不会记入日志。
+"""
+
+import os
+import struct
+
+import numpy as np
+
+from .sim_order_book import peek_next_order_id
+from .utils import get_int_from_timestamp, int_to_datetime64, cents_to_price, price_to_cents
+
+# 记录的类型
+KIND_ASK = b'a'
+KIND_BID = b'b'
+KIND_CANCEL = b'c'
+KIND_HOLDING = b'h'  # 向client的持仓注入vol股
+KIND_CASH = b'm'  # 向client注入amount的资金
+KIND_ANCHOR = b'n'  # 将股票的状态锚定到datetime的截面
+KIND_RESET = b'r'  # 重置模拟器
+KIND_AUCTION_OPEN = b'u'  # 开始集合竞价
+KIND_AUCTION_CLEAR = b'x'  # 集合竞价撮合，价格为参考价格
+
+# 每条记录：序号、tick、时间、类型、股票代码、client、价格（分）、数量、挂单编号、金额
+# a/b的挂单编号为未成交部分挂入order book时得到的编号，c的挂单编号为被撤的挂单
+JOURNAL_RECORD = struct.Struct('<Qiqc12siiqqd')
+JOURNAL_DTYPE = np.dtype([('seq', '<u8'), ('tick', '<i4'), ('datetime', '<i8'), ('kind', 'S1'), ('symbol', 'S12'),
+                          ('client', '<i4'), ('price', '<i4'), ('vol', '<i8'), ('order_id', '<i8'),
+                          ('amount', '<f8')])
+assert JOURNAL_DTYPE.itemsize == JOURNAL_RECORD.size
+
+
+class CommissionJournal:
+    """
+    一个追加写入的委托日志文件
+    """
+
+    def __init__(self, path, sync=False):
+        """
+        :param sync: 每次写入文件后是否fsync
+        """
+        self.path = path
+        self.sync = sync
+        self.file = open(path, 'ab')
+        # 接着已有的记录编号，不完整的末尾记录在读取时被忽略
+        self.seq = os.path.getsize(path) // JOURNAL_RECORD.size
+        self.buffer = bytearray()
+        self.tick = 0
+        self.datetime = 0
+
+    def set_clock(self, tick, datetime):
+        self.tick = tick
+        self.datetime = get_int_from_timestamp(datetime) if datetime is not None else 0
+
+    def append(self, kind, symbol=b'', client=0, price=0, vol=0, order_id=0, amount=0.0):
+        self.buffer += JOURNAL_RECORD.pack(self.seq, self.tick, self.datetime, kind, symbol, client, price, vol,
+                                           order_id, amount)
+        self.seq += 1
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.buffer = bytearray()
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+        return True
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        return True
+
+
+# 当前进程中打开的委托日志，None表示不记录
+_journal = None
+
+
+def open_commission_journal(path, sync=False):
+    global _journal
+    close_commission_journal()
+    _journal = CommissionJournal(path, sync)
+    return _journal
+
+
+def close_commission_journal():
+    global _journal
+    if _journal is not None:
+        _journal.close()
+        _journal = None
+    return True
+
+
+def flush_commission_journal():
+    if _journal is not None:
+        _journal.flush()
+    return True
+
+
+def set_journal_clock(tick, datetime):
+    if _journal is not None:
+        _journal.set_clock(tick, datetime)
+    return True
+
+
+def journal_commission(msg, order_id=None):
+    """
+    :param msg: 已通过合法性检查的SimCommissionMsg
+    :param order_id: 默认a/b为未成交部分挂入order book时将得到的编号，c为撤单的目标
+    """
+    if _journal is not None:
+        if order_id is None:
+            order_id = msg.commission_to_cancel if msg.commit_direction == 'c' else peek_next_order_id()
+        _journal.append(msg.commit_direction.encode(), msg.stock_symbol.encode(), msg.commit_client,
+                        price_to_cents(msg.commit_price), msg.commit_vol, order_id)
+    return True
+
+
+def journal_holding(client_id, symbol, vol):
+    if _journal is not None:
+        _journal.append(KIND_HOLDING, symbol.encode(), client_id, vol=vol)
+    return True
+
+
+def journal_cash(client_id, amount):
+    if _journal is not None:
+        _journal.append(KIND_CASH, client=client_id, amount=amount)
+    return True
+
+
+def journal_anchor(symbol, datetime):
+    if _journal is not None:
+        _journal.append(KIND_ANCHOR, symbol.encode(), order_id=get_int_from_timestamp(datetime))
+    return True
+
+
+def journal_auction(symbol, open_auction, reference=None):
+    if _journal is not None:
+        if open_auction:
+            _journal.append(KIND_AUCTION_OPEN, symbol.encode())
+        else:
+            _journal.append(KIND_AUCTION_CLEAR, symbol.encode(),
+                            price=price_to_cents(reference) if reference is not None else -1)
+    return True
+
+
+def journal_is_open():
+    return _journal is not None
+
+
+def journal_reset(superuser_id):
+    if _journal is not None:
+        _journal.append(KIND_RESET, client=superuser_id)
+    return True
+
+
+def read_journal(path):
+    """
+    :return: 全部完整的记录，JOURNAL_DTYPE的结构化数组
+    """
+    count = os.path.getsize(path) // JOURNAL_RECORD.size
+    return np.fromfile(path, dtype=JOURNAL_DTYPE, count=count)
+
+
+def replay_journal(path, session):
+    """
+    在内存中的会话上按顺序重放日志，会话应处于日志开始时的状态（通常日志以一条重置记录开始）
+    日志中出现的其他client在会话中不存在时，以默认资金加入
+    :param session: SimMarketSession
+    :return: session
+    """
+    records = read_journal(path)
+    # 时间按不同的值批量转换
+    int_datetimes, inverse = np.unique(records['datetime'], return_inverse=True)
+    datetimes = [None if value == 0 else timestamp for value, timestamp in
+                 zip(int_datetimes.tolist(), int_to_datetime64(int_datetimes).astype(object).tolist())]
+    ticks = records['tick'].tolist()
+    kinds = records['kind'].tolist()
+    symbols = records['symbol'].tolist()
+    client_ids = records['client'].tolist()
+    prices = records['price'].tolist()
+    vols = records['vol'].tolist()
+    order_ids = records['order_id'].tolist()
+    amounts = records['amount'].tolist()
+    for i, kind in enumerate(kinds):
+        session.datetime = datetimes[inverse[i]]
+        session.tick = ticks[i]
+        client_id = client_ids[i]
+        if client_id and client_id not in session.clients and kind != KIND_RESET:
+            session.add_client(client_id)
+        if kind in (KIND_ASK, KIND_BID, KIND_CANCEL):
+            price = prices[i] if session.price_ticks else cents_to_price(prices[i])
+            if kind == KIND_CANCEL:
+                session.commit(client_id, symbols[i].decode(), 'c', price, vols[i], order_ids[i])
+            else:
+                session.next_order_id = order_ids[i]
+                session.commit(client_id, symbols[i].decode(), kind.decode(), price, vols[i])
+        elif kind == KIND_HOLDING:
+            session.credit_holding(client_id, symbols[i].decode(), vols[i])
+        elif kind == KIND_CASH:
+            session.credit_cash(client_id, amounts[i])
+        elif kind == KIND_ANCHOR:
+            session.anchor_stock(symbols[i].decode(), int_to_datetime64(order_ids[i]).item())
+        elif kind == KIND_AUCTION_OPEN:
+            session.open_auction(symbols[i].decode())
+        elif kind == KIND_AUCTION_CLEAR:
+            reference = None
+            if prices[i] >= 0:
+                reference = prices[i] if session.price_ticks else cents_to_price(prices[i])
+            session.call_auction(symbols[i].decode(), reference)
+        elif kind == KIND_RESET:
+            session.super_client_id = client_id
+            session.reset()
+        else:
+            raise ValueError('Invalid journal record: {}'.format(kind))
+    return session
@@ -0,0 +1,530 @@
+# _*_ coding:UTF-8 _*_
+
+"""
+该文件定义了模拟环境中常驻内存的order book撮合引擎。
+每支SimStock对应一个SimOrderBook，按价格排序的档位，每个档位内是先进先出的挂单队列（价格优先、时间优先）。
+撮合全部在内存中完成，只在tick边界或显式要求时写回SimOrderBookEntry/SimOrderBookElem。
+挂单与对应的委托使用同一个编号，由next_order_id在进程中单调递增地分配。
+注意：内存中的order book只在当前进程内有效，模拟器需要在单进程中运行，部署时Procfile将gunicorn限定为单个worker。
+"""
+
+import bisect
+from collections import deque
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Max
+
+from .sim_stocks import SimOrderBookEntry, SimOrderBookElem
+from .sim_clients import SimCommissionElem
+
+
+class SimBookOrder:
+    """
+    order book中的一条挂单，属性名与SimOrderBookElem保持一致
+    """
+    __slots__ = ('unique_id', 'client', 'direction_committed', 'price_committed', 'vol_committed', 'date_committed')
+
+    def __init__(self, client, direction_committed, price_committed, vol_committed, date_committed, unique_id=None):
+        self.unique_id = unique_id if unique_id is not None else next_order_id()
+        self.client = client
+        self.direction_committed = direction_committed
+        self.price_committed = price_committed
+        self.vol_committed = vol_committed
+        self.date_committed = date_committed
+
+    def __repr__(self):
+        return str(self.client) + '-(' + str(self.price_committed) + ',' + str(self.vol_committed) + ')'
+
+
+class SimBookLevel:
+    """
+    order book中一个价格的档位，包含按时间排序的挂单队列
+    """
+    __slots__ = ('price', 'orders', 'total_vol')
+
+    def __init__(self, price):
+        self.price = price
+        self.orders = deque()
+        self.total_vol = 0
+
+
+class SimOrderBook:
+    """
+    一支股票的内存order book
+    两个方向的档位价格各自保存在有序列表中，排序键使最优价格总在列表末尾：
+    买方的键为价格本身，卖方的键为价格的相反数。因此取最优档位为O(1)，新增档位为O(log n)的查找。
+    每个方向另有一份前N档的深度快照，该方向的档位发生变化时失效，读取时只遍历需要的N档重建。
+    另外按(client, 方向, 价格)索引每个client的挂单，顺序与档位内的队列一致，撤单时无需遍历档位。
+    集合竞价期间（auction为True）委托不撮合，全部挂入order book，竞价结束时由call_auction以单一价格一次撮合。
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.keys = {'a': [], 'b': []}
+        self.levels = {'a': {}, 'b': {}}
+        self.orders = {}  # unique_id -> SimBookOrder
+        self.client_orders = {}  # (client, direction, price) -> deque([SimBookOrder])，按队列顺序
+        self.depths = {'a': None, 'b': None}  # direction -> (快照的档数, [(price, total_vol)])
+        self.auction = False  # 是否处于集合竞价期间
+        self.dirty = False
+
+    @staticmethod
+    def level_key(direction, price):
+        return -price if direction == 'a' else price
+
+    def is_empty(self, direction):
+        return len(self.keys[direction]) == 0
+
+    def best_level(self, direction):
+        keys = self.keys[direction]
+        if not keys:
+            return None
+        return self.levels[direction][self.level_key(direction, keys[-1])]
+
+    def best_order(self, direction):
+        level = self.best_level(direction)
+        if level is None:
+            return None
+        return level.orders[0]
+
+    def iter_levels(self, direction):
+        """
+        从最优价格开始，依次遍历一个方向上的全部档位
+        """
+        levels = self.levels[direction]
+        for key in reversed(self.keys[direction]):
+            yield levels[self.level_key(direction, key)]
+
+    def depth(self, direction, level=-1):
+        """
+        一个方向上从最优价格开始的前level个档位[(price, total_vol)]，level为-1时为全部档位
+        """
+        snapshot = self.depths[direction]
+        if snapshot is None or (snapshot[0] != -1 and (level == -1 or level > snapshot[0])):
+            levels = []
+            for book_level in self.iter_levels(direction):
+                if len(levels) == level:
+                    break
+                levels.append((book_level.price, book_level.total_vol))
+            snapshot = (level, levels)
+            self.depths[direction] = snapshot
+        if level == -1:
+            return list(snapshot[1])
+        return snapshot[1][:level]
+
+    def get_order_book_data(self, level=5, to_list=False):
+        """
+        获得指定level的盘口数据，level为-1时获得全部order book数据，默认获取五档数据
+        [(a5, a5_v ... a1, a1_v)], [(b1, b1_v ... b5, b5_v)]
+        to_list为True时返回展开的列表，空缺的档位为0
+        """
+        ask_info = self.depth('a', level)
+        ask_info.reverse()
+        bid_info = self.depth('b', level)
+        while len(ask_info) < level:
+            ask_info.insert(0, (None, None))
+        while len(bid_info) < level:
+            bid_info.append((None, None))
+
+        if not to_list:
+            if level == -1:
+                return ask_info, bid_info
+            return ask_info[-level:], bid_info[:level]
+        result_list = []
+        for info in ask_info[-level:] + bid_info[:level]:
+            if info[0] is not None:
+                result_list.append(info[0])
+                result_list.append(info[1])
+            else:
+                result_list.append(0)
+                result_list.append(0)
+        return result_list
+
+    def add_order(self, order):
+        """
+        将一条挂单加入对应价格档位的队尾
+        """
+        direction = order.direction_committed
+        levels = self.levels[direction]
+        level = levels.get(order.price_committed)
+        if level is None:
+            level = SimBookLevel(order.price_committed)
+            levels[order.price_committed] = level
+            bisect.insort(self.keys[direction], self.level_key(direction, order.price_committed))
+        level.orders.append(order)
+        level.total_vol += order.vol_committed
+        self.orders[order.unique_id] = order
+        client_key = (order.client, direction, order.price_committed)
+        client_orders = self.client_orders.get(client_key)
+        if client_orders is None:
+            client_orders = deque()
+            self.client_orders[client_key] = client_orders
+        client_orders.append(order)
+        self.depths[direction] = None
+        self.dirty = True
+        return order
+
+    def _remove_level(self, direction, price):
+        keys = self.keys[direction]
+        key = self.level_key(direction, price)
+        index = bisect.bisect_left(keys, key)
+        assert keys[index] == key
+        del keys[index]
+        del self.levels[direction][price]
+
+    def _unindex_order(self, order, first=False):
+        """
+        将一条已移出档位的挂单移出client的挂单索引
+        :param first: 该挂单是否为client在该价格上最早的挂单（撮合时总是如此）
+        """
+        client_key = (order.client, order.direction_committed, order.price_committed)
+        client_orders = self.client_orders[client_key]
+        if first:
+            assert client_orders[0] is order
+            client_orders.popleft()
+        else:
+            client_orders.remove(order)
+        if not client_orders:
+            del self.client_orders[client_key]
+
+    def match(self, direction, price, vol):
+        """
+        将一个方向为direction、限价为price、数量为vol的委托与对手方挂单撮合
+        :return: 成交列表[(被交易的挂单, 成交量)]，挂单已按成交量扣减，完全成交的挂单已移出order book
+        """
+        matching_direction = 'b' if direction == 'a' else 'a'
+        keys = self.keys[matching_direction]
+        levels = self.levels[matching_direction]
+        fills = []
+        remaining_vol = vol
+        while remaining_vol > 0 and keys:
+            level = levels[self.level_key(matching_direction, keys[-1])]
+            if (direction == 'a' and level.price < price) or (direction == 'b' and level.price > price):
+                # 价格不符合要求，结束撮合
+                break
+            orders = level.orders
+            while remaining_vol > 0 and orders:
+                order = orders[0]
+                traded_vol = min(remaining_vol, order.vol_committed)
+                order.vol_committed -= traded_vol
+                level.total_vol -= traded_vol
+                remaining_vol -= traded_vol
+                if order.vol_committed == 0:
+                    orders.popleft()
+                    del self.orders[order.unique_id]
+                    self._unindex_order(order, first=True)
+                fills.append((order, traded_vol))
+            if not orders:
+                keys.pop()
+                del levels[level.price]
+        if fills:
+            self.depths[matching_direction] = None
+            self.dirty = True
+        return fills
+
+    def auction_price(self, reference=None):
+        """
+        集合竞价的成交价：可成交量最大的价格，相同时取未成交量（买卖累计量之差）最小的，仍相同时取最接近reference的，
+        再相同时取较低的价格。全部档位价格排序后，以前缀和得到每个价格上买方（不低于该价格）与卖方（不高于该价格）的累计量
+        :param reference: 参考价格，通常为最新价
+        :return: (成交价, 成交量)，买卖不交叉时返回(None, 0)
+        """
+        best_ask, best_bid = self.best_level('a'), self.best_level('b')
+        if best_ask is None or best_bid is None or best_bid.price < best_ask.price:
+            return None, 0
+        prices = sorted(set(self.levels['a']) | set(self.levels['b']))
+        index_of = dict((price, i) for i, price in enumerate(prices))
+        ask_vols = np.zeros(len(prices), dtype=np.int64)
+        bid_vols = np.zeros(len(prices), dtype=np.int64)
+        for price, level in self.levels['a'].items():
+            ask_vols[index_of[price]] = level.total_vol
+        for price, level in self.levels['b'].items():
+            bid_vols[index_of[price]] = level.total_vol
+        cum_ask = np.cumsum(ask_vols)
+        cum_bid = np.cumsum(bid_vols[::-1])[::-1]
+        vols = np.minimum(cum_ask, cum_bid)
+        max_vol = vols.max()
+        candidates = np.flatnonzero(vols == max_vol)
+        imbalances = np.abs(cum_bid[candidates] - cum_ask[candidates])
+        candidates = candidates[imbalances == imbalances.min()].tolist()
+        if reference is not None:
+            return min((abs(prices[i] - reference), prices[i]) for i in candidates)[1], int(max_vol)
+        return prices[candidates[0]], int(max_vol)
+
+    def call_auction(self, reference=None):
+        """
+        集合竞价撮合：以auction_price的单一价格一次撮合全部可成交的挂单，按价格优先、时间优先配对买卖双方，并结束集合竞价
+        :return: (成交价, 成交列表[(买方挂单, 卖方挂单, 成交量)])，挂单已按成交量扣减，完全成交的挂单已移出order book
+        """
+        self.auction = False
+        price, vol = self.auction_price(reference)
+        if vol == 0:
+            return price, []
+        ask_fills = self.match('b', price, vol)
+        bid_fills = self.match('a', price, vol)
+        fills = []
+        i = j = 0
+        ask_left = ask_fills[0][1]
+        bid_left = bid_fills[0][1]
+        while i < len(ask_fills) and j < len(bid_fills):
+            traded_vol = min(ask_left, bid_left)
+            fills.append((bid_fills[j][0], ask_fills[i][0], traded_vol))
+            ask_left -= traded_vol
+            bid_left -= traded_vol
+            if ask_left == 0:
+                i += 1
+                ask_left = ask_fills[i][1] if i < len(ask_fills) else 0
+            if bid_left == 0:
+                j += 1
+                bid_left = bid_fills[j][1] if j < len(bid_fills) else 0
+        return price, fills
+
+    def cancel(self, unique_id, vol):
+        """
+        撤去某条挂单的vol数量，全部撤去时将其移出order book
+        :return: 被撤的挂单，不存在时返回None
+        """
+        order = self.orders.get(unique_id)
+        if order is None:
+            return None
+        assert vol <= order.vol_committed
+        direction = order.direction_committed
+        level = self.levels[direction][order.price_committed]
+        order.vol_committed -= vol
+        level.total_vol -= vol
+        if order.vol_committed == 0:
+            level.orders.remove(order)
+            del self.orders[unique_id]
+            self._unindex_order(order)
+            if not level.orders:
+                self._remove_level(direction, order.price_committed)
+        self.depths[direction] = None
+        self.dirty = True
+        return order
+
+    def get_client_orders(self, client, price):
+        """
+        client在price上的全部挂单，按队列顺序（从最早的挂单开始）
+        同一client在同一价格上不会同时有买卖两个方向的挂单（后到的一方会与之成交），因此不必区分方向
+        """
+        for direction in ('a', 'b'):
+            client_orders = self.client_orders.get((client, direction, price))
+            if client_orders:
+                return list(client_orders)
+        return []
+
+    def cancel_client_vol(self, client, price, vol):
+        """
+        从最新的挂单开始，撤去client在price上共vol数量的挂单
+        :return: [(被撤的挂单, 撤去的数量)]，挂单的vol_committed为撤单后的剩余数量
+        """
+        cancelled = []
+        remaining_vol = vol
+        for order in reversed(self.get_client_orders(client, price)):
+            if remaining_vol == 0:
+                break
+            cancel_vol = min(order.vol_committed, remaining_vol)
+            self.cancel(order.unique_id, cancel_vol)
+            cancelled.append((order, cancel_vol))
+            remaining_vol -= cancel_vol
+        return cancelled
+
+    def remove_levels_beyond(self, depth, client=None):
+        """
+        撤去两个方向上最优depth档之外的全部挂单，client不为None时只撤去该client的挂单
+        :return: 被撤去的挂单列表，顺序与逐档逐笔撤单时相同：各方向的档位按价格从高到低，档位内从最新的挂单开始
+        """
+        removed = []
+        for direction in ('a', 'b'):
+            keys = self.keys[direction]
+            if len(keys) <= depth:
+                continue
+            outer_keys = keys[:len(keys) - depth]
+            kept_keys = []
+            # 卖方的键为价格的相反数，升序即价格从高到低
+            for key in (outer_keys if direction == 'a' else reversed(outer_keys)):
+                price = self.level_key(direction, key)
+                level = self.levels[direction][price]
+                kept_orders = deque()
+                for order in reversed(level.orders):
+                    if client is None or order.client == client:
+                        removed.append(order)
+                        del self.orders[order.unique_id]
+                        # 该client在这一档的挂单全部撤去
+                        self.client_orders.pop((order.client, direction, price), None)
+                        level.total_vol -= order.vol_committed
+                    else:
+                        kept_orders.appendleft(order)
+                if kept_orders:
+                    level.orders = kept_orders
+                    kept_keys.append(key)
+                else:
+                    del self.levels[direction][price]
+            kept_keys.sort()
+            self.keys[direction] = kept_keys + keys[len(keys) - depth:]
+            self.depths[direction] = None
+        if removed:
+            self.dirty = True
+        return removed
+
+    def clear(self):
+        self.keys = {'a': [], 'b': []}
+        self.levels = {'a': {}, 'b': {}}
+        self.orders = {}
+        self.client_orders = {}
+        self.depths = {'a': None, 'b': None}
+        self.auction = False
+        self.dirty = True
+
+    def snapshot(self):
+        """
+        :return: (是否处于集合竞价期间, 全部挂单的元组)，挂单按档位和档位内的队列顺序排列，见restore
+        """
+        return self.auction, tuple((order.unique_id, order.client, order.direction_committed, order.price_committed,
+                                    order.vol_committed, order.date_committed)
+                                   for direction in ('a', 'b') for level in self.iter_levels(direction)
+                                   for order in level.orders)
+
+    def restore(self, snapshot):
+        """
+        将order book恢复为snapshot时的状态
+        """
+        self.clear()
+        auction, orders = snapshot
+        for unique_id, client, direction, price, vol, date_committed in orders:
+            self.add_order(SimBookOrder(client=client, direction_committed=direction, price_committed=price,
+                                        vol_committed=vol, date_committed=date_committed, unique_id=unique_id))
+        self.auction = auction
+        return self
+
+    @classmethod
+    def load(cls, symbol):
+        """
+        从数据库中的SimOrderBookEntry/SimOrderBookElem读入order book
+        """
+        book = cls(symbol)
+        entries = SimOrderBookEntry.objects.filter(stock_symbol=symbol)
+        entry_directions = dict(entries.values_list('id', 'entry_direction'))
+        elements = SimOrderBookElem.objects.filter(entry_belonged__in=list(entry_directions.keys()))
+        # 编号按委托的先后分配，即档位内的队列顺序
+        for element in elements.order_by('unique_id'):
+            book.add_order(SimBookOrder(client=element.client, direction_committed=entry_directions[element.entry_belonged],
+                                        price_committed=element.price_committed, vol_committed=element.vol_committed,
+                                        date_committed=element.date_committed, unique_id=element.unique_id))
+        book.dirty = False
+        return book
+
+    def flush(self):
+        """
+        将内存中的order book写回数据库，只有发生过改变时才会写
+        """
+        if not self.dirty:
+            return False
+        with transaction.atomic():
+            entries = SimOrderBookEntry.objects.filter(stock_symbol=self.symbol)
+            SimOrderBookElem.objects.filter(entry_belonged__in=entries.values('id')).delete()
+            entries.delete()
+
+            # sqlite下bulk_create不返回主键，因此显式分配条目的id
+            next_id = (SimOrderBookEntry.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+            new_entries = []
+            new_elements = []
+            for direction in ('a', 'b'):
+                for level in self.iter_levels(direction):
+                    new_entries.append(SimOrderBookEntry(id=next_id, stock_symbol=self.symbol, entry_direction=direction,
+                                                         entry_price=level.price, total_vol=level.total_vol))
+                    for order in level.orders:
+                        new_elements.append(SimOrderBookElem(entry_belonged=next_id, unique_id=order.unique_id,
+                                                             client=order.client, date_committed=order.date_committed,
+                                                             direction_committed=direction,
+                                                             price_committed=order.price_committed,
+                                                             vol_committed=order.vol_committed))
+                    next_id += 1
+            SimOrderBookEntry.objects.bulk_create(new_entries)
+            SimOrderBookElem.objects.bulk_create(new_elements)
+        self.dirty = False
+        return True
+
+
+# 当前进程中下一个挂单编号，None表示尚未从数据库中读取
+_next_order_id = None
+
+
+def peek_next_order_id():
+    """
+    下一个将被分配的挂单/委托编号，第一次调用时接着数据库中已有的最大编号
+    """
+    global _next_order_id
+    if _next_order_id is None:
+        max_ids = [SimOrderBookElem.objects.aggregate(max_id=Max('unique_id'))['max_id'],
+                   SimCommissionElem.objects.aggregate(max_id=Max('unique_id'))['max_id']]
+        _next_order_id = max([max_id for max_id in max_ids if max_id is not None], default=0) + 1
+    return _next_order_id
+
+
+def next_order_id():
+    """
+    分配一个新的挂单/委托编号，编号在进程中单调递增
+    """
+    global _next_order_id
+    order_id = peek_next_order_id()
+    _next_order_id = order_id + 1
+    return order_id
+
+
+def set_next_order_id(order_id):
+    """
+    从检查点恢复时使用，此后分配的编号与检查点之后原本分配的相同
+    """
+    global _next_order_id
+    _next_order_id = order_id
+    return True
+
+
+# 当前进程中已载入内存的order book，symbol -> SimOrderBook
+_order_books = {}
+
+
+def get_order_book(symbol):
+    """
+    获得一支股票的内存order book，第一次访问时从数据库载入
+    """
+    book = _order_books.get(symbol)
+    if book is None:
+        book = SimOrderBook.load(symbol)
+        _order_books[symbol] = book
+    return book
+
+
+def get_auction_symbols():
+    """
+    :return: 内存中处于集合竞价期间的order book的股票代码，数据库中不记录这一状态
+    """
+    return [symbol for symbol, book in _order_books.items() if book.auction]
+
+
+def flush_order_books(symbol=None):
+    """
+    将内存中的order book写回数据库，symbol为None时写回全部
+    """
+    if symbol is None:
+        books = list(_order_books.values())
+    elif symbol in _order_books:
+        books = [_order_books[symbol]]
+    else:
+        books = []
+    for book in books:
+        book.flush()
+    return True
+
+
+def discard_order_books(symbol=None):
+    """
+    丢弃内存中的order book（不写回），下次访问时重新从数据库载入，symbol为None时丢弃全部
+    """
+    if symbol is None:
+        _order_books.clear()
+    else:
+        _order_books.pop(symbol, None)
+    return True
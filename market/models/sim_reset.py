@@ -0,0 +1,63 @@
+# _*_ coding:UTF-8 _*_
+
+"""
+该文件定义了模拟器的快速重置。
+每个episode开始和每次重新锚定前都需要重置，因此重置不逐个对象地删除，而是对模拟器的各个表各执行一次整表删除（数据库支持时为TRUNCATE），
+全部股票的状态用一条UPDATE清空，所需的语句数与order book、持仓和委托的规模无关。
+"""
+
+import time
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from .clients import BaseClient
+from .sim_clients import SimHoldingElem, SimCommissionElem, SimTransactionElem
+from .sim_stocks import SimStock, SimOrderBookEntry, SimOrderBookElem, SimTradeHistory
+from .sim_order_book import discard_order_books
+from .sim_trade_tape import discard_trade_tapes
+from .sim_risk import discard_risk_view
+from .sim_journal import journal_reset
+
+# 重置时清空的表，导入的截面数据不在其中
+RESET_MODELS = (SimTransactionElem, SimHoldingElem, SimCommissionElem, SimOrderBookElem, SimOrderBookEntry,
+                SimTradeHistory)
+
+# 重置后超级用户的资金
+SUPERUSER_CASH = 100000000
+
+
+def flush_simulation_tables():
+    """
+    删除超级用户以外的client，清空RESET_MODELS中的表，需要在事务中调用
+    """
+    # 虚拟client在真实股市的表中可能有关联的数据，仍由ORM级联删除，通常为空
+    BaseClient.objects.filter(driver=None).delete()
+    tables = [model._meta.db_table for model in RESET_MODELS]
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sql_flush(no_style(), tables, []):
+            cursor.execute(sql)
+    return True
+
+
+def reset_simulation_data(superuser_client):
+    """
+    删除超级用户以外的client与全部持仓、委托、成交、order book和交易历史，清空全部股票的状态，恢复超级用户的资金
+    :param superuser_client: 超级用户，其资金字段同时在内存中更新
+    :return: 重置的耗时（秒）
+    """
+    time0 = time.time()
+    with transaction.atomic():
+        flush_simulation_tables()
+        SimStock.objects.update(amount=0, volume=0, last_price=None, high=None, low=None, limit_up=None,
+                                limit_down=None)
+        BaseClient.objects.filter(id=superuser_client.id).update(cash=SUPERUSER_CASH, flexible_cash=SUPERUSER_CASH,
+                                                                 frozen_cash=0)
+    superuser_client.cash = SUPERUSER_CASH
+    superuser_client.flexible_cash = SUPERUSER_CASH
+    superuser_client.frozen_cash = 0
+    discard_order_books()
+    discard_trade_tapes()
+    discard_risk_view()
+    journal_reset(superuser_client.id)
+    return time.time() - time0
@@ -0,0 +1,89 @@
+# _*_ coding:UTF-8 _*_
+
+"""
+该文件定义了委托合法性检查所需数据的内存视图。
+SimCommissionMsg.is_valid需要股票的涨跌停价、client的可用资金和(client, symbol)的可用持仓，
+这些数据第一次访问时从数据库读入，此后由修改它们的模拟器流程（下单、撤单、结算、锚定、重置）同步更新，
+检查只需几次字典查找。与order book相同，视图只在当前进程内有效，在模拟器之外修改了这些数据时需要调用discard_risk_view。
+"""
+
+from .clients import BaseClient
+from .sim_clients import SimHoldingElem
+from .sim_stocks import SimStock
+from .config import PRICE_QUANTUM
+
+
+def quantize_limit(price):
+    """
+    与保存到DecimalField后读出的值一致
+    """
+    return price.quantize(PRICE_QUANTUM) if price is not None else None
+
+
+class SimRiskView:
+    """
+    一个模拟会话的风控视图
+    """
+
+    def __init__(self):
+        self.limits = {}  # symbol -> (limit_up, limit_down)
+        self.flexible_cash = {}  # client_id -> flexible_cash
+        self.available_vol = {}  # (owner, symbol) -> available_vol，不持有时为None
+
+    def get_limits(self, symbol):
+        """
+        :return: (limit_up, limit_down)，股票不存在时返回None
+        """
+        limits = self.limits.get(symbol)
+        if limits is None:
+            limits = SimStock.objects.filter(symbol=symbol).values_list('limit_up', 'limit_down').first()
+            if limits is not None:
+                self.limits[symbol] = limits
+        return limits
+
+    def get_flexible_cash(self, client_id):
+        if client_id not in self.flexible_cash:
+            self.flexible_cash[client_id] = BaseClient.objects.values_list('flexible_cash', flat=True).get(id=client_id)
+        return self.flexible_cash[client_id]
+
+    def get_available_vol(self, owner, symbol):
+        """
+        :return: client对该股票的可用持仓，不持有时返回None
+        """
+        key = (owner, symbol)
+        if key not in self.available_vol:
+            self.available_vol[key] = SimHoldingElem.objects.filter(owner=owner, stock_symbol=symbol).\
+                values_list('available_vol', flat=True).first()
+        return self.available_vol[key]
+
+    def update_stock(self, stock):
+        self.limits[stock.symbol] = (quantize_limit(stock.limit_up), quantize_limit(stock.limit_down))
+
+    def update_client(self, client):
+        self.flexible_cash[client.id] = client.flexible_cash
+
+    def update_holding(self, holding):
+        self.available_vol[(holding.owner, holding.stock_symbol)] = holding.available_vol
+
+    def remove_holding(self, owner, symbol):
+        self.available_vol[(owner, symbol)] = None
+
+    def discard_stock(self, symbol):
+        self.limits.pop(symbol, None)
+
+    def clear(self):
+        self.limits.clear()
+        self.flexible_cash.clear()
+        self.available_vol.clear()
+
+
+# 当前进程的风控视图
+risk_view = SimRiskView()
+
+
+def discard_risk_view():
+    """
+    丢弃风控视图中的全部数据，下次访问时重新从数据库读入
+    """
+    risk_view.clear()
+    return True
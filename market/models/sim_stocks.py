@@ -7,7 +7,6 @@
 
 from django.db import models
 from django.urls import reverse
-import uuid
 import time
 
 from .config import *
@@ -17,7 +16,7 @@ class SimStock(models.Model):
     """
     Model representing A simulator stock class
     """
-    symbol = models.CharField(max_length=12)
+    symbol = models.CharField(max_length=12, unique=True)
     name = models.CharField(max_length=20)
 
     # Maximum price allowed: 999.99
@@ -57,9 +56,10 @@ class SimStock(models.Model):
     def get_next_tick_info_url(self):
         return reverse('market:sim_stock_next_tick', args=[str(self.id)])
 
-    def trading_behaviour(self, direction, price, vol, datetime, tick):
+    def trading_behaviour(self, direction, price, vol, datetime, tick, save=True):
         """
         发生了一次交易，进行一次更新
+        :param save: 是否立即保存，批量结算时由结算阶段统一写回
         """
         self.last_price = price
         if price < self.low:
@@ -68,83 +68,37 @@ class SimStock(models.Model):
             self.high = price
         self.volume += vol
         self.amount += float(price * vol)
-        self.save()
+        if save:
+            self.save()
 
-        # 记录交易历史
-        # SimTradeHistory.objects.create(stock_symbol=self.symbol, direction=direction, price=price, vol=vol, datetime=datetime, tick=tick)
+        # 记录交易历史，在tick边界批量写入
+        from .sim_trade_tape import get_trade_tape
+        get_trade_tape(self.symbol).record(direction, price, vol, datetime, tick)
 
     def is_order_book_empty(self, direction):
         """
         判断自己的买或卖的order book是否为空
         """
-        if SimOrderBookEntry.objects.filter(stock_symbol=self.symbol, entry_direction=direction).exists():
-            return False
-        else:
-            return True
+        from .sim_order_book import get_order_book
+        return get_order_book(self.symbol).is_empty(direction)
 
     def get_best_element(self, direction):
-        entries = SimOrderBookEntry.objects.filter(stock_symbol=self.symbol, entry_direction=direction)
-        if not entries.exists():
-            return None
-        else:
-            if direction == 'a':
-                # 得到最早的卖一条目
-                best_entry = entries.order_by('entry_price')[0]
-                best_element = SimOrderBookElem.objects.filter(entry_belonged=best_entry.id)[0]
-                return best_element
-            elif direction == 'b':
-                # 得到最早的买一条目
-                best_entry = entries.order_by('-entry_price')[0]
-                best_element = SimOrderBookElem.objects.filter(entry_belonged=best_entry.id)[0]
-                return best_element
-            else:
-                raise NotImplementedError
+        """
+        得到最优价格档位中最早的挂单，order book为空时返回None
+        """
+        if direction not in ['a', 'b']:
+            raise NotImplementedError
+        from .sim_order_book import get_order_book
+        return get_order_book(self.symbol).best_order(direction)
 
     def get_order_book_data(self, level=5, to_list=False):
         """
         获得指定level的盘口数据，level为-1时获得全部order book数据，默认获取五档数据
         [(a5, a5_v ... a1, a1_v)], [(b1, b1_v ... b5, b5_v)]
+        直接读取内存order book的深度快照，不访问数据库
         """
-        ask_info = []
-        bid_info = []
-        order_book_entries = SimOrderBookEntry.objects.filter(stock_symbol=self.symbol).order_by('-entry_price')
-        if order_book_entries.exists():
-            for entry in order_book_entries:
-                if entry.entry_direction == 'a':
-                    ask_info.append((entry.entry_price, entry.total_vol))
-                elif entry.entry_direction == 'b':
-                    bid_info.append((entry.entry_price, entry.total_vol))
-                else:
-                    raise ValueError('Invalid direction in order book entries!')
-        while len(ask_info) < level:
-            ask_info.insert(0, (None, None))
-        while len(bid_info) < level:
-            bid_info.append((None, None))
-
-        if not to_list:
-            if level == -1:
-                return ask_info, bid_info
-            else:
-                return ask_info[-level:], bid_info[:level]
-        else:
-            result_list = []
-            ask, bid = ask_info[-level:], bid_info[:level]
-            for info in ask:
-                if info[0]is not None:
-                    result_list.append(info[0])
-                    result_list.append(info[1])
-                else:
-                    result_list.append(0)
-                    result_list.append(0)
-
-            for info in bid:
-                if info[0]is not None:
-                    result_list.append(info[0])
-                    result_list.append(info[1])
-                else:
-                    result_list.append(0)
-                    result_list.append(0)
-            return result_list
+        from .sim_order_book import get_order_book
+        return get_order_book(self.symbol).get_order_book_data(level, to_list)
 
     def get_level5_volume(self):
         level5_data = self.get_order_book_data(level=5, to_list=True)
@@ -171,9 +125,14 @@ class SimStock(models.Model):
         return slices
 
     def reset(self):
+        from .sim_order_book import discard_order_books
+        from .sim_trade_tape import discard_trade_tapes
+        from .sim_risk import risk_view
+        discard_order_books(self.symbol)
+        discard_trade_tapes(self.symbol)
+        risk_view.discard_stock(self.symbol)
         entries = SimOrderBookEntry.objects.filter(stock_symbol=self.symbol)
-        for entry in entries:
-            SimOrderBookElem.objects.filter(entry_belonged=entry.id).delete()
+        SimOrderBookElem.objects.filter(entry_belonged__in=entries.values('id')).delete()
         entries.delete()
         SimTradeHistory.objects.filter(stock_symbol=self.symbol).delete()
         self.amount = 0
@@ -187,13 +146,20 @@ class SimStock(models.Model):
         return True
 
     def quit(self):
+        from .sim_order_book import discard_order_books
+        from .sim_trade_tape import discard_trade_tapes
+        from .sim_tick_store import invalidate_tick_columns
+        from .sim_risk import risk_view
+        discard_order_books(self.symbol)
+        discard_trade_tapes(self.symbol)
+        risk_view.discard_stock(self.symbol)
         entries = SimOrderBookEntry.objects.filter(stock_symbol=self.symbol)
-        for entry in entries:
-            SimOrderBookElem.objects.filter(entry_belonged=entry.id).delete()
+        SimOrderBookElem.objects.filter(entry_belonged__in=entries.values('id')).delete()
         entries.delete()
         SimTradeHistory.objects.filter(stock_symbol=self.symbol).delete()
         SimStockSlice.objects.filter(stock_symbol=self.symbol).delete()
         SimStockDailyInfo.objects.filter(stock_symbol=self.symbol).delete()
+        invalidate_tick_columns(self.symbol)
         self.delete()
         return True
 
@@ -236,6 +202,7 @@ class SimStockSlice(models.Model):
 
     class Meta:
         ordering = ['stock_symbol', 'datetime']
+        unique_together = ('stock_symbol', 'datetime')
 
     def __str__(self):
         return self.stock_symbol + str(self.datetime)
@@ -271,6 +238,9 @@ class SimStockDailyInfo(models.Model):
     volume = models.IntegerField(verbose_name="交易量", default=0)
     amount = models.FloatField(verbose_name="交易额", default=0)
 
+    class Meta:
+        unique_together = ('stock_symbol', 'date')
+
     def __str__(self):
         return self.stock_symbol + str(self.date)
 
@@ -286,6 +256,7 @@ class SimOrderBookEntry(models.Model):
 
     class Meta:
         ordering = ['stock_symbol', 'entry_direction', 'entry_price']
+        unique_together = ('stock_symbol', 'entry_direction', 'entry_price')
 
     def __str__(self):
         return self.stock_symbol + '-(' + str(self.entry_price) + ',' + str(self.entry_direction) + ')'
@@ -296,7 +267,7 @@ class SimOrderBookElem(models.Model):
     Order Book Entry
     """
     entry_belonged = models.IntegerField()  # 所属的order book条目
-    unique_id = models.UUIDField(blank=False, default=uuid.uuid4)  # 用于和委托一一对应
+    unique_id = models.BigIntegerField(unique=True)  # 挂单编号，用于和委托一一对应，见next_order_id
     client = models.IntegerField()  # 挂单的client的id
     date_committed = models.DateTimeField()  # 委托提交被挂起的时间
     OPERATION_DIRECTION = (
@@ -309,6 +280,7 @@ class SimOrderBookElem(models.Model):
 
     class Meta:
         ordering = ['entry_belonged', 'date_committed']
+        indexes = [models.Index(fields=['entry_belonged', 'date_committed'], name='sim_ob_elem_entry_date_idx')]
 
     def __str__(self):
         return str(self.client) + '-(' + str(self.price_committed) + ',' + str(self.vol_committed) + ')'
@@ -331,6 +303,7 @@ class SimTradeHistory(models.Model):
 
     class Meta:
         ordering = ['stock_symbol', 'tick', 'id']
+        indexes = [models.Index(fields=['stock_symbol', 'tick'], name='sim_trade_symbol_tick_idx')]
 
     def __str__(self):
         return self.stock_symbol + str(self.direction) + '-(' + str(self.price) + ',' + str(self.vol) + ')'
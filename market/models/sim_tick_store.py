@@ -0,0 +1,228 @@
+# _*_ coding:UTF-8 _*_
+
+"""
+该文件定义了按列存储的tick截面数据。
+每支股票的SimStockSlice被导出为market/data/ticks/<symbol>/下的一组.npy文件，每个字段一个文件：
+时间为int64（形如20180102093003000），价格为以分为单位的int32，挂单量、成交量为int64，成交额为float64（与FloatField一致）。
+读取时以mmap方式打开，按下标或时间区间取得的都是不复制数据的视图。
+"""
+
+import os
+import datetime as dt
+import shutil
+
+import numpy as np
+from django.db.models import Count, Max
+
+from .sim_stocks import SimStockSlice
+from .utils import get_int_from_timestamp, int_to_datetime64, price_to_cents, cents_to_price
+
+
+TICK_STORE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'ticks')
+
+PRICE_FIELDS = ['last_price', 'high', 'low', 'open', 'a1', 'a2', 'a3', 'a4', 'a5', 'b1', 'b2', 'b3', 'b4', 'b5']
+VOLUME_FIELDS = ['a1_v', 'a2_v', 'a3_v', 'a4_v', 'a5_v', 'b1_v', 'b2_v', 'b3_v', 'b4_v', 'b5_v', 'volume']
+FIELD_DTYPES = dict([('datetime', np.int64)] + [(field, np.int32) for field in PRICE_FIELDS] +
+                    [(field, np.int64) for field in VOLUME_FIELDS] + [('amount', np.float64)])
+
+
+class SimTickColumns:
+    """
+    一支股票全部tick截面的列式视图，各列为等长的numpy数组（通常是mmap）
+    """
+
+    def __init__(self, symbol, columns):
+        self.symbol = symbol
+        self.columns = columns
+        self.datetime = columns['datetime']
+
+    def __len__(self):
+        return len(self.datetime)
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def search(self, cur_datetime):
+        """
+        返回第一个时间不早于cur_datetime的截面下标，可能等于len(self)
+        """
+        return int(np.searchsorted(self.datetime, get_int_from_timestamp(cur_datetime), side='left'))
+
+    def index_of(self, cur_datetime):
+        """
+        返回时间恰为cur_datetime的截面下标，不存在时返回None
+        """
+        index = self.search(cur_datetime)
+        if index < len(self) and self.datetime[index] == get_int_from_timestamp(cur_datetime):
+            return index
+        return None
+
+    def as_of(self, cur_datetime):
+        """
+        返回时间不晚于cur_datetime的最后一个截面下标，不存在时返回None
+        """
+        index = int(np.searchsorted(self.datetime, get_int_from_timestamp(cur_datetime), side='right')) - 1
+        return index if index >= 0 else None
+
+    def range(self, start=None, end=None):
+        """
+        取得时间在[start, end]之间的全部截面，返回各列的视图（不复制数据）
+        """
+        left = 0 if start is None else self.search(start)
+        right = len(self) if end is None else \
+            int(np.searchsorted(self.datetime, get_int_from_timestamp(end), side='right'))
+        return self.rows(left, right)
+
+    def rows(self, left, right):
+        """
+        取得下标在[left, right)之间的截面，返回各列的视图（不复制数据）
+        """
+        return SimTickColumns(self.symbol, dict((field, column[left:right]) for field, column in self.columns.items()))
+
+    def datetimes(self):
+        """
+        将时间列转换为datetime.datetime的数组
+        """
+        return int_to_datetime64(self.datetime).astype(dt.datetime)
+
+    def to_slice(self, index):
+        """
+        将一个截面还原为（不保存的）SimStockSlice，价格为Decimal，可直接用于原有基于SimStockSlice的计算
+        """
+        values = {'stock_symbol': self.symbol,
+                  'datetime': int_to_datetime64(self.datetime[index]).item()}
+        for field in PRICE_FIELDS:
+            values[field] = cents_to_price(self.columns[field][index])
+        for field in VOLUME_FIELDS:
+            values[field] = int(self.columns[field][index])
+        values['amount'] = float(self.columns['amount'][index])
+        return SimStockSlice(**values)
+
+
+class SimTickStore:
+    """
+    tick截面的列式存储，每支股票一个目录，已打开的mmap缓存在进程内
+    """
+
+    def __init__(self, path=TICK_STORE_PATH):
+        self.path = path
+        self.opened = {}  # symbol -> SimTickColumns
+
+    def symbol_path(self, symbol):
+        return os.path.join(self.path, symbol)
+
+    def exists(self, symbol):
+        return os.path.exists(os.path.join(self.symbol_path(symbol), 'datetime.npy'))
+
+    def write(self, symbol, columns, signature=None):
+        """
+        写入一支股票的全部列，先写入临时目录再整体替换，避免读到写了一半的数据
+        :param columns: field -> 数组，须包含FIELD_DTYPES中的全部字段且长度相同，datetime须升序
+        :param signature: 数据来源的标记，用于判断存储是否过期，见get_db_signature
+        """
+        length = len(columns['datetime'])
+        target_path = self.symbol_path(symbol)
+        temp_path = target_path + '.tmp'
+        if os.path.exists(temp_path):
+            shutil.rmtree(temp_path)
+        os.makedirs(temp_path)
+        for field, dtype in FIELD_DTYPES.items():
+            column = np.asarray(columns[field], dtype=dtype)
+            assert len(column) == length
+            np.save(os.path.join(temp_path, field + '.npy'), column)
+        if signature is not None:
+            np.save(os.path.join(temp_path, 'signature.npy'), np.asarray(signature, dtype=np.int64))
+        self.invalidate(symbol)
+        if os.path.exists(target_path):
+            shutil.rmtree(target_path)
+        os.replace(temp_path, target_path)
+        return True
+
+    def open(self, symbol):
+        """
+        以mmap方式打开一支股票的全部列，不存在时返回None
+        """
+        tick_columns = self.opened.get(symbol)
+        if tick_columns is None:
+            if not self.exists(symbol):
+                return None
+            columns = {}
+            for field in FIELD_DTYPES:
+                columns[field] = np.load(os.path.join(self.symbol_path(symbol), field + '.npy'), mmap_mode='r')
+            tick_columns = SimTickColumns(symbol, columns)
+            self.opened[symbol] = tick_columns
+        return tick_columns
+
+    def get_signature(self, symbol):
+        path = os.path.join(self.symbol_path(symbol), 'signature.npy')
+        if not os.path.exists(path):
+            return None
+        return tuple(np.load(path).tolist())
+
+    def invalidate(self, symbol=None):
+        """
+        丢弃已打开的列，symbol为None时丢弃全部
+        """
+        if symbol is None:
+            self.opened.clear()
+        else:
+            self.opened.pop(symbol, None)
+        return True
+
+    def remove(self, symbol):
+        self.invalidate(symbol)
+        if os.path.exists(self.symbol_path(symbol)):
+            shutil.rmtree(self.symbol_path(symbol))
+        return True
+
+    def build_from_db(self, symbol):
+        """
+        将数据库中一支股票的SimStockSlice导出为列式存储
+        """
+        fields = ['datetime'] + PRICE_FIELDS + VOLUME_FIELDS + ['amount']
+        signature = get_db_signature(symbol)
+        rows = SimStockSlice.objects.filter(stock_symbol=symbol).order_by('datetime').values_list(*fields)
+        columns = dict((field, []) for field in fields)
+        for row in rows.iterator():
+            columns['datetime'].append(get_int_from_timestamp(row[0]))
+            for i, field in enumerate(fields[1:], start=1):
+                columns[field].append(row[i])
+        for field in PRICE_FIELDS:
+            columns[field] = [price_to_cents(price) for price in columns[field]]
+        return self.write(symbol, columns, signature)
+
+
+def get_db_signature(symbol):
+    """
+    数据库中一支股票截面的标记：(截面数目, 最大id)，重新导入或删除后会改变
+    """
+    info = SimStockSlice.objects.filter(stock_symbol=symbol).aggregate(count=Count('id'), max_id=Max('id'))
+    return info['count'], info['max_id'] or 0
+
+
+tick_store = SimTickStore()
+# 本进程中已核对过与数据库一致的股票
+_checked_symbols = set()
+
+
+def get_tick_columns(symbol):
+    """
+    获得一支股票的列式tick数据。每个进程第一次访问时核对与数据库中的截面是否一致，不存在或不一致时重新导出
+    """
+    if symbol not in _checked_symbols:
+        if tick_store.get_signature(symbol) != get_db_signature(symbol):
+            tick_store.build_from_db(symbol)
+        _checked_symbols.add(symbol)
+    return tick_store.open(symbol)
+
+
+def invalidate_tick_columns(symbol=None):
+    """
+    数据库中的截面发生变化后调用，下次访问时重新核对，symbol为None时作用于全部股票
+    """
+    if symbol is None:
+        _checked_symbols.clear()
+    else:
+        _checked_symbols.discard(symbol)
+    tick_store.invalidate(symbol)
+    return True
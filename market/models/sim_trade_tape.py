@@ -0,0 +1,109 @@
+# _*_ coding:UTF-8 _*_
+
+"""
+该文件定义了模拟器的成交记录缓冲。
+每支股票的每笔成交（方向、价格、数量、时间、tick）先写入内存中预先分配的环形缓冲，
+在tick边界、episode边界或缓冲写满时以一次bulk_create写入SimTradeHistory，不必为每笔成交单独写库。
+与内存order book相同，缓冲只在当前进程内有效。
+"""
+
+import numpy as np
+
+from .sim_stocks import SimTradeHistory
+from .config import TRADE_TAPE_SIZE
+from .utils import price_to_cents, cents_to_price
+
+TRADE_TAPE_DTYPE = np.dtype([('tick', '<i4'), ('datetime', 'M8[us]'), ('direction', 'S1'), ('price', '<i4'),
+                             ('vol', '<i8')])
+
+
+class SimTradeTape:
+    """
+    一支股票尚未写入数据库的成交，价格以分为单位的整数保存
+    """
+
+    def __init__(self, symbol, capacity=TRADE_TAPE_SIZE):
+        self.symbol = symbol
+        self.trades = np.zeros(capacity, dtype=TRADE_TAPE_DTYPE)
+        self.start = 0  # 最早一笔未写入的成交的位置
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def record(self, direction, price, vol, datetime, tick):
+        """
+        记录一笔成交，缓冲已满时先写入数据库
+        """
+        capacity = len(self.trades)
+        if self.size == capacity:
+            self.flush()
+        self.trades[(self.start + self.size) % capacity] = (tick, datetime, direction, price_to_cents(price), vol)
+        self.size += 1
+        return True
+
+    def to_array(self):
+        """
+        :return: 按成交顺序排列的未写入的成交
+        """
+        return self.trades.take(np.arange(self.start, self.start + self.size), mode='wrap')
+
+    def flush(self):
+        """
+        将缓冲中的成交批量写入SimTradeHistory
+        """
+        if self.size == 0:
+            return False
+        trades = self.to_array()
+        SimTradeHistory.objects.bulk_create([
+            SimTradeHistory(stock_symbol=self.symbol, direction=direction.decode(), price=cents_to_price(price),
+                            vol=vol, datetime=datetime, tick=tick)
+            for tick, datetime, direction, price, vol in zip(trades['tick'].tolist(),
+                                                             trades['datetime'].astype(object).tolist(),
+                                                             trades['direction'].tolist(), trades['price'].tolist(),
+                                                             trades['vol'].tolist())])
+        self.clear()
+        return True
+
+    def clear(self):
+        self.start = (self.start + self.size) % len(self.trades)
+        self.size = 0
+        return True
+
+
+# 当前进程中的成交记录缓冲，symbol -> SimTradeTape
+_trade_tapes = {}
+
+
+def get_trade_tape(symbol):
+    tape = _trade_tapes.get(symbol)
+    if tape is None:
+        tape = SimTradeTape(symbol)
+        _trade_tapes[symbol] = tape
+    return tape
+
+
+def flush_trade_tapes(symbol=None):
+    """
+    将缓冲中的成交写入数据库，symbol为None时写入全部
+    """
+    if symbol is None:
+        tapes = list(_trade_tapes.values())
+    elif symbol in _trade_tapes:
+        tapes = [_trade_tapes[symbol]]
+    else:
+        tapes = []
+    for tape in tapes:
+        tape.flush()
+    return True
+
+
+def discard_trade_tapes(symbol=None):
+    """
+    丢弃缓冲中尚未写入的成交，symbol为None时丢弃全部
+    """
+    if symbol is None:
+        _trade_tapes.clear()
+    else:
+        _trade_tapes.pop(symbol, None)
+    return True
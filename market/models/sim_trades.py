@@ -5,61 +5,215 @@
 并非虚拟股市原本的模型，做了一些适应性的调整，取消了全部外键。
 """
 
-from django.db import models
-import uuid
+from django.db import models, transaction
 from decimal import Decimal
 import time
 
 from .clients import BaseClient
 from .sim_market import SimMarket
 from .sim_clients import SimHoldingElem, SimCommissionElem, SimTransactionElem
-from .sim_stocks import SimStock, SimOrderBookEntry, SimOrderBookElem
+from .sim_stocks import SimStock
+from .sim_order_book import SimBookOrder, get_order_book
+from .sim_journal import journal_commission, journal_auction, flush_commission_journal
+from .sim_risk import risk_view
 from .config import *
 
 
-class SimTradeMsg(models.Model):
-    stock_symbol = models.CharField(max_length=12)
-    initiator = models.IntegerField(verbose_name='交易的发起方ID')
+class SimTradeMsg:
+    """
+    一次成交的信息，只在撮合与结算之间传递，不保存到数据库（成交记录见SimTransactionElem）
+    """
+    __slots__ = ('stock_symbol', 'initiator', 'trade_direction', 'trade_price', 'trade_vol', 'trade_date',
+                 'trade_tick', 'commission_id', 'acceptor', 'tax_charged', 'initiator_commission_id')
+
+    def __init__(self, stock_symbol, initiator, trade_direction, trade_price, trade_vol, trade_date, trade_tick,
+                 commission_id, acceptor, tax_charged=0, initiator_commission_id=None):
+        self.stock_symbol = stock_symbol
+        self.initiator = initiator  # 交易的发起方ID
+        self.trade_direction = trade_direction
+        self.trade_price = trade_price
+        self.trade_vol = trade_vol
+        self.trade_date = trade_date
+        self.trade_tick = trade_tick
+        self.commission_id = commission_id  # 被交易的挂单的编号
+        self.acceptor = acceptor  # 交易的接受方ID
+        self.tax_charged = tax_charged
+        self.initiator_commission_id = initiator_commission_id  # 集合竞价中发起方（买方）挂单的编号
+
+
+class SimSettlement:
+    """
+    结算阶段：收集一次委托（或一次集合竞价）撮合产生的全部SimTradeMsg，
+    合并到每个client、每条持仓、每条委托之上，最后在一个事务中批量写回数据库。
+    价格与金额直接在读入的模型实例上以Decimal计算，不使用INTEGER_PRICE_TICKS的整数分表示。
+    """
+
+    def __init__(self):
+        self.trade_msgs = []
+
+        self.clients = {}
+        self.stocks = {}
+        self.holdings = {}
+        self.commissions = {}
+        self.transactions = []
 
-    trade_direction = models.CharField(max_length=1)
-    trade_price = models.DecimalField(max_digits=MAX_DIGITS, decimal_places=DECIMAL_PLACES)
-    trade_vol = models.IntegerField()
-    trade_date = models.DateTimeField(blank=False)
-    trade_tick = models.IntegerField(blank=False)
+        self.dirty_clients = set()
+        self.dirty_holdings = set()
+        self.dirty_commissions = set()
+        self.new_holdings = {}
+        self.deleted_holdings = {}  # id -> (owner, symbol)
+        self.deleted_commissions = set()
 
-    # 被交易的挂单的ID
-    commission_id = models.UUIDField(blank=False, default=uuid.uuid4, verbose_name='原本挂单的uuid')
+    def add_trade(self, msg):
+        assert isinstance(msg, SimTradeMsg)
+        self.trade_msgs.append(msg)
 
-    acceptor = models.IntegerField(verbose_name='交易的接受方ID')
-    tax_charged = models.FloatField(default=0)
+    def get_client(self, client_id):
+        self.dirty_clients.add(client_id)
+        return self.clients[client_id]
 
+    def get_stock(self, symbol):
+        return self.stocks[symbol]
 
-def sim_instant_trade(msg):
+    def get_holding(self, owner, symbol):
+        """
+        得到client对某支股票的持仓，不存在时返回None
+        """
+        key = (owner, symbol)
+        if key in self.new_holdings:
+            return self.new_holdings[key]
+        holding = self.holdings.get(key)
+        if holding is not None:
+            self.dirty_holdings.add(key)
+        return holding
+
+    def create_holding(self, **kwargs):
+        holding = SimHoldingElem(**kwargs)
+        self.new_holdings[(holding.owner, holding.stock_symbol)] = holding
+        return holding
+
+    def delete_holding(self, holding):
+        key = (holding.owner, holding.stock_symbol)
+        if key in self.new_holdings:
+            del self.new_holdings[key]
+        else:
+            del self.holdings[key]
+            self.dirty_holdings.discard(key)
+            self.deleted_holdings[holding.id] = key
+
+    def get_commission(self, unique_id):
+        self.dirty_commissions.add(unique_id)
+        return self.commissions[unique_id]
+
+    def delete_commission(self, commission):
+        del self.commissions[commission.unique_id]
+        self.dirty_commissions.discard(commission.unique_id)
+        self.deleted_commissions.add(commission.id)
+
+    def load(self):
+        """
+        一次性读入结算涉及的全部client、股票、持仓和委托
+        """
+        client_ids = set()
+        symbols = set()
+        commission_ids = set()
+        for msg in self.trade_msgs:
+            client_ids.add(msg.initiator)
+            client_ids.add(msg.acceptor)
+            symbols.add(msg.stock_symbol)
+            commission_ids.add(msg.commission_id)
+            if msg.initiator_commission_id is not None:
+                commission_ids.add(msg.initiator_commission_id)
+
+        self.clients = BaseClient.objects.in_bulk(list(client_ids))
+        self.stocks = {stock.symbol: stock for stock in SimStock.objects.filter(symbol__in=symbols)}
+        for holding in SimHoldingElem.objects.filter(owner__in=client_ids, stock_symbol__in=symbols):
+            key = (holding.owner, holding.stock_symbol)
+            assert key not in self.holdings
+            self.holdings[key] = holding
+        self.commissions = {commission.unique_id: commission
+                            for commission in SimCommissionElem.objects.filter(unique_id__in=commission_ids)}
+
+    def save(self):
+        """
+        将结算结果批量写回数据库
+        """
+        SimTransactionElem.objects.bulk_create(self.transactions)
+        BaseClient.objects.bulk_update([self.clients[client_id] for client_id in self.dirty_clients],
+                                       ['cash', 'frozen_cash', 'flexible_cash'])
+        SimStock.objects.bulk_update(list(self.stocks.values()), ['last_price', 'low', 'high', 'volume', 'amount'])
+
+        if self.deleted_holdings:
+            SimHoldingElem.objects.filter(id__in=list(self.deleted_holdings.keys())).delete()
+        SimHoldingElem.objects.bulk_update([self.holdings[key] for key in self.dirty_holdings],
+                                           ['vol', 'frozen_vol', 'available_vol', 'cost', 'price_guaranteed',
+                                            'last_price', 'profit', 'value'])
+        SimHoldingElem.objects.bulk_create(list(self.new_holdings.values()))
+
+        if self.deleted_commissions:
+            SimCommissionElem.objects.filter(id__in=self.deleted_commissions).delete()
+        SimCommissionElem.objects.bulk_update([self.commissions[unique_id] for unique_id in self.dirty_commissions],
+                                              ['price_traded', 'vol_traded'])
+
+        # 同步风控视图
+        for client_id in self.dirty_clients:
+            risk_view.update_client(self.clients[client_id])
+        for owner, symbol in self.deleted_holdings.values():
+            risk_view.remove_holding(owner, symbol)
+        for key in self.dirty_holdings:
+            risk_view.update_holding(self.holdings[key])
+        for holding in self.new_holdings.values():
+            risk_view.update_holding(holding)
+
+    def settle(self):
+        """
+        结算全部收集到的交易，无论交易数目多少，查询数目都是常数
+        """
+        if len(self.trade_msgs) == 0:
+            return True
+        with transaction.atomic():
+            self.load()
+            for msg in self.trade_msgs:
+                # 这应当是并行的
+                if msg.initiator_commission_id is not None:
+                    sim_auction_trade(msg, self)
+                sim_instant_trade(msg, self)
+                sim_delayed_trade(msg, self)
+
+                # 记录交易
+                self.stocks[msg.stock_symbol].trading_behaviour(msg.trade_direction, msg.trade_price, msg.trade_vol,
+                                                                msg.trade_date, msg.trade_tick, save=False)
+            self.save()
+        self.trade_msgs = []
+        return True
+
+
+def sim_instant_trade(msg, settlement):
     """
     client的委托立刻得到了交易，从而不会出现在委托记录中
     :param msg: 交易的相关信息，是一个TradeMsg类
+    :param settlement: 所属的结算阶段，是一个SimSettlement类，修改只作用于其中的对象
     """
     initiator = msg.initiator
     stock_symbol = msg.stock_symbol
 
-    initiator_object = BaseClient.objects.get(id=initiator)
-    stock_object = SimStock.objects.get(symbol=stock_symbol)
-    SimTransactionElem.objects.create(one_side=initiator, the_other_side=msg.acceptor,
-                                      stock_symbol=stock_symbol, price_traded=msg.trade_price, vol_traded=msg.trade_vol,
-                                      date_traded=msg.trade_date, operation=msg.trade_direction)
+    initiator_object = settlement.get_client(initiator)
+    stock_object = settlement.get_stock(stock_symbol)
+    settlement.transactions.append(SimTransactionElem(one_side=initiator, the_other_side=msg.acceptor,
+                                                      stock_symbol=stock_symbol, price_traded=msg.trade_price,
+                                                      vol_traded=msg.trade_vol, date_traded=msg.trade_date,
+                                                      operation=msg.trade_direction))
 
     if msg.trade_direction == 'a':
         # 卖出
-        hold_element = SimHoldingElem.objects.get(owner=initiator, stock_symbol=stock_symbol)
+        hold_element = settlement.get_holding(initiator, stock_symbol)
         available_shares = hold_element.available_vol
         assert available_shares >= msg.trade_vol
         hold_element.available_vol -= msg.trade_vol
         hold_element.vol -= msg.trade_vol
         if hold_element.vol == 0:
             # 目前为止已全部卖出，不再持有，删除该条数据
-            hold_element.delete()
-        else:
-            hold_element.save(update_fields=['vol', 'available_vol'])
+            settlement.delete_holding(hold_element)
 
         earning = float(msg.trade_price * msg.trade_vol - msg.tax_charged)
         initiator_object.cash += earning
@@ -67,39 +221,42 @@ def sim_instant_trade(msg):
 
     elif msg.trade_direction == 'b':
         # 买入
-        holding = SimHoldingElem.objects.filter(owner=initiator, stock_symbol=stock_symbol)
-        if holding.exists():
-            # 之前本就持有该股票
-            assert holding.count() == 1
-            new_holding = holding[0]
-            new_holding.cost = Decimal((new_holding.cost * new_holding.vol + msg.trade_price * msg.trade_vol) /
-                                       (new_holding.vol + msg.trade_vol))
-            new_holding.price_guaranteed = new_holding.cost
-            new_holding.last_price = stock_object.last_price
-            new_holding.vol += msg.trade_vol
-            new_holding.available_vol += msg.trade_vol
-            new_holding.profit -= msg.tax_charged
-            new_holding.value = float(stock_object.last_price) * new_holding.vol
-            new_holding.save()
-        else:
-            # 即买入新的股票
-            SimHoldingElem.objects.create(owner=initiator, stock_symbol=stock_symbol,
-                                          vol=msg.trade_vol, frozen_vol=0, available_vol=msg.trade_vol,
-                                          cost=msg.trade_price, price_guaranteed=msg.trade_price,
-                                          last_price=stock_object.last_price, profit=- msg.tax_charged,
-                                          value=stock_object.last_price * msg.trade_vol, date_bought=msg.trade_date)
+        sim_build_holding(settlement, initiator, stock_object, msg)
         spending = float(msg.trade_price * msg.trade_vol + msg.tax_charged)
         initiator_object.cash -= spending
         initiator_object.flexible_cash -= spending
 
-    initiator_object.save(update_fields=['cash', 'flexible_cash'])
     return True
 
 
-def sim_delayed_trade(msg):
+def sim_auction_trade(msg, settlement):
+    """
+    集合竞价中买方的挂单得到了交易：更新买方的委托，并按委托价解除这部分冻结的资金，之后与即时成交相同地按成交价结算
+    :param msg: 交易的相关信息，是一个TradeMsg类
+    :param settlement: 所属的结算阶段，是一个SimSettlement类，修改只作用于其中的对象
+    """
+    commission_element = settlement.get_commission(msg.initiator_commission_id)
+    assert commission_element.operation == 'b'
+    assert commission_element.vol_traded + msg.trade_vol <= commission_element.vol_committed
+    new_avg_price = (commission_element.price_traded * commission_element.vol_traded +
+                     msg.trade_price * msg.trade_vol) / (commission_element.vol_traded + msg.trade_vol)
+    commission_element.price_traded = new_avg_price.quantize(PRICE_QUANTUM)
+    commission_element.vol_traded += msg.trade_vol
+    if commission_element.vol_traded == commission_element.vol_committed:
+        settlement.delete_commission(commission_element)
+
+    initiator_object = settlement.get_client(msg.initiator)
+    freeze = float(commission_element.price_committed * msg.trade_vol)
+    initiator_object.frozen_cash -= freeze
+    initiator_object.flexible_cash += freeze
+    return True
+
+
+def sim_delayed_trade(msg, settlement):
     """
     client的委托记录中的委托得到了交易，从而改变委托情况
     :param msg: 交易的相关信息，是一个TradeMsg类
+    :param settlement: 所属的结算阶段，是一个SimSettlement类，修改只作用于其中的对象
     """
     assert isinstance(msg, SimTradeMsg)
     acceptor = msg.acceptor
@@ -109,37 +266,33 @@ def sim_delayed_trade(msg):
     else:
         acceptor_direction = 'a'
 
-    acceptor_object = BaseClient.objects.get(id=acceptor)
-    stock_object = SimStock.objects.get(symbol=stock_symbol)
+    acceptor_object = settlement.get_client(acceptor)
+    stock_object = settlement.get_stock(stock_symbol)
 
     # 先处理委托
-    commission_element = SimCommissionElem.objects.get(unique_id=msg.commission_id)
+    commission_element = settlement.get_commission(msg.commission_id)
     assert commission_element.stock_symbol == stock_symbol
     assert commission_element.operation == acceptor_direction
     assert commission_element.vol_traded + msg.trade_vol <= commission_element.vol_committed
     new_avg_price = (commission_element.price_traded * commission_element.vol_traded +
                      msg.trade_price * msg.trade_vol) / (commission_element.vol_traded + msg.trade_vol)
-    commission_element.price_traded = new_avg_price
+    commission_element.price_traded = new_avg_price.quantize(PRICE_QUANTUM)
     commission_element.vol_traded += msg.trade_vol
 
     # 委托完成时的操作，目前直接删除，没有委托历史记录，只有历史成交记录
     if commission_element.vol_traded == commission_element.vol_committed:
-        commission_element.delete()
-    else:
-        commission_element.save(update_fields=['price_traded', 'vol_traded'])
+        settlement.delete_commission(commission_element)
 
     if acceptor_direction == 'a':
         # 卖出，处理持仓
-        hold_element = SimHoldingElem.objects.get(owner=acceptor, stock_symbol=stock_symbol)
+        hold_element = settlement.get_holding(acceptor, stock_symbol)
         frozen_shares = hold_element.frozen_vol
         assert frozen_shares >= msg.trade_vol
         hold_element.frozen_vol -= msg.trade_vol
         hold_element.vol -= msg.trade_vol
         if hold_element.vol == 0:
             # 该持有的股票目前为止已全部卖出，不再持有，删除该条数据
-            hold_element.delete()
-        else:
-            hold_element.save(update_fields=['vol', 'frozen_vol'])
+            settlement.delete_holding(hold_element)
 
         # 结算收益，成交金额减去收益
         earning = float(msg.trade_price * msg.trade_vol - msg.tax_charged)
@@ -148,65 +301,77 @@ def sim_delayed_trade(msg):
 
     elif acceptor_direction == 'b':
         # 买入，建仓
-        holding = SimHoldingElem.objects.filter(owner=acceptor, stock_symbol=stock_symbol)
-        if holding.exists():
-            # 之前本就持有该股票
-            assert holding.count() == 1
-            new_holding = holding[0]
-            new_holding.cost = Decimal((new_holding.cost * new_holding.vol + msg.trade_price * msg.trade_vol) /
-                                       (new_holding.vol + msg.trade_vol))
-            new_holding.price_guaranteed = new_holding.cost
-            new_holding.last_price = stock_object.last_price
-            new_holding.vol += msg.trade_vol
-            new_holding.available_vol += msg.trade_vol
-            new_holding.profit -= msg.tax_charged
-            new_holding.value = float(stock_object.last_price) * new_holding.vol
-            new_holding.save()
-        else:
-            # 即买入新的股票
-            SimHoldingElem.objects.create(owner=acceptor, stock_symbol=stock_symbol,
-                                          vol=msg.trade_vol, frozen_vol=0, available_vol=msg.trade_vol,
-                                          cost=msg.trade_price, price_guaranteed=msg.trade_price,
-                                          last_price=stock_object.last_price, profit=- msg.tax_charged,
-                                          value=stock_object.last_price * msg.trade_vol, date_bought=msg.trade_date)
+        sim_build_holding(settlement, acceptor, stock_object, msg)
 
         # 结算交易成本，扣除冻结资金和资金余额
         spending = float(msg.trade_price * msg.trade_vol + msg.tax_charged)
         acceptor_object.cash -= spending
         acceptor_object.frozen_cash -= spending
 
-    acceptor_object.save(update_fields=['cash', 'frozen_cash', 'flexible_cash'])
     return True
 
 
-class SimCommissionMsg(models.Model):
-    stock_symbol = models.CharField(max_length=12)
-    commit_client = models.IntegerField(verbose_name='委托的client的ID')
+def sim_build_holding(settlement, owner, stock_object, msg):
+    """
+    买入成交后建仓或加仓
+    """
+    new_holding = settlement.get_holding(owner, stock_object.symbol)
+    if new_holding is not None:
+        # 之前本就持有该股票
+        new_holding.cost = Decimal((new_holding.cost * new_holding.vol + msg.trade_price * msg.trade_vol) /
+                                   (new_holding.vol + msg.trade_vol)).quantize(PRICE_QUANTUM)
+        new_holding.price_guaranteed = new_holding.cost
+        new_holding.last_price = stock_object.last_price
+        new_holding.vol += msg.trade_vol
+        new_holding.available_vol += msg.trade_vol
+        new_holding.profit -= msg.tax_charged
+        new_holding.value = float(stock_object.last_price) * new_holding.vol
+    else:
+        # 即买入新的股票
+        settlement.create_holding(owner=owner, stock_symbol=stock_object.symbol,
+                                  vol=msg.trade_vol, frozen_vol=0, available_vol=msg.trade_vol,
+                                  cost=msg.trade_price, price_guaranteed=msg.trade_price,
+                                  last_price=stock_object.last_price, profit=- msg.tax_charged,
+                                  value=float(stock_object.last_price * msg.trade_vol), date_bought=msg.trade_date)
+    return True
 
-    commit_direction = models.CharField(max_length=1, default='b')
-    commit_price = models.DecimalField(max_digits=MAX_DIGITS, decimal_places=DECIMAL_PLACES, default=0)
-    commit_vol = models.IntegerField(default=0)
-    commit_date = models.DateTimeField(blank=True, default=None)
 
-    # used for cancel a commission
-    commission_to_cancel = models.UUIDField(verbose_name='委托取消的目标委托本身的uuid', default=uuid.uuid4)
+class SimCommissionMsg:
+    """
+    client提交的一个委托，只在委托处理的过程中传递，不保存到数据库。
+    需要留存时由record_commission加入审计记录，在tick边界以flush_commission_records批量写入SimCommissionRecord
+    """
+    __slots__ = ('stock_symbol', 'commit_client', 'commit_direction', 'commit_price', 'commit_vol', 'commit_date',
+                 'commission_to_cancel', 'confirmed')
+
+    def __init__(self, stock_symbol, commit_client, commit_direction='b', commit_price=0, commit_vol=0,
+                 commit_date=None, commission_to_cancel=None):
+        self.stock_symbol = stock_symbol
+        self.commit_client = commit_client  # 委托的client的ID
+        self.commit_direction = commit_direction
+        self.commit_price = commit_price
+        self.commit_vol = commit_vol
+        self.commit_date = commit_date
+
+        # used for cancel a commission，委托取消的目标委托的编号
+        self.commission_to_cancel = commission_to_cancel
 
-    # Confirm the commission
-    confirmed = models.BooleanField(default=False)
+        # Confirm the commission
+        self.confirmed = False
 
     def is_valid(self):
         """
-        判断委托信息是否合法
+        判断委托信息是否合法，所需数据从风控视图中读取
         :return: 合法则返回True
         """
-        if not SimStock.objects.filter(symbol=self.stock_symbol).exists():
+        limits = risk_view.get_limits(self.stock_symbol)
+        if limits is None:
             # 委托的股票标的不存在
             print('The STOCK COMMITTED DOES NOT EXIST!')
             return False
-        else:
-            stock_corr = SimStock.objects.get(symbol=self.stock_symbol)
-        if stock_corr.limit_up != 0 and stock_corr.limit_down != 0:
-            if self.commit_price > stock_corr.limit_up or self.commit_price < stock_corr.limit_down:
+        limit_up, limit_down = limits
+        if limit_up != 0 and limit_down != 0:
+            if self.commit_price > limit_up or self.commit_price < limit_down:
                 # 委托价格，需要在涨跌停价之间
                 print('COMMIT PRICE MUST BE BETWEEN THE LIMIT UP AND THE LIMIT DOWN!')
                 return False
@@ -215,19 +380,19 @@ class SimCommissionMsg(models.Model):
             print('COMMIT DIRECTION INVALID!')
             return False
 
-        commit_client_object = BaseClient.objects.get(id=self.commit_client)
         if self.commit_direction == 'a':
             # 委卖，则委托的股票必须有合理的持仓和充足的可用余额
-            if not SimHoldingElem.objects.filter(owner=self.commit_client, stock_symbol=self.stock_symbol).exists():
+            available_vol = risk_view.get_available_vol(self.commit_client, self.stock_symbol)
+            if available_vol is None:
                 print('DOES NOT HOLD THE STOCK!')
                 return False
-            holding_element = SimHoldingElem.objects.get(owner=self.commit_client, stock_symbol=self.stock_symbol)
-            if holding_element.available_vol < self.commit_vol:
+            if available_vol < self.commit_vol:
                 print('DOES NOT HOLD ENOUGH STOCK SHARES!')
                 return False
         elif self.commit_direction == 'b':
             # 委买，则必须有充足的可用余额，能够负担税费的冻结资金
-            if commit_client_object.flexible_cash < self.commit_price * self.commit_vol * Decimal(1 + TAX_RATE):
+            flexible_cash = risk_view.get_flexible_cash(self.commit_client)
+            if flexible_cash < self.commit_price * self.commit_vol * TAX_FACTOR:
                 print('CAN NOT AFFORD THE FROZEN CASH!')
                 return False
         elif self.commit_direction == 'c':
@@ -239,6 +404,53 @@ class SimCommissionMsg(models.Model):
         return True
 
 
+class SimCommissionRecord(models.Model):
+    """
+    委托的审计记录，由flush_commission_records批量写入
+    """
+    stock_symbol = models.CharField(max_length=12)
+    commit_client = models.IntegerField(verbose_name='委托的client的ID')
+
+    commit_direction = models.CharField(max_length=1, default='b')
+    commit_price = models.DecimalField(max_digits=MAX_DIGITS, decimal_places=DECIMAL_PLACES, default=0)
+    commit_vol = models.IntegerField(default=0)
+    commit_date = models.DateTimeField(null=True, blank=True)
+
+    commission_to_cancel = models.BigIntegerField(verbose_name='委托取消的目标委托的编号', null=True, blank=True)
+
+
+# 尚未写入数据库的委托审计记录
+_commission_records = []
+
+
+def record_commission(msg, order_id=None):
+    """
+    将一个已接受的委托写入委托日志（打开时），并加入审计记录，RECORD_COMMISSIONS为False时不加入审计记录
+    :param order_id: 委托在order book中的挂单编号，默认为撤单的目标，或未成交部分挂入order book时将得到的编号
+    """
+    journal_commission(msg, order_id)
+    if RECORD_COMMISSIONS:
+        _commission_records.append(SimCommissionRecord(stock_symbol=msg.stock_symbol, commit_client=msg.commit_client,
+                                                       commit_direction=msg.commit_direction,
+                                                       commit_price=msg.commit_price, commit_vol=msg.commit_vol,
+                                                       commit_date=msg.commit_date,
+                                                       commission_to_cancel=msg.commission_to_cancel))
+    return True
+
+
+def flush_commission_records():
+    """
+    将积累的委托审计记录批量写入数据库，委托日志同时写入文件
+    """
+    global _commission_records
+    flush_commission_journal()
+    if not _commission_records:
+        return False
+    records, _commission_records = _commission_records, []
+    SimCommissionRecord.objects.bulk_create(records)
+    return True
+
+
 def sim_add_commission(msg):
     """
     client成功提交了一个委托，且部分或全部没有被交易，将更新client的委托信息和相应股票的order book
@@ -250,22 +462,15 @@ def sim_add_commission(msg):
     stock_symbol = msg.stock_symbol
     market  = SimMarket.objects.get(id=1)
 
-    order_book_entry, created = SimOrderBookEntry.objects.get_or_create(stock_symbol=stock_symbol,
-                                                                        entry_price=msg.commit_price,
-                                                                        entry_direction=msg.commit_direction)
-
-    order_book_entry.total_vol += msg.commit_vol
-    order_book_entry.save(update_fields=['total_vol'])
-    new_order_book_element = SimOrderBookElem.objects.create(entry_belonged=order_book_entry.id,
-                                                             client=principle,
-                                                             direction_committed=msg.commit_direction,
-                                                             price_committed=msg.commit_price,
-                                                             vol_committed=msg.commit_vol,
-                                                             date_committed=market.datetime)
+    new_order = get_order_book(stock_symbol).add_order(SimBookOrder(client=principle,
+                                                                    direction_committed=msg.commit_direction,
+                                                                    price_committed=msg.commit_price,
+                                                                    vol_committed=msg.commit_vol,
+                                                                    date_committed=market.datetime))
 
     SimCommissionElem.objects.create(owner=principle, stock_symbol=stock_symbol, operation=msg.commit_direction,
                                      price_committed=msg.commit_price, vol_committed=msg.commit_vol,
-                                     date_committed=market.datetime, unique_id=new_order_book_element.unique_id)
+                                     date_committed=market.datetime, unique_id=new_order.unique_id)
 
     if msg.commit_direction == 'a':
         # 卖出委托
@@ -274,6 +479,7 @@ def sim_add_commission(msg):
         holding.frozen_vol += msg.commit_vol
         holding.available_vol -= msg.commit_vol
         holding.save(update_fields=['frozen_vol', 'available_vol'])
+        risk_view.update_holding(holding)
 
     elif msg.commit_direction == 'b':
         # 买入委托
@@ -283,159 +489,53 @@ def sim_add_commission(msg):
         principle_object.frozen_cash += freeze
         principle_object.flexible_cash -= freeze
         principle_object.save(update_fields=['frozen_cash', 'flexible_cash'])
+        risk_view.update_client(principle_object)
 
     return True
 
 
 def sim_order_book_matching(commission):
     """
-    将client给出的委托信息与order book中所有order进行撮合交易
+    将client给出的委托信息与order book中所有order进行撮合交易，本次委托产生的全部交易一并结算
+    :param commission: 委托信息
     """
     assert isinstance(commission, SimCommissionMsg)
     assert commission.confirmed is False
 
     stock_symbol = commission.stock_symbol
-    stock_object = SimStock.objects.get(symbol=stock_symbol)
+    settlement = SimSettlement()
     direction = commission.commit_direction
     remaining_vol = commission.commit_vol
     market = SimMarket.objects.get(id=1)
+    order_book = get_order_book(stock_symbol)
 
-    if direction == 'a':
-        # 卖出委托
-        matching_direction = 'b'
-        while not stock_object.is_order_book_empty(matching_direction):
-            best_element = stock_object.get_best_element(matching_direction)
-            if best_element.price_committed < commission.commit_price:
-                # 价格不符合要求，结束撮合
-                break
-            if remaining_vol == 0:
-                # 交易量达成要求，结束撮合
-                break
-            if remaining_vol >= best_element.vol_committed:
-                # 交易发生，order book中的此条挂单被完全交易
-                trade_message = SimTradeMsg(stock_symbol=stock_symbol, initiator=commission.commit_client,
-                                            trade_direction=direction, trade_price=best_element.price_committed,
-                                            trade_vol=best_element.vol_committed, acceptor=best_element.client,
-                                            commission_id=best_element.unique_id, tax_charged=0,
-                                            trade_date=market.datetime, trade_tick=market.tick)
+    if direction == 'a' or direction == 'b':
+        # 买入/卖出委托，在内存order book中按价格优先、时间优先撮合，集合竞价期间不撮合
+        fills = [] if order_book.auction else order_book.match(direction, commission.commit_price, remaining_vol)
+        for best_element, traded_vol in fills:
+            # 交易发生，order book中的此条挂单被完全或部分交易
+            trade_message = SimTradeMsg(stock_symbol=stock_symbol, initiator=commission.commit_client,
+                                        trade_direction=direction, trade_price=best_element.price_committed,
+                                        trade_vol=traded_vol, acceptor=best_element.client,
+                                        commission_id=best_element.unique_id, tax_charged=0,
+                                        trade_date=market.datetime, trade_tick=market.tick)
 
-                # 这应当是并行的
-                sim_instant_trade(trade_message)
-                sim_delayed_trade(trade_message)
-
-                # 记录交易，并删除order book中的挂单
-                stock_object.trading_behaviour(direction, best_element.price_committed, best_element.vol_committed,
-                                               trade_message.trade_date, trade_message.trade_tick)
-                remaining_vol -= best_element.vol_committed
-                best_entry = SimOrderBookEntry.objects.get(id=best_element.entry_belonged)
-                best_entry.total_vol -= best_element.vol_committed
-                if best_entry.total_vol == 0:
-                    best_entry.delete()
-                else:
-                    best_entry.save(update_fields=['total_vol'])
-
-                best_element.delete()
+            settlement.add_trade(trade_message)
+            remaining_vol -= traded_vol
 
-            else:
-                # 交易发生，order book中的此条挂单被部分交易
-                trade_message = SimTradeMsg(stock_symbol=stock_symbol, initiator=commission.commit_client,
-                                            trade_direction=direction, trade_price=best_element.price_committed,
-                                            trade_vol=remaining_vol, acceptor=best_element.client,
-                                            commission_id=best_element.unique_id, tax_charged=0,
-                                            trade_date=market.datetime, trade_tick=market.tick)
-
-                # 这应当是并行的
-                sim_instant_trade(trade_message)
-                sim_delayed_trade(trade_message)
-
-                # 记录交易，并调整order book中的挂单
-                stock_object.trading_behaviour(direction, best_element.price_committed, remaining_vol,
-                                               trade_message.trade_date, trade_message.trade_tick)
-                best_element.vol_committed -= remaining_vol
-                best_entry = SimOrderBookEntry.objects.get(id=best_element.entry_belonged)
-                best_entry.total_vol -= remaining_vol
-                remaining_vol = 0
-                best_element.save(update_fields=['vol_committed'])
-                best_entry.save(update_fields=['total_vol'])
-
-    elif direction == 'b':
-        # 买入委托
-        matching_direction = 'a'
-        while not stock_object.is_order_book_empty(matching_direction):
-            best_element = stock_object.get_best_element(matching_direction)
-            if best_element.price_committed > commission.commit_price:
-                # 价格不符合要求，结束撮合
-                break
-            if remaining_vol == 0:
-                # 交易量达成要求，结束撮合
-                break
-            if remaining_vol >= best_element.vol_committed:
-                # 交易发生，order book中的此条挂单被完全交易
-                trade_message = SimTradeMsg(stock_symbol=stock_symbol, initiator=commission.commit_client,
-                                            trade_direction=direction, trade_price=best_element.price_committed,
-                                            trade_vol=best_element.vol_committed, acceptor=best_element.client,
-                                            commission_id=best_element.unique_id, tax_charged=0,
-                                            trade_date=market.datetime, trade_tick=market.tick)
-
-                # 这应当是并行的
-                sim_instant_trade(trade_message)
-                sim_delayed_trade(trade_message)
-
-                # 记录交易，并删除order book中的挂单
-                stock_object.trading_behaviour(direction, best_element.price_committed, best_element.vol_committed,
-                                               trade_message.trade_date, trade_message.trade_tick)
-                remaining_vol -= best_element.vol_committed
-                best_entry = SimOrderBookEntry.objects.get(id=best_element.entry_belonged)
-                best_entry.total_vol -= best_element.vol_committed
-                if best_entry.total_vol == 0:
-                    best_entry.delete()
-                else:
-                    best_entry.save(update_fields=['total_vol'])
-
-                best_element.delete()
-
-            else:
-                # 交易发生，order book中的此条挂单被部分交易
-                trade_message = SimTradeMsg(stock_symbol=stock_object.symbol, initiator=commission.commit_client,
-                                            trade_direction=direction, trade_price=best_element.price_committed,
-                                            trade_vol=remaining_vol, acceptor=best_element.client,
-                                            commission_id=best_element.unique_id, tax_charged=0,
-                                            trade_date=market.datetime, trade_tick=market.tick)
-
-                # 这应当是并行的
-                sim_instant_trade(trade_message)
-                sim_delayed_trade(trade_message)
-
-                # 记录交易，并调整order book中的挂单
-                stock_object.trading_behaviour(direction, best_element.price_committed, remaining_vol,
-                                               trade_message.trade_date, trade_message.trade_tick)
-                best_element.vol_committed -= remaining_vol
-                best_entry = SimOrderBookEntry.objects.get(id=best_element.entry_belonged)
-                best_entry.total_vol -= remaining_vol
-                remaining_vol = 0
-                best_element.save(update_fields=['vol_committed'])
-                best_entry.save(update_fields=['total_vol'])
+        # 本次委托产生的全部交易一并结算
+        settlement.settle()
 
     elif direction == 'c':
         # 撤单
         assert commission.commission_to_cancel is not None
-        order_book_element_corr = SimOrderBookElem.objects.get(unique_id=commission.commission_to_cancel)
+        order_book_element_corr = order_book.orders.get(commission.commission_to_cancel)
         try:
+            # 撤销的挂单不存在（编号有误或已全部成交）时撤单失败
+            assert order_book_element_corr is not None
             assert commission.commit_client == order_book_element_corr.client
             assert commission.commit_vol <= order_book_element_corr.vol_committed  # 委托撤单的数量
-            order_book_entry = SimOrderBookEntry.objects.get(id=order_book_element_corr.entry_belonged)
-            order_book_entry.total_vol -= commission.commit_vol
-
-            order_book_element_corr.vol_committed -= commission.commit_vol
-            if order_book_element_corr.vol_committed == 0:
-                order_book_element_corr.delete()
-            else:
-                order_book_element_corr.save(update_fields=['vol_committed'])
-
-            if order_book_entry.total_vol == 0:
-                order_book_entry.delete()
-            else:
-                order_book_entry.save(update_fields=['total_vol'])
+            order_book.cancel(commission.commission_to_cancel, commission.commit_vol)
 
             # 确认撤单成功，删除委托信息，解除冻结
             origin_commission = SimCommissionElem.objects.get(unique_id=commission.commission_to_cancel)
@@ -444,6 +544,7 @@ def sim_order_book_matching(commission):
                 holding.frozen_vol -= commission.commit_vol
                 holding.available_vol += commission.commit_vol
                 holding.save(update_fields=['frozen_vol', 'available_vol'])
+                risk_view.update_holding(holding)
             else:
                 assert origin_commission.operation == 'b'
                 freeze = float(commission.commit_price * commission.commit_vol)
@@ -451,6 +552,7 @@ def sim_order_book_matching(commission):
                 client_object.frozen_cash -= freeze
                 client_object.flexible_cash += freeze
                 client_object.save(update_fields=['frozen_cash', 'flexible_cash'])
+                risk_view.update_client(client_object)
             origin_commission.vol_committed -= commission.commit_vol
             if origin_commission.vol_traded == origin_commission.vol_committed:
                 origin_commission.delete()
@@ -461,7 +563,6 @@ def sim_order_book_matching(commission):
             print("撤单失败！")
 
         commission.confirmed = True
-        commission.save()
         return True
 
     else:
@@ -479,6 +580,36 @@ def sim_order_book_matching(commission):
     return True
 
 
+def sim_open_auction(stock_symbol):
+    """
+    开始集合竞价，此后的委托全部挂入order book，直到sim_call_auction
+    """
+    get_order_book(stock_symbol).auction = True
+    journal_auction(stock_symbol, open_auction=True)
+    return True
+
+
+def sim_call_auction(stock_symbol, reference=None):
+    """
+    集合竞价结束，以成交量最大的单一价格撮合期间收集的全部委托，产生的交易一并结算
+    :param reference: 参考价格，多个价格的成交量相同时取最接近的，通常为最新价
+    :return: 成交价，没有成交时为None
+    """
+    journal_auction(stock_symbol, open_auction=False, reference=reference)
+    price, fills = get_order_book(stock_symbol).call_auction(reference)
+    if not fills:
+        return None
+    market = SimMarket.objects.get(id=1)
+    settlement = SimSettlement()
+    for bid, ask, traded_vol in fills:
+        settlement.add_trade(SimTradeMsg(stock_symbol=stock_symbol, initiator=bid.client, trade_direction='b',
+                                         trade_price=price, trade_vol=traded_vol, acceptor=ask.client,
+                                         commission_id=ask.unique_id, initiator_commission_id=bid.unique_id,
+                                         trade_date=market.datetime, trade_tick=market.tick))
+    settlement.settle()
+    return price
+
+
 def sim_commission_handler(new_commission, handle_info=False):
     """
     委托的处理函数，如果接受的委托message合法，则根据处理情况，在数据库中建立委托项/加入order book/建立成交记录
@@ -489,6 +620,7 @@ def sim_commission_handler(new_commission, handle_info=False):
     assert isinstance(new_commission, SimCommissionMsg)
     if not new_commission.is_valid():
         return False
+    record_commission(new_commission)
 
     sim_order_book_matching(new_commission)
 
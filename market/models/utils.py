@@ -1,3 +1,7 @@
+from decimal import Decimal
+import threading
+import queue
+
 import numpy as np
 import pandas as pd
 import h5py
@@ -20,16 +24,90 @@ def generate_random_client_name(name_length=10, chars=string.ascii_uppercase + s
     return ''.join(random.choice(chars) for _ in range(name_length))
 
 
+def price_to_cents(price):
+    """
+    将Decimal/float价格转换为以分为单位的整数
+    """
+    return int(round(price * 100))
+
+
+def cents_to_price(cents):
+    """
+    将以分为单位的整数转换为两位小数的Decimal价格
+    """
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def round_half_even_div(numerator, denominator):
+    """
+    整数除法，结果按ROUND_HALF_EVEN舍入为整数，与Decimal的quantize一致
+    """
+    quotient, remainder = divmod(numerator, denominator)
+    if 2 * remainder > denominator or (2 * remainder == denominator and quotient % 2 == 1):
+        quotient += 1
+    return quotient
+
+
 def get_dts_range(dts, st, ed):
     left = np.searchsorted(dts, st, side="left")
     right = np.searchsorted(dts, ed, side="right")
     return left, right
 
 
+def prefetch(iterator, depth=1):
+    """
+    在后台线程中提前读取iterator的下depth项，iterator在后台线程中被迭代与关闭
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        try:
+            for item in iterator:
+                if not put(('item', item)):
+                    break
+            else:
+                put(('end', None))
+        except BaseException as e:
+            put(('error', e))
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            kind, item = buffer.get()
+            if kind == 'end':
+                break
+            if kind == 'error':
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
 class TickTable:
     def __init__(self, path):
         self.path = path
 
+    def open(self):
+        try:
+            return h5py.File(self.path, "r")
+        except OSError:
+            return h5py.File(self.path + '.h5', "r")
+
     @staticmethod
     def get_keys():
         return ['high', 'low', 'last', 'volume', 'amount', 'a1', 'a2', 'a3', 'a4', 'a5', 'b1', 'b2', 'b3', 'b4', 'b5',
@@ -43,13 +121,8 @@ class TickTable:
         if isinstance(codes, six.string_types):
             codes = [codes]
             is_req_code_list = False
+        h5file = self.open()
         for code in codes:
-            code_path = self.path
-            try:
-                h5file = h5py.File(code_path, "r")
-            except OSError:
-                code_path = code_path + '.h5'
-                h5file = h5py.File(code_path, "r")
             grp = h5file.get(code)
             if grp is None:
                 continue
@@ -74,9 +147,69 @@ class TickTable:
                     df = pd.DataFrame(data=data, index=dts)
                     df.index.name = "datetime"
                 result.append(df)
+        h5file.close()
         result = pd.concat(result, axis=0)
         return result
 
+    def stream(self, codes, start_dt=None, end_dt=None, keys=None, chunk_size=100000, by_day=False,
+               prefetch_depth=1):
+        """
+        分块读取一支或多支股票的数据，读取过程中文件保持打开，读完或生成器关闭时关闭
+        :param chunk_size: 每块的记录数
+        :param by_day: 是否按日对齐，为True时每块包含若干完整的交易日（至少一日），记录数不超过chunk_size
+        :param prefetch_depth: 后台线程预读的块数，为0时不预读
+        :return: 生成(code, chunk)，chunk为numpy structured array，包含datetime与keys中的字段
+        """
+        if keys is None:
+            keys = self.get_keys()
+        if isinstance(codes, six.string_types):
+            codes = [codes]
+        chunks = self._iter_chunks(codes, start_dt, end_dt, keys, chunk_size, by_day)
+        if prefetch_depth > 0:
+            chunks = prefetch(chunks, prefetch_depth)
+        return chunks
+
+    def _iter_chunks(self, codes, start_dt, end_dt, keys, chunk_size, by_day):
+        with self.open() as h5file:
+            for code in codes:
+                grp = h5file.get(code)
+                if grp is None:
+                    continue
+                dts_array = grp["datetime"][:]
+                if len(dts_array) == 0:
+                    continue
+                start_dt_code = start_dt or dts_array[0]
+                end_dt_code = end_dt or dts_array[-1]
+                left, right = get_dts_range(dts_array, start_dt_code, end_dt_code)
+                dtype = [('datetime', dts_array.dtype)] + [(key, grp[key].dtype) for key in keys]
+                for chunk_left, chunk_right in get_chunk_ranges(dts_array, left, right, chunk_size, by_day):
+                    chunk = np.empty(chunk_right - chunk_left, dtype=dtype)
+                    chunk['datetime'] = dts_array[chunk_left: chunk_right]
+                    for key in keys:
+                        chunk[key] = grp[key][chunk_left: chunk_right]
+                    yield code, chunk
+
+
+def get_chunk_ranges(dts, left, right, chunk_size, by_day=False):
+    """
+    将[left, right)的记录划分为若干块
+    :param by_day: 是否按日对齐，为True时块的边界总在两个交易日之间，单日记录数超过chunk_size时该日单独成块
+    :return: [(chunk_left, chunk_right)]
+    """
+    if not by_day:
+        return [(i, min(i + chunk_size, right)) for i in range(left, right, chunk_size)]
+    days = np.asarray(dts[left: right]) // 1000000000
+    day_starts = (np.flatnonzero(days[1:] != days[:-1]) + 1 + left).tolist() + [right]
+    ranges = []
+    chunk_left = left
+    for i in range(len(day_starts) - 1):
+        if day_starts[i + 1] - chunk_left > chunk_size and day_starts[i] > chunk_left:
+            ranges.append((chunk_left, day_starts[i]))
+            chunk_left = day_starts[i]
+    if chunk_left < right:
+        ranges.append((chunk_left, right))
+    return ranges
+
 
 def get_timestamp_from_int(cur_time):
     cur_time = str(cur_time)
@@ -95,6 +228,49 @@ def get_int_from_timestamp(cur_timestamp):
     return cur_time
 
 
+def int_to_datetime64(int_datetimes):
+    """
+    将整数形式的时间数组（如20180102093003000）批量转换为datetime64[us]，
+    与get_timestamp_from_int一致，末三位作为microsecond
+    """
+    values = np.asarray(int_datetimes, dtype=np.int64)
+    microsecond = values % 1000
+    values = values // 1000
+    second = values % 100
+    values = values // 100
+    minute = values % 100
+    values = values // 100
+    hour = values % 100
+    values = values // 100
+    day = values % 100
+    values = values // 100
+    month = values % 100
+    year = values // 100
+    dates = ((year - 1970) * 12 + month - 1).astype('datetime64[M]').astype('datetime64[D]') + \
+        (day - 1).astype('timedelta64[D]')
+    micros = ((hour * 60 + minute) * 60 + second) * 1000000 + microsecond
+    return dates.astype('datetime64[us]') + micros.astype('timedelta64[us]')
+
+
+def datetime64_to_int(datetimes):
+    """
+    将datetime64数组批量转换为整数形式的时间（如20180102093003000），int_to_datetime64的逆运算
+    """
+    datetimes = np.asarray(datetimes).astype('datetime64[us]')
+    days = datetimes.astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    years = months.astype('datetime64[Y]')
+    year = years.astype(np.int64) + 1970
+    month = months.astype(np.int64) - (year - 1970) * 12 + 1
+    day = (days - months).astype(np.int64) + 1
+    micros = (datetimes - days).astype(np.int64)
+    hour = micros // 3600000000
+    minute = micros // 60000000 % 60
+    second = micros // 1000000 % 60
+    microsecond = micros % 1000000
+    return ((((year * 100 + month) * 100 + day) * 100 + hour) * 100 + minute) * 100000 + second * 1000 + microsecond
+
+
 def get_next_timestamp(cur_timestamp, interval):
     assert interval % 3 == 0 and interval < 60
 
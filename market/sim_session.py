@@ -0,0 +1,677 @@
+# _*_ coding:UTF-8 _*_
+
+"""
+该文件定义了完全在内存中运行的模拟市场会话SimMarketSession，供GAIL等需要大量rollout的训练使用。
+会话持有市场时钟、股票、client、持仓、委托和order book，全部是带__slots__的普通Python对象，
+锚定、下单、撤单、撮合与结算的语义与simulator_main、sim_trades中基于数据库的流程一致，但完全不访问数据库。
+锚定所需的截面从列式tick存储中读取。
+price_ticks为True时，会话内部（order book、撮合、结算）的价格均为以分为单位的整数，
+只在act的输入、get_order_book_data与observe的输出处与Decimal价格相互换算，结果与Decimal价格时一致。
+"""
+
+from decimal import Decimal
+
+from .models.config import CASH, PRICE_QUANTUM, TAX_FACTOR, INTEGER_PRICE_TICKS
+from .models.sim_order_book import SimOrderBook, SimBookOrder
+from .models.sim_stocks import SimStockSlice
+from .models.sim_tick_store import get_tick_columns
+from .models.utils import price_to_cents, cents_to_price, round_half_even_div
+from .calculations import is_call_auction_time
+
+
+class SessionStock:
+    """
+    会话中的一支股票，字段与SimStock一致
+    """
+    __slots__ = ('symbol', 'last_price', 'low', 'high', 'limit_up', 'limit_down', 'volume', 'amount', 'price_ticks')
+
+    def __init__(self, symbol, price_ticks=False):
+        self.symbol = symbol
+        self.price_ticks = price_ticks
+        self.reset()
+
+    def reset(self):
+        self.last_price = None
+        self.low = None
+        self.high = None
+        self.limit_up = None
+        self.limit_down = None
+        self.volume = 0
+        self.amount = 0
+
+    def trading_behaviour(self, price, vol):
+        """
+        发生了一次交易，进行一次更新
+        """
+        self.last_price = price
+        if price < self.low:
+            self.low = price
+        if price > self.high:
+            self.high = price
+        self.volume += vol
+        self.amount += price * vol / 100 if self.price_ticks else float(price * vol)
+
+
+class SessionClient:
+    """
+    会话中的一个client，只保留与交易相关的资金字段
+    """
+    __slots__ = ('id', 'cash', 'frozen_cash', 'flexible_cash')
+
+    def __init__(self, client_id, cash=CASH):
+        self.id = client_id
+        self.cash = cash
+        self.frozen_cash = 0
+        self.flexible_cash = cash
+
+
+class SessionHolding:
+    """
+    会话中client的一条持仓，字段与SimHoldingElem一致
+    """
+    __slots__ = ('owner', 'stock_symbol', 'vol', 'frozen_vol', 'available_vol', 'cost', 'price_guaranteed',
+                 'last_price', 'profit', 'value', 'date_bought')
+
+    def __init__(self, owner, stock_symbol, date_bought, vol=0, frozen_vol=0, available_vol=0, cost=0,
+                 price_guaranteed=0, last_price=0, profit=0, value=0):
+        self.owner = owner
+        self.stock_symbol = stock_symbol
+        self.vol = vol
+        self.frozen_vol = frozen_vol
+        self.available_vol = available_vol
+        self.cost = cost
+        self.price_guaranteed = price_guaranteed
+        self.last_price = last_price
+        self.profit = profit
+        self.value = value
+        self.date_bought = date_bought
+
+
+class SessionCommission:
+    """
+    会话中client的一条委托，字段与SimCommissionElem一致
+    """
+    __slots__ = ('unique_id', 'owner', 'stock_symbol', 'operation', 'price_committed', 'vol_committed',
+                 'price_traded', 'vol_traded', 'date_committed')
+
+    def __init__(self, unique_id, owner, stock_symbol, operation, price_committed, vol_committed, date_committed,
+                 price_traded=Decimal(0)):
+        self.unique_id = unique_id
+        self.owner = owner
+        self.stock_symbol = stock_symbol
+        self.operation = operation
+        self.price_committed = price_committed
+        self.vol_committed = vol_committed
+        self.price_traded = price_traded
+        self.vol_traded = 0
+        self.date_committed = date_committed
+
+
+class SessionTransaction:
+    """
+    会话中的一条成交记录，字段与SimTransactionElem一致
+    """
+    __slots__ = ('one_side', 'the_other_side', 'stock_symbol', 'operation', 'price_traded', 'vol_traded',
+                 'date_traded')
+
+    def __init__(self, one_side, the_other_side, stock_symbol, operation, price_traded, vol_traded, date_traded):
+        self.one_side = one_side
+        self.the_other_side = the_other_side
+        self.stock_symbol = stock_symbol
+        self.operation = operation
+        self.price_traded = price_traded
+        self.vol_traded = vol_traded
+        self.date_traded = date_traded
+
+
+def get_slots(obj):
+    return tuple(getattr(obj, slot) for slot in obj.__slots__)
+
+
+def set_slots(obj, values):
+    """
+    按__slots__的顺序设置对象的属性，用于从检查点恢复
+    """
+    for slot, value in zip(obj.__slots__, values):
+        setattr(obj, slot, value)
+    return obj
+
+
+class SimMarketSession:
+    """
+    一个纯内存的模拟市场。同一进程中可以同时存在多个相互独立的会话。
+    """
+
+    def __init__(self, super_client_id, symbols=(), price_ticks=INTEGER_PRICE_TICKS):
+        """
+        :param super_client_id: 超级用户的ID，锚定时由其建立持仓并挂单
+        :param symbols: 会话中的股票，锚定时会自动加入
+        :param price_ticks: 会话内部是否以分为单位的整数表示价格
+        """
+        self.super_client_id = super_client_id
+        self.price_ticks = price_ticks
+        self.datetime = None
+        self.tick = 0
+        self.next_order_id = 1  # 会话内单调递增的挂单/委托编号
+
+        self.stocks = {}  # symbol -> SessionStock
+        self.clients = {}  # client_id -> SessionClient
+        self.holdings = {}  # (owner, symbol) -> SessionHolding
+        self.commissions = {}  # unique_id -> SessionCommission，按委托的先后顺序
+        self.order_books = {}  # symbol -> SimOrderBook
+        self.transactions = []
+
+        for symbol in symbols:
+            self.add_stock(symbol)
+        self.reset()
+
+    def add_stock(self, symbol):
+        stock = self.stocks.get(symbol)
+        if stock is None:
+            stock = SessionStock(symbol, self.price_ticks)
+            self.stocks[symbol] = stock
+            self.order_books[symbol] = SimOrderBook(symbol)
+        return stock
+
+    def add_client(self, client_id, cash=CASH):
+        client = SessionClient(client_id, cash)
+        self.clients[client_id] = client
+        return client
+
+    def reset(self):
+        """
+        与simulator_resetter相同：删除超级用户以外的client与全部持仓、委托、成交，清空全部股票的状态和order book
+        """
+        self.clients = {}
+        self.holdings = {}
+        self.commissions = {}
+        self.transactions = []
+        for symbol, stock in self.stocks.items():
+            stock.reset()
+            self.order_books[symbol].clear()
+        self.add_client(self.super_client_id, 100000000)
+        self.datetime = None
+        self.tick = 0
+        self.next_order_id = 1
+        return True
+
+    def to_tick(self, price):
+        """
+        将Decimal价格换算为会话内部的价格，已经是以分为单位的整数时不做换算
+        """
+        if self.price_ticks and not isinstance(price, int):
+            return price_to_cents(price)
+        return price
+
+    def to_price(self, price):
+        """
+        将会话内部的价格换算为Decimal价格
+        """
+        if self.price_ticks and price is not None:
+            return cents_to_price(price)
+        return price
+
+    def to_float(self, price):
+        """
+        与float(price)的结果一致
+        """
+        return price / 100 if self.price_ticks else float(price)
+
+    def money(self, price, vol):
+        """
+        与float(price * vol)的结果一致：整数分的乘积是精确的，除以100只舍入一次
+        """
+        return price * vol / 100 if self.price_ticks else float(price * vol)
+
+    def average_price(self, price_a, vol_a, price_b, vol_b):
+        """
+        两部分成交的均价，与Decimal计算后quantize到分的结果一致
+        """
+        if self.price_ticks:
+            return round_half_even_div(price_a * vol_a + price_b * vol_b, vol_a + vol_b)
+        return Decimal((price_a * vol_a + price_b * vol_b) / (vol_a + vol_b)).quantize(PRICE_QUANTUM)
+
+    def checkpoint(self):
+        """
+        记录会话的全部状态：市场时钟、股票、client、持仓、委托、成交和order book
+        :return: 由元组组成的检查点，不与会话共享任何可变对象，可以多次恢复
+        """
+        return {
+            'price_ticks': self.price_ticks,
+            'clock': (self.datetime, self.tick, self.next_order_id),
+            'stocks': tuple(get_slots(stock) for stock in self.stocks.values()),
+            'clients': tuple((client.id, client.cash, client.frozen_cash, client.flexible_cash)
+                             for client in self.clients.values()),
+            'holdings': tuple(get_slots(holding) for holding in self.holdings.values()),
+            'commissions': tuple(get_slots(commission) for commission in self.commissions.values()),
+            # 成交记录创建后不再修改，直接共享
+            'transactions': tuple(self.transactions),
+            'order_books': tuple((symbol, book.snapshot()) for symbol, book in self.order_books.items()),
+        }
+
+    def restore(self, checkpoint):
+        """
+        将会话恢复到checkpoint时的状态
+        """
+        assert checkpoint['price_ticks'] == self.price_ticks
+        self.datetime, self.tick, self.next_order_id = checkpoint['clock']
+        symbols = set()
+        for values in checkpoint['stocks']:
+            stock = self.add_stock(values[0])
+            set_slots(stock, values)
+            symbols.add(stock.symbol)
+        for symbol, stock in self.stocks.items():
+            if symbol not in symbols:
+                # 检查点之后才加入的股票
+                stock.reset()
+                self.order_books[symbol].clear()
+        self.clients = {}
+        for client_id, cash, frozen_cash, flexible_cash in checkpoint['clients']:
+            client = self.add_client(client_id, cash)
+            client.frozen_cash = frozen_cash
+            client.flexible_cash = flexible_cash
+        self.holdings = {}
+        for values in checkpoint['holdings']:
+            holding = set_slots(SessionHolding.__new__(SessionHolding), values)
+            self.holdings[(holding.owner, holding.stock_symbol)] = holding
+        self.commissions = {}
+        for values in checkpoint['commissions']:
+            commission = set_slots(SessionCommission.__new__(SessionCommission), values)
+            self.commissions[commission.unique_id] = commission
+        self.transactions = list(checkpoint['transactions'])
+        for symbol, snapshot in checkpoint['order_books']:
+            self.order_books[symbol].restore(snapshot)
+        return True
+
+    def advance(self, next_datetime):
+        """
+        市场时钟前进一个tick
+        """
+        self.datetime = next_datetime
+        self.tick += 1
+        return True
+
+    def anchor_stock(self, symbol, ach):
+        """
+        将股票的状态锚定到anchor位置，不建立持仓和挂单
+        :param ach: SimStockSlice，或截面的时间（从列式tick存储中读取）
+        :return: anchor位置的SimStockSlice
+        """
+        stock = self.add_stock(symbol)
+        if not isinstance(ach, SimStockSlice):
+            tick_columns = get_tick_columns(symbol)
+            anchor = tick_columns.to_slice(tick_columns.index_of(ach))
+        else:
+            anchor = ach
+        if self.datetime is None:
+            self.datetime = anchor.datetime
+
+        stock.last_price = self.to_tick(anchor.last_price)
+        stock.high = self.to_tick(anchor.high)
+        stock.low = self.to_tick(anchor.low)
+        # 与保存到DecimalField后读出的值一致
+        stock.limit_up = self.to_tick((anchor.open * Decimal(1.1)).quantize(PRICE_QUANTUM))
+        stock.limit_down = self.to_tick((anchor.open * Decimal(0.9)).quantize(PRICE_QUANTUM))
+        stock.amount = anchor.amount
+        stock.volume = anchor.volume
+        return anchor
+
+    def anchor(self, symbol, ach):
+        """
+        与anchor_one_stock相同，将股票锚定到anchor位置的状态，由超级用户按五档盘口建立持仓并挂单
+        :param ach: SimStockSlice，或截面的时间（从列式tick存储中读取）
+        """
+        anchor = self.anchor_stock(symbol, ach)
+        if anchor.a1 == 0 and anchor.b1 == 0:
+            # anchor位置可能是集合竞价时段或其他特殊情况，没有盘口，判断为无法交易
+            return True
+
+        client_id = self.super_client_id
+        auction = is_call_auction_time(anchor.datetime)
+        if auction:
+            self.open_auction(symbol)
+        for level in range(5, 0, -1):
+            price = self.to_tick(getattr(anchor, 'a{}'.format(level)))
+            if price != 0:
+                vol = getattr(anchor, 'a{}_v'.format(level))
+                self.credit_holding(client_id, symbol, vol, anchor.datetime)
+                self.commit(client_id, symbol, 'a', price, vol)
+        for level in range(1, 6):
+            price = self.to_tick(getattr(anchor, 'b{}'.format(level)))
+            if price != 0:
+                vol = getattr(anchor, 'b{}_v'.format(level))
+                self.credit_cash(client_id, self.money(price, vol))
+                self.commit(client_id, symbol, 'b', price, vol)
+        if auction:
+            self.call_auction(symbol, anchor.last_price)
+        return True
+
+    def credit_holding(self, client_id, symbol, vol, date_bought=None):
+        """
+        超级用户挂卖单前注入持仓
+        """
+        holding = self.holdings.get((client_id, symbol))
+        if holding is None:
+            holding = SessionHolding(client_id, symbol, date_bought or self.datetime)
+            self.holdings[(client_id, symbol)] = holding
+        holding.vol += vol
+        holding.available_vol += vol
+        return holding
+
+    def credit_cash(self, client_id, amount):
+        """
+        超级用户挂买单前注入资金
+        """
+        client = self.clients[client_id]
+        client.cash += amount
+        client.flexible_cash += amount
+        return client
+
+    def act(self, actions, symbol='000009.XSHE', client_id=None):
+        """
+        与act_according_to_calculated_actions相同，由超级用户执行一个tick的交易动作
+        :param actions: [(direction, price, vol)]，price为Decimal价格或以分为单位的整数
+        """
+        if client_id is None:
+            client_id = self.super_client_id
+
+        self.erase_out_of_level(client_id, symbol)
+        for direction, price, vol in actions:
+            price = self.to_tick(price)
+            if direction == 'a':
+                self.credit_holding(client_id, symbol, vol)
+                self.commit(client_id, symbol, 'a', price, vol)
+            elif direction == 'b':
+                self.credit_cash(client_id, self.to_float(price) * vol)
+                self.commit(client_id, symbol, 'b', price, vol)
+            elif direction == 'c':
+                self.cancel(client_id, symbol, price, vol)
+            else:
+                raise ValueError('Invalid Actions in function: act()!')
+        return True
+
+    def cancel(self, client_id, symbol, price, vol):
+        """
+        与sim_cancel相同，从最新的委托开始，撤去client在price上共vol数量的委托
+        """
+        remaining_vol = vol
+        for order in reversed(self.order_books[symbol].get_client_orders(client_id, price)):
+            if remaining_vol == 0:
+                break
+            rest_vol = min(order.vol_committed, remaining_vol)
+            self.commit(client_id, symbol, 'c', price, rest_vol, order.unique_id)
+            remaining_vol -= rest_vol
+        return True
+
+    def erase_out_of_level(self, client_id, symbol, level=5):
+        """
+        与sim_erase_data_out_of_level相同，撤去client在五档之外的全部挂单
+        """
+        client = self.clients[client_id]
+        for order in self.order_books[symbol].remove_levels_beyond(level, client=client_id):
+            if order.direction_committed == 'a':
+                holding = self.holdings[(client_id, symbol)]
+                holding.frozen_vol -= order.vol_committed
+                holding.available_vol += order.vol_committed
+            else:
+                freeze = self.money(order.price_committed, order.vol_committed)
+                client.frozen_cash -= freeze
+                client.flexible_cash += freeze
+            del self.commissions[order.unique_id]
+        return True
+
+    def is_valid(self, client_id, symbol, direction, price, vol, commission_to_cancel=None):
+        """
+        与SimCommissionMsg.is_valid相同，判断委托信息是否合法
+        """
+        stock = self.stocks.get(symbol)
+        if stock is None:
+            print('The STOCK COMMITTED DOES NOT EXIST!')
+            return False
+        if stock.limit_up and stock.limit_down:
+            if price > stock.limit_up or price < stock.limit_down:
+                print('COMMIT PRICE MUST BE BETWEEN THE LIMIT UP AND THE LIMIT DOWN!')
+                return False
+        if direction not in ['a', 'b', 'c']:
+            print('COMMIT DIRECTION INVALID!')
+            return False
+
+        client = self.clients[client_id]
+        if direction == 'a':
+            holding = self.holdings.get((client_id, symbol))
+            if holding is None:
+                print('DOES NOT HOLD THE STOCK!')
+                return False
+            if holding.available_vol < vol:
+                print('DOES NOT HOLD ENOUGH STOCK SHARES!')
+                return False
+        elif direction == 'b':
+            if client.flexible_cash < (price * vol * TAX_FACTOR / 100 if self.price_ticks else
+                                       price * vol * TAX_FACTOR):
+                print('CAN NOT AFFORD THE FROZEN CASH!')
+                return False
+        elif direction == 'c':
+            if commission_to_cancel is None:
+                print('COMMISSION CANCELED IS NONE!')
+                return False
+        return True
+
+    def commit(self, client_id, symbol, direction, price, vol, commission_to_cancel=None):
+        """
+        与sim_commission_handler相同，处理一个委托：撮合、结算，未成交的部分挂入order book
+        :return: 委托合法则返回True
+        """
+        if not self.is_valid(client_id, symbol, direction, price, vol, commission_to_cancel):
+            return False
+
+        order_book = self.order_books[symbol]
+        if direction == 'c':
+            self._cancel_commission(client_id, symbol, price, vol, commission_to_cancel)
+            return True
+
+        remaining_vol = vol
+        if not order_book.auction:
+            for order, traded_vol in order_book.match(direction, price, vol):
+                self._settle(symbol, client_id, direction, order, traded_vol)
+                remaining_vol -= traded_vol
+        if remaining_vol > 0:
+            self._add_commission(client_id, symbol, direction, price, remaining_vol)
+        return True
+
+    def open_auction(self, symbol):
+        """
+        与sim_open_auction相同，开始集合竞价，此后的委托全部挂入order book
+        """
+        self.order_books[symbol].auction = True
+        return True
+
+    def call_auction(self, symbol, reference=None):
+        """
+        与sim_call_auction相同，以单一价格撮合集合竞价期间收集的全部委托
+        :param reference: 参考价格，默认为最新价
+        :return: 成交价，没有成交时为None
+        """
+        if reference is None:
+            reference = self.stocks[symbol].last_price
+        price, fills = self.order_books[symbol].call_auction(self.to_tick(reference) if reference is not None else None)
+        for bid, ask, traded_vol in fills:
+            # 买方的委托按委托价解除冻结，之后与即时成交相同地结算
+            commission = self.commissions[bid.unique_id]
+            assert commission.vol_traded + traded_vol <= commission.vol_committed
+            commission.price_traded = self.average_price(commission.price_traded, commission.vol_traded, price,
+                                                         traded_vol)
+            commission.vol_traded += traded_vol
+            if commission.vol_traded == commission.vol_committed:
+                del self.commissions[bid.unique_id]
+            client = self.clients[bid.client]
+            freeze = self.money(bid.price_committed, traded_vol)
+            client.frozen_cash -= freeze
+            client.flexible_cash += freeze
+            self._settle(symbol, bid.client, 'b', ask, traded_vol, price)
+        return price if fills else None
+
+    def _cancel_commission(self, client_id, symbol, price, vol, commission_to_cancel):
+        order = self.order_books[symbol].orders.get(commission_to_cancel)
+        if order is None or client_id != order.client or vol > order.vol_committed:
+            print("撤单失败！")
+            return False
+        self.order_books[symbol].cancel(commission_to_cancel, vol)
+
+        # 确认撤单成功，删除委托信息，解除冻结
+        origin_commission = self.commissions[commission_to_cancel]
+        if origin_commission.operation == 'a':
+            holding = self.holdings[(client_id, symbol)]
+            holding.frozen_vol -= vol
+            holding.available_vol += vol
+        else:
+            assert origin_commission.operation == 'b'
+            freeze = self.money(price, vol)
+            client = self.clients[client_id]
+            client.frozen_cash -= freeze
+            client.flexible_cash += freeze
+        origin_commission.vol_committed -= vol
+        if origin_commission.vol_traded == origin_commission.vol_committed:
+            del self.commissions[commission_to_cancel]
+        return True
+
+    def _add_commission(self, client_id, symbol, direction, price, vol):
+        """
+        与sim_add_commission相同，委托未成交的部分挂入order book，冻结相应的持仓或资金
+        """
+        order = self.order_books[symbol].add_order(SimBookOrder(client=client_id, direction_committed=direction,
+                                                                price_committed=price, vol_committed=vol,
+                                                                date_committed=self.datetime,
+                                                                unique_id=self.next_order_id))
+        self.next_order_id += 1
+        self.commissions[order.unique_id] = SessionCommission(order.unique_id, client_id, symbol, direction, price,
+                                                              vol, self.datetime, 0 if self.price_ticks else Decimal(0))
+        if direction == 'a':
+            holding = self.holdings[(client_id, symbol)]
+            assert vol <= holding.available_vol
+            holding.frozen_vol += vol
+            holding.available_vol -= vol
+        elif direction == 'b':
+            client = self.clients[client_id]
+            freeze = self.money(price, vol)
+            assert freeze <= client.flexible_cash
+            client.frozen_cash += freeze
+            client.flexible_cash -= freeze
+        return True
+
+    def _settle(self, symbol, initiator, direction, order, traded_vol, price=None):
+        """
+        结算一笔成交，与sim_instant_trade、sim_delayed_trade相同，不收取税费
+        :param price: 成交价，默认为被交易挂单的价格
+        """
+        if price is None:
+            price = order.price_committed
+        acceptor = order.client
+        stock = self.stocks[symbol]
+        tax_charged = 0
+        self.transactions.append(SessionTransaction(initiator, acceptor, symbol, direction, price, traded_vol,
+                                                    self.datetime))
+
+        # 发起方
+        initiator_object = self.clients[initiator]
+        if direction == 'a':
+            holding = self.holdings[(initiator, symbol)]
+            assert holding.available_vol >= traded_vol
+            holding.available_vol -= traded_vol
+            holding.vol -= traded_vol
+            if holding.vol == 0:
+                del self.holdings[(initiator, symbol)]
+            earning = self.money(price, traded_vol) - tax_charged
+            initiator_object.cash += earning
+            initiator_object.flexible_cash += earning
+        else:
+            self._build_holding(initiator, stock, price, traded_vol, tax_charged)
+            spending = self.money(price, traded_vol) + tax_charged
+            initiator_object.cash -= spending
+            initiator_object.flexible_cash -= spending
+
+        # 接受方的委托
+        acceptor_object = self.clients[acceptor]
+        commission = self.commissions[order.unique_id]
+        assert commission.vol_traded + traded_vol <= commission.vol_committed
+        commission.price_traded = self.average_price(commission.price_traded, commission.vol_traded, price, traded_vol)
+        commission.vol_traded += traded_vol
+        if commission.vol_traded == commission.vol_committed:
+            del self.commissions[order.unique_id]
+
+        # 接受方
+        if direction == 'b':
+            holding = self.holdings[(acceptor, symbol)]
+            assert holding.frozen_vol >= traded_vol
+            holding.frozen_vol -= traded_vol
+            holding.vol -= traded_vol
+            if holding.vol == 0:
+                del self.holdings[(acceptor, symbol)]
+            earning = self.money(price, traded_vol) - tax_charged
+            acceptor_object.cash += earning
+            acceptor_object.flexible_cash += earning
+        else:
+            self._build_holding(acceptor, stock, price, traded_vol, tax_charged)
+            spending = self.money(price, traded_vol) + tax_charged
+            acceptor_object.cash -= spending
+            acceptor_object.frozen_cash -= spending
+
+        stock.trading_behaviour(price, traded_vol)
+        return True
+
+    def _build_holding(self, owner, stock, price, vol, tax_charged):
+        """
+        与sim_build_holding相同，买入成交后建仓或加仓
+        """
+        holding = self.holdings.get((owner, stock.symbol))
+        if holding is not None:
+            holding.cost = self.average_price(holding.cost, holding.vol, price, vol)
+            holding.price_guaranteed = holding.cost
+            holding.last_price = stock.last_price
+            holding.vol += vol
+            holding.available_vol += vol
+            holding.profit -= tax_charged
+            holding.value = self.to_float(stock.last_price) * holding.vol
+        else:
+            self.holdings[(owner, stock.symbol)] = SessionHolding(owner, stock.symbol, self.datetime, vol=vol,
+                                                                  available_vol=vol, cost=price,
+                                                                  price_guaranteed=price,
+                                                                  last_price=stock.last_price, profit=-tax_charged,
+                                                                  value=self.money(stock.last_price, vol))
+        return True
+
+    def get_order_book_data(self, symbol, level=5, to_list=False):
+        """
+        与SimStock.get_order_book_data相同，获得指定level的盘口数据，level为-1时获得全部order book数据
+        价格为Decimal价格
+        """
+        data = self.order_books[symbol].get_order_book_data(level, to_list)
+        if not self.price_ticks:
+            return data
+        if to_list:
+            return [self.to_price(item) if i % 2 == 0 and item != 0 else item for i, item in enumerate(data)]
+        ask_info, bid_info = data
+        return [(self.to_price(price), vol) for price, vol in ask_info], \
+            [(self.to_price(price), vol) for price, vol in bid_info]
+
+    def observe(self, symbol='000009.XSHE'):
+        """
+        五档盘口数据，以及最新价、最高价、最低价、成交量、成交额，共25项
+        """
+        stock = self.stocks[symbol]
+        if self.price_ticks:
+            # 观测中的价格以元为单位，与Decimal价格转换为浮点数的结果一致
+            ob = [item / 100 if i % 2 == 0 else item for i, item in
+                  enumerate(self.order_books[symbol].get_order_book_data(level=5, to_list=True))]
+            ob.append(stock.last_price / 100)
+            ob.append(stock.high / 100)
+            ob.append(stock.low / 100)
+            ob.append(stock.volume)
+            ob.append(stock.amount)
+            return ob
+        ob = self.get_order_book_data(symbol, level=5, to_list=True)
+        ob.append(stock.last_price)
+        ob.append(stock.high)
+        ob.append(stock.low)
+        ob.append(stock.volume)
+        ob.append(stock.amount)
+        return ob
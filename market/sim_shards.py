@@ -0,0 +1,303 @@
+# _*_ coding:UTF-8 _*_
+
+"""
+该文件定义了按股票分片的多进程模拟。
+全部股票按代码分配到若干个子进程，每个子进程持有一个只包含自己股票的SimMarketSession，
+这些股票的order book与委托流只在该进程中撮合，持仓按(client, symbol)天然分属各个进程。
+client的资金是唯一跨股票的状态，由父进程中的总账统一结算：每个tick开始时各进程收到总账，
+tick结束时返回各client资金的变化，父进程汇总后进入下一个tick。
+每个tick开始时，各client的可用资金平均分给本tick有委托的各进程，各进程只能动用分到的部分，
+因此同一笔资金不会在多个进程中被重复使用，汇总后的资金不会为负。
+父进程等待全部进程完成一个tick后才推进市场时钟，因此各股票的时钟保持一致。
+"""
+
+import multiprocessing
+from multiprocessing import Pipe
+
+from django.db import connections
+
+from .models.config import INTEGER_PRICE_TICKS
+from .models.sim_reset import SUPERUSER_CASH
+from .models.sim_tick_store import get_tick_columns
+from .models.utils import get_int_from_timestamp
+from .action_cache import get_action_cache, get_tick_action
+from .sim_session import SimMarketSession
+
+
+def get_ledger(session):
+    """
+    :return: client_id -> (cash, frozen_cash, flexible_cash)
+    """
+    return dict((client_id, (client.cash, client.frozen_cash, client.flexible_cash))
+                for client_id, client in session.clients.items())
+
+
+def set_ledger(session, ledger):
+    for client_id, (cash, frozen_cash, flexible_cash) in ledger.items():
+        client = session.clients.get(client_id)
+        if client is None:
+            client = session.add_client(client_id)
+        client.cash = cash
+        client.frozen_cash = frozen_cash
+        client.flexible_cash = flexible_cash
+    return True
+
+
+def split_ledger(ledger, num_parts):
+    """
+    将各client的可用资金平均分成num_parts份，总资金与冻结资金不变，除不尽的部分归入最后一份
+    :return: num_parts个总账的列表
+    """
+    ledgers = [{} for _ in range(num_parts)]
+    for client_id, (cash, frozen_cash, flexible_cash) in ledger.items():
+        if isinstance(flexible_cash, int):
+            share = flexible_cash // num_parts
+        else:
+            share = flexible_cash / num_parts
+        for i in range(num_parts - 1):
+            ledgers[i][client_id] = (cash, frozen_cash, share)
+        ledgers[-1][client_id] = (cash, frozen_cash, flexible_cash - share * (num_parts - 1))
+    return ledgers
+
+
+def get_ledger_changes(session, ledger):
+    """
+    :return: 相对于ledger，各client资金的变化
+    """
+    changes = {}
+    for client_id, values in get_ledger(session).items():
+        origin = ledger.get(client_id, (0, 0, 0))
+        change = tuple(value - origin_value for value, origin_value in zip(values, origin))
+        if any(change):
+            changes[client_id] = change
+    return changes
+
+
+def replay_one_tick(session, symbol, next_datetime):
+    """
+    按tick数据计算股票从当前时间到next_datetime的交易动作并执行
+    各股票的截面时间不必与市场时钟对齐：从当前时间之前（含）最近的截面开始，
+    依次执行结束时间落在(当前时间, next_datetime]内的每一对相邻截面
+    :return: 执行了交易动作的截面数，为0时表示该股票在这段时间内被跳过
+    """
+    if session.datetime is None:
+        return 0
+    tick_columns = get_tick_columns(symbol)
+    if tick_columns is None:
+        return 0
+    index = tick_columns.as_of(session.datetime)
+    if index is None:
+        # 当前时间早于第一个截面，从第一个截面开始
+        index = 0
+    end = get_int_from_timestamp(next_datetime)
+    replayed = 0
+    while index + 1 < len(tick_columns) and tick_columns.datetime[index + 1] <= end:
+        cur_slice = tick_columns.to_slice(index)
+        actions = get_tick_action(symbol, cur_slice.datetime, cur_slice, tick_columns.to_slice(index + 1))
+        if actions is not None:
+            session.act(actions, symbol)
+            replayed += 1
+        index += 1
+    return replayed
+
+
+def worker(remote, parent_remote, super_client_id, symbols, price_ticks):
+    parent_remote.close()
+    session = SimMarketSession(super_client_id, symbols, price_ticks)
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'reset':
+                session.reset()
+                remote.send(True)
+            elif cmd in ('anchor', 'act', 'replay'):
+                ledger, commands, next_datetime = data
+                set_ledger(session, ledger)
+                if cmd == 'anchor':
+                    session.datetime = next_datetime
+                    result = dict((symbol, session.anchor(symbol, ach)) for symbol, ach in commands.items())
+                elif cmd == 'act':
+                    result = dict((symbol, session.act(actions, symbol)) for symbol, actions in commands.items())
+                    session.advance(next_datetime)
+                else:
+                    result = dict((symbol, replay_one_tick(session, symbol, next_datetime)) for symbol in commands)
+                    session.advance(next_datetime)
+                remote.send((result, get_ledger_changes(session, ledger)))
+            elif cmd == 'observe':
+                remote.send(dict((symbol, session.observe(symbol)) for symbol in data))
+            elif cmd == 'get_order_book_data':
+                symbols, level = data
+                remote.send(dict((symbol, session.get_order_book_data(symbol, level)) for symbol in symbols))
+            elif cmd == 'transactions':
+                remote.send(session.transactions)
+            elif cmd == 'close':
+                remote.close()
+                break
+            else:
+                raise NotImplementedError
+    except KeyboardInterrupt:
+        print('ShardedMarket worker: got KeyboardInterrupt')
+
+
+class ShardedMarket:
+    """
+    多支股票的多进程模拟，接口与SimMarketSession相近，股票相关的参数均为symbol -> 参数的dict
+    """
+
+    def __init__(self, super_client_id, symbols, num_workers=None, price_ticks=INTEGER_PRICE_TICKS):
+        """
+        :param super_client_id: 超级用户的ID
+        :param symbols: 模拟的全部股票
+        :param num_workers: 子进程数，默认为CPU核数，不超过股票数
+        :param price_ticks: 各会话内部是否以分为单位的整数表示价格
+        """
+        symbols = sorted(symbols)
+        num_workers = min(num_workers or multiprocessing.cpu_count(), len(symbols))
+        self.super_client_id = super_client_id
+        self.shards = [symbols[i::num_workers] for i in range(num_workers)]
+        self.shard_of = dict((symbol, i) for i, shard in enumerate(self.shards) for symbol in shard)
+        self.datetime = None
+        self.tick = 0
+        self.skipped = []  # 上一次replay中被跳过的股票
+        self.ledger = {}
+        self.reset_ledger()
+
+        # 在父进程中读入列式tick数据与交易动作缓存，fork出的子进程无需再访问数据库
+        for symbol in symbols:
+            get_tick_columns(symbol)
+            get_action_cache(symbol)
+        # 数据库连接不能跨进程共享
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(num_workers)])
+        self.ps = [context.Process(target=worker, args=(work_remote, remote, super_client_id, shard, price_ticks))
+                   for work_remote, remote, shard in zip(self.work_remotes, self.remotes, self.shards)]
+        for p in self.ps:
+            p.daemon = True
+            p.start()
+        for remote in self.work_remotes:
+            remote.close()
+        self.closed = False
+
+    def reset_ledger(self):
+        self.ledger = {self.super_client_id: (SUPERUSER_CASH, 0, SUPERUSER_CASH)}
+
+    def split(self, commands):
+        """
+        将symbol -> 参数的dict按分片拆开
+        """
+        shard_commands = [{} for _ in self.shards]
+        for symbol, command in commands.items():
+            shard_commands[self.shard_of[symbol]][symbol] = command
+        return shard_commands
+
+    def run(self, cmd, shard_commands, next_datetime):
+        """
+        各进程执行一个tick，全部完成后汇总资金的变化
+        可用资金预先分给本tick有委托的各进程，没有委托的进程只结算已有的挂单，不分得可用资金
+        :return: symbol -> 各股票的执行结果
+        """
+        active = [i for i, commands in enumerate(shard_commands) if commands]
+        idle_ledger = dict((client_id, (cash, frozen_cash, 0))
+                           for client_id, (cash, frozen_cash, _) in self.ledger.items())
+        shard_ledgers = [idle_ledger] * len(self.remotes)
+        for i, ledger in zip(active, split_ledger(self.ledger, max(len(active), 1))):
+            shard_ledgers[i] = ledger
+        for remote, commands, ledger in zip(self.remotes, shard_commands, shard_ledgers):
+            remote.send((cmd, (ledger, commands, next_datetime)))
+        results = {}
+        for remote in self.remotes:
+            result, changes = remote.recv()
+            results.update(result)
+            for client_id, change in changes.items():
+                origin = self.ledger.get(client_id, (0, 0, 0))
+                self.ledger[client_id] = tuple(value + delta for value, delta in zip(origin, change))
+        return results
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        for remote in self.remotes:
+            remote.recv()
+        self.reset_ledger()
+        self.datetime = None
+        self.tick = 0
+        return True
+
+    def anchor(self, anchors, datetime=None):
+        """
+        将各股票并行地锚定到anchor位置
+        :param anchors: symbol -> SimStockSlice或截面的时间
+        :param datetime: 市场时间，默认为第一个anchor的时间
+        """
+        if datetime is None:
+            datetime = self.datetime
+        if datetime is None:
+            ach = next(iter(anchors.values()))
+            datetime = getattr(ach, 'datetime', ach)
+        self.datetime = datetime
+        return self.run('anchor', self.split(anchors), datetime)
+
+    def act(self, actions, next_datetime):
+        """
+        执行一个tick的交易动作后，市场时钟前进到next_datetime
+        :param actions: symbol -> [(direction, price, vol)]
+        """
+        results = self.run('act', self.split(actions), next_datetime)
+        self.datetime = next_datetime
+        self.tick += 1
+        return results
+
+    def replay(self, next_datetime, symbols=None):
+        """
+        各股票按tick数据计算当前时间到next_datetime的交易动作并执行，之后市场时钟前进到next_datetime
+        这段时间内没有可执行截面的股票记在self.skipped中，并打印出来
+        :return: symbol -> 执行了交易动作的截面数
+        """
+        if symbols is None:
+            symbols = self.shard_of.keys()
+        results = self.run('replay', self.split(dict((symbol, None) for symbol in symbols)), next_datetime)
+        self.skipped = sorted(symbol for symbol, replayed in results.items() if not replayed)
+        if self.skipped:
+            print('ShardedMarket: no tick to replay before {} for {}'.format(next_datetime, ', '.join(self.skipped)))
+        self.datetime = next_datetime
+        self.tick += 1
+        return results
+
+    def gather(self, cmd, data_of_shard):
+        for remote, data in zip(self.remotes, data_of_shard):
+            remote.send((cmd, data))
+        results = {}
+        for remote in self.remotes:
+            results.update(remote.recv())
+        return results
+
+    def observe(self, symbols=None):
+        shard_symbols = self.shards if symbols is None else [[symbol for symbol in shard if symbol in symbols]
+                                                              for shard in self.shards]
+        return self.gather('observe', shard_symbols)
+
+    def get_order_book_data(self, symbols=None, level=5):
+        shard_symbols = self.shards if symbols is None else [[symbol for symbol in shard if symbol in symbols]
+                                                              for shard in self.shards]
+        return self.gather('get_order_book_data', [(shard, level) for shard in shard_symbols])
+
+    def get_transactions(self):
+        """
+        :return: 全部成交，按分片依次排列
+        """
+        transactions = []
+        for remote in self.remotes:
+            remote.send(('transactions', None))
+        for remote in self.remotes:
+            transactions.extend(remote.recv())
+        return transactions
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for p in self.ps:
+            p.join()
+        self.closed = True
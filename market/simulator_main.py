@@ -3,10 +3,21 @@ import random
 from decimal import Decimal
 import datetime as dt
 
+from django.db import transaction
+from django.db.models import F
+
 from .models import clients
 from .models import sim_market, sim_clients, sim_stocks
-from .models.sim_trades import SimCommissionMsg, sim_commission_handler
-from .calculations import calc_tick_action
+from .models.sim_trades import SimCommissionMsg, sim_commission_handler, flush_commission_records, record_commission, \
+    sim_open_auction, sim_call_auction
+from .models.sim_order_book import SimBookOrder, get_order_book, flush_order_books
+from .models.sim_trade_tape import flush_trade_tapes
+from .models.sim_risk import risk_view
+from .models.sim_reset import reset_simulation_data
+from .models.sim_journal import journal_is_open, set_journal_clock, journal_holding, journal_cash, journal_anchor
+from .models.sim_tick_store import get_tick_columns
+from .action_cache import get_tick_action
+from .calculations import is_call_auction_time
 from .baselines.baselines import logger
 
 
@@ -31,6 +42,7 @@ def calc_actions_without_check(stock):
     market.datetime = market.anchored_datetime
     market.tick = 0
     market.save()
+    tick_columns = get_tick_columns(stock)
     calc_length = 1000000
     ticks = 0
     total_count = 0
@@ -48,14 +60,13 @@ def calc_actions_without_check(stock):
         datetime = market.datetime
         if datetime.hour == 14 and datetime.minute >= 57:
             continue
-        cur_slice = sim_stocks.SimStockSlice.objects.get(stock_symbol=stock, datetime=datetime)
-        next_slice = sim_stocks.SimStockSlice.objects.filter(id=cur_slice.id + 1)
+        index = tick_columns.index_of(datetime)
+        cur_slice = tick_columns.to_slice(index)
 
-        if next_slice.exists():
+        if index + 1 < len(tick_columns):
             ticks += 1
-            assert len(next_slice) == 1
-            next_tick = next_slice[0]
-            result = calc_tick_action(datetime)
+            next_tick = tick_columns.to_slice(index + 1)
+            result = get_tick_action(stock, datetime, cur_slice, next_tick, build=True)
 
             if result is not None:
                 ask_vol, bid_vol = cur_slice.get_level5_volume()
@@ -119,7 +130,8 @@ def calc_and_check_actions(user, stock):
     market.tick = 0
     market.save()
     anchor_one_stock(stock, market.datetime, super_client)
-    cur_slice = sim_stocks.SimStockSlice.objects.get(stock_symbol=stock, datetime=market.datetime)
+    tick_columns = get_tick_columns(stock)
+    cur_slice = tick_columns.to_slice(tick_columns.index_of(market.datetime))
     if check_act_consistency(stock, cur_slice):
         print('Anchored Successfully, Status Synchronous.')
     else:
@@ -174,8 +186,9 @@ def calc_and_check_actions_of_one_tick(super_client, stock, datetime, anchored=T
 
     if datetime.hour == 14 and datetime.minute >= 57:
         return None, False, False
-    cur_slice = sim_stocks.SimStockSlice.objects.get(stock_symbol=stock, datetime=datetime)
-    next_slice = sim_stocks.SimStockSlice.objects.filter(id=cur_slice.id + 1)
+    tick_columns = get_tick_columns(stock)
+    index = tick_columns.index_of(datetime)
+    cur_slice = tick_columns.to_slice(index)
     next_tick = None
     calculated = False
     consistent = False
@@ -188,14 +201,13 @@ def calc_and_check_actions_of_one_tick(super_client, stock, datetime, anchored=T
         else:
             logger.info('Anchored Failed.')
 
-    if next_slice.exists():
-        assert len(next_slice) == 1
-        next_tick = next_slice[0]
-        result = calc_tick_action(datetime)
+    if index + 1 < len(tick_columns):
+        next_tick = tick_columns.to_slice(index + 1)
+        result = get_tick_action(stock, datetime, cur_slice, next_tick)
         if result is not None:
             calculated = True
             act_according_to_calculated_actions(super_client, result)
-            ok = check_act_consistency(stock, next_slice[0])
+            ok = check_act_consistency(stock, next_tick)
             if ok:
                 consistent = True
             else:
@@ -209,6 +221,7 @@ def calc_and_check_actions_of_one_tick(super_client, stock, datetime, anchored=T
 def act_according_to_calculated_actions(v_client, actions):
     market = sim_market.SimMarket.objects.get(id=1)
     stock_symbol = '000009.XSHE'
+    set_journal_clock(market.tick, market.datetime)
 
     sim_erase_data_out_of_level(v_client, stock_symbol, market.datetime)
     for action in actions:
@@ -223,12 +236,18 @@ def act_according_to_calculated_actions(v_client, actions):
             inventory.vol += action[2]
             inventory.available_vol += action[2]
             inventory.save()
+            risk_view.update_holding(inventory)
+            journal_holding(v_client.id, stock_symbol, action[2])
             sim_ask(v_client, stock_symbol, action[1], action[2], market.datetime)
 
         elif action[0] == 'b':
+            # 之前的成交与委托只在结算中写入了数据库，先读入，避免保存时覆盖
+            v_client.refresh_from_db(fields=['cash', 'frozen_cash', 'flexible_cash'])
             v_client.cash += float(action[1]) * action[2]
             v_client.flexible_cash += float(action[1]) * action[2]
             v_client.save()
+            risk_view.update_client(v_client)
+            journal_cash(v_client.id, float(action[1]) * action[2])
             sim_bid(v_client, stock_symbol, action[1], action[2], market.datetime)
 
         elif action[0] == 'c':
@@ -236,6 +255,11 @@ def act_according_to_calculated_actions(v_client, actions):
         else:
             raise ValueError('Invalid Actions in function: act_according_to_calculated_actions()!')
 
+    # tick结束，将内存中的order book、成交记录与委托的审计记录写回数据库
+    flush_order_books(stock_symbol)
+    flush_trade_tapes(stock_symbol)
+    flush_commission_records()
+
 
 def check_act_consistency(stock_symbol, target_slice):
     assert isinstance(target_slice, sim_stocks.SimStockSlice)
@@ -308,51 +332,96 @@ def sim_ask(v_client, symbol, price, vol, datetime):
 
 def sim_cancel(v_client, symbol, price, vol, datetime):
     """
-    虚拟的client（必须是超级用户）在模拟股市中撤单，委托给股市环境，将调用相应的处理函数
+    虚拟的client（必须是超级用户）在模拟股市中撤单，从最新的委托开始撤去client在price上共vol数量的委托
+    挂单由order book中按client和价格的索引找到并一次撤去，委托信息与解除的冻结合并写回
     :param v_client:虚拟的client
     :param symbol:股票标的代码
     :param price:撤去的价格
     :param vol:撤去的数量
     :param datetime:委托的时间
     """
-    origin_commissions = sim_clients.SimCommissionElem.objects.filter(owner=v_client.id, stock_symbol=symbol,
-                                                                      price_committed=price)
-    remaining_vol = vol
-    for commission in origin_commissions:
-        if remaining_vol == 0:
-            break
-        rest_vol = commission.vol_committed - commission.vol_traded
-        if rest_vol <= remaining_vol:
-            new_commission = SimCommissionMsg(stock_symbol=symbol, commit_client=v_client.id, commit_direction='c',
-                                              commit_price=price, commit_vol=rest_vol,
-                                              commission_to_cancel=commission.unique_id, commit_date=datetime)
-            sim_commission_handler(new_commission)
-            remaining_vol -= rest_vol
+    order_book = get_order_book(symbol)
+    client_orders = order_book.get_client_orders(v_client.id, price)
+    if not client_orders:
+        return True
+    if not SimCommissionMsg(stock_symbol=symbol, commit_client=v_client.id, commit_direction='c', commit_price=price,
+                            commit_vol=vol, commission_to_cancel=client_orders[-1].unique_id,
+                            commit_date=datetime).is_valid():
+        return False
+
+    released_vol = 0
+    released_cash = []
+    finished_ids = []
+    partial = None
+    for order, cancel_vol in order_book.cancel_client_vol(v_client.id, price, vol):
+        record_commission(SimCommissionMsg(stock_symbol=symbol, commit_client=v_client.id, commit_direction='c',
+                                           commit_price=price, commit_vol=cancel_vol,
+                                           commission_to_cancel=order.unique_id, commit_date=datetime))
+        if order.direction_committed == 'a':
+            released_vol += cancel_vol
         else:
-            new_commission = SimCommissionMsg(stock_symbol=symbol, commit_client=v_client.id, commit_direction='c',
-                                              commit_price=price, commit_vol=remaining_vol,
-                                              commission_to_cancel=commission.unique_id, commit_date=datetime)
-            sim_commission_handler(new_commission)
-            remaining_vol = 0
+            released_cash.append(float(price * cancel_vol))
+        if order.vol_committed == 0:
+            finished_ids.append(order.unique_id)
+        else:
+            # 只有最后一条挂单可能部分撤去
+            partial = (order.unique_id, cancel_vol)
+
+    with transaction.atomic():
+        if finished_ids:
+            sim_clients.SimCommissionElem.objects.filter(unique_id__in=finished_ids).delete()
+        if partial is not None:
+            sim_clients.SimCommissionElem.objects.filter(unique_id=partial[0]).\
+                update(vol_committed=F('vol_committed') - partial[1])
+        release_frozen(v_client, symbol, released_vol, released_cash)
+    return True
 
+
+def release_frozen(v_client, symbol, released_vol, released_cash):
+    """
+    撤单后解除client在一支股票上冻结的持仓和资金，各写回一次
+    :param released_vol: 解除冻结的持仓量
+    :param released_cash: 各笔撤单解除冻结的资金，按撤单顺序依次加减，与逐笔撤单时的浮点运算结果一致
+    """
+    if released_vol > 0:
+        holding = sim_clients.SimHoldingElem.objects.get(owner=v_client.id, stock_symbol=symbol)
+        holding.frozen_vol -= released_vol
+        holding.available_vol += released_vol
+        holding.save(update_fields=['frozen_vol', 'available_vol'])
+        risk_view.update_holding(holding)
+    if released_cash:
+        client_object = clients.BaseClient.objects.get(id=v_client.id)
+        for freeze in released_cash:
+            client_object.frozen_cash -= freeze
+            client_object.flexible_cash += freeze
+        client_object.save(update_fields=['frozen_cash', 'flexible_cash'])
+        risk_view.update_client(client_object)
     return True
 
 
-def sim_erase_data_out_of_level(v_client, symbol, datetime):
-    stock = sim_stocks.SimStock.objects.get(symbol=symbol)
-    level5_ask, level5_bid = stock.get_order_book_data(level=5)
-    level5_prices = []
-    for level_data in level5_ask:
-        level5_prices.append(level_data[0])
-    for level_data in level5_bid:
-        level5_prices.append(level_data[0])
-    all_ask, all_bid = stock.get_order_book_data(level=-1)
-    for level_data in all_ask:
-        if level_data[0] not in level5_prices:
-            sim_cancel(v_client, symbol, level_data[0], level_data[1], datetime)
-    for level_data in all_bid:
-        if level_data[0] not in level5_prices:
-            sim_cancel(v_client, symbol, level_data[0], level_data[1], datetime)
+def sim_erase_data_out_of_level(v_client, symbol, datetime, level=5):
+    """
+    撤去client在五档之外的全部挂单，在order book中一次完成，
+    解除的冻结资金和持仓量合并写回，对应的委托以一条语句删除（order book中的挂单在tick结束时写回）
+    """
+    removed = get_order_book(symbol).remove_levels_beyond(level, client=v_client.id)
+    if not removed:
+        return True
+
+    released_vol = 0
+    released_cash = []
+    for order in removed:
+        if order.direction_committed == 'a':
+            released_vol += order.vol_committed
+        else:
+            released_cash.append(float(order.price_committed * order.vol_committed))
+        record_commission(SimCommissionMsg(stock_symbol=symbol, commit_client=v_client.id, commit_direction='c',
+                                           commit_price=order.price_committed, commit_vol=order.vol_committed,
+                                           commission_to_cancel=order.unique_id, commit_date=datetime))
+
+    with transaction.atomic():
+        sim_clients.SimCommissionElem.objects.filter(unique_id__in=[order.unique_id for order in removed]).delete()
+        release_frozen(v_client, symbol, released_vol, released_cash)
     return True
 
 
@@ -365,7 +434,8 @@ def anchor_one_stock(stock, ach, client):
     else:
         stock_object = stock
     if not isinstance(ach, sim_stocks.SimStockSlice):
-        anchor = sim_stocks.SimStockSlice.objects.get(datetime=ach)
+        tick_columns = get_tick_columns(stock_object.symbol)
+        anchor = tick_columns.to_slice(tick_columns.index_of(ach))
     else:
         anchor = ach
     assert isinstance(client, clients.BaseClient)
@@ -382,12 +452,24 @@ def anchor_one_stock(stock, ach, client):
     stock_object.amount = anchor.amount
     stock_object.volume = anchor.volume
     stock_object.save()
+    risk_view.update_stock(stock_object)
+    if journal_is_open():
+        market = sim_market.SimMarket.objects.get(id=1)
+        set_journal_clock(market.tick, market.datetime)
+        journal_anchor(stock_object.symbol, anchor.datetime)
 
     if anchor.a1 == 0 and anchor.b1 == 0:
         # anchor位置可能是集合竞价时段或其他特殊情况，没有盘口，判断为无法交易
         return True
 
+    if install_order_book(stock_object, anchor, client):
+        return True
+
+    # 无法直接装入时，逐笔委托，经过撮合建立order book，集合竞价时段的委托以单一价格一次撮合
     stock_symbol = stock_object.symbol
+    auction = is_call_auction_time(anchor.datetime)
+    if auction:
+        sim_open_auction(stock_symbol)
     if anchor.a5 != 0:
         superuser_build_position(client, stock_symbol, anchor.a5, anchor.a5_v, anchor.datetime)
     if anchor.a4 != 0:
@@ -409,49 +491,128 @@ def anchor_one_stock(stock, ach, client):
         super_user_enter_market(client, stock_symbol, anchor.b4, anchor.b4_v, anchor.datetime)
     if anchor.b5 != 0:
         super_user_enter_market(client, stock_symbol, anchor.b5, anchor.b5_v, anchor.datetime)
+    if auction:
+        sim_call_auction(stock_symbol, anchor.last_price)
+
+    flush_order_books(stock_symbol)
+    flush_trade_tapes(stock_symbol)
+    flush_commission_records()
+    return True
+
+
+def install_order_book(stock_object, anchor, client):
+    """
+    不经过撮合，将anchor的五档盘口直接装入order book：超级用户的持仓、挂单、委托、冻结的资金和持仓量批量写入，
+    结果与逐笔委托（superuser_build_position/super_user_enter_market）相同
+    :return: order book非空、盘口交叉（会发生撮合）或没有可装入的档位时不做任何修改，返回False
+    """
+    stock_symbol = stock_object.symbol
+    order_book = get_order_book(stock_symbol)
+    if not order_book.is_empty('a') or not order_book.is_empty('b'):
+        return False
+
+    # 与逐笔委托时的合法性检查一致，跳过涨跌停价之外和数量为0的档位，涨跌停价未设置时不检查
+    limit_up, limit_down = risk_view.get_limits(stock_symbol)
+    check_limits = limit_up != 0 and limit_down != 0
+    ask_levels = []
+    bid_levels = []
+    for i in range(5, 0, -1):
+        price, vol = getattr(anchor, 'a{}'.format(i)), getattr(anchor, 'a{}_v'.format(i))
+        if price != 0 and vol > 0 and (not check_limits or limit_down <= price <= limit_up):
+            ask_levels.append((price, vol))
+    for i in range(1, 6):
+        price, vol = getattr(anchor, 'b{}'.format(i)), getattr(anchor, 'b{}_v'.format(i))
+        if price != 0 and vol > 0 and (not check_limits or limit_down <= price <= limit_up):
+            bid_levels.append((price, vol))
+    if not ask_levels and not bid_levels:
+        return False
+    if ask_levels and bid_levels and min(ask_levels)[0] <= max(bid_levels)[0]:
+        return False
 
+    market = sim_market.SimMarket.objects.get(id=1)
+    with transaction.atomic():
+        client_object = clients.BaseClient.objects.get(id=client.id)
+        if ask_levels:
+            inventory, _ = sim_clients.SimHoldingElem.objects.get_or_create(owner=client.id, stock_symbol=stock_symbol,
+                                                                           defaults={'date_bought': anchor.datetime})
+            for price, vol in ask_levels:
+                inventory.vol += vol
+                inventory.frozen_vol += vol
+            inventory.save()
+            risk_view.update_holding(inventory)
+        for price, vol in bid_levels:
+            # 与super_user_enter_market和sim_add_commission中的浮点运算顺序一致
+            client_object.cash += float(price * vol)
+            client_object.flexible_cash += float(price * vol)
+            freeze = float(price * vol)
+            client_object.frozen_cash += freeze
+            client_object.flexible_cash -= freeze
+        client_object.save(update_fields=['cash', 'frozen_cash', 'flexible_cash'])
+        risk_view.update_client(client_object)
+        client.cash = client_object.cash
+        client.frozen_cash = client_object.frozen_cash
+        client.flexible_cash = client_object.flexible_cash
+
+        new_commissions = []
+        for direction, levels in (('a', ask_levels), ('b', bid_levels)):
+            for price, vol in levels:
+                order = order_book.add_order(SimBookOrder(client=client.id, direction_committed=direction,
+                                                          price_committed=price, vol_committed=vol,
+                                                          date_committed=market.datetime))
+                new_commissions.append(sim_clients.SimCommissionElem(owner=client.id, stock_symbol=stock_symbol,
+                                                                     operation=direction, price_committed=price,
+                                                                     vol_committed=vol,
+                                                                     date_committed=market.datetime,
+                                                                     unique_id=order.unique_id))
+                # 日志中的顺序与逐笔委托相同：先注入持仓或资金，再委托
+                if direction == 'a':
+                    journal_holding(client.id, stock_symbol, vol)
+                else:
+                    journal_cash(client.id, float(price * vol))
+                record_commission(SimCommissionMsg(stock_symbol=stock_symbol, commit_client=client.id,
+                                                   commit_direction=direction, commit_price=price, commit_vol=vol,
+                                                   commit_date=anchor.datetime), order.unique_id)
+        sim_clients.SimCommissionElem.objects.bulk_create(new_commissions)
+        flush_order_books(stock_symbol)
+    flush_commission_records()
     return True
 
 
 def superuser_build_position(user, stock_symbol, price, vol, date):
     assert isinstance(user, clients.BaseClient)
     inventory, created = sim_clients.SimHoldingElem.objects.get_or_create(owner=user.id,
-                                                                          stock_symbol=stock_symbol, date_bought=date)
+                                                                          stock_symbol=stock_symbol,
+                                                                          defaults={'date_bought': date})
     inventory.vol += vol
     inventory.available_vol += vol
     inventory.save()
-    new_commission = SimCommissionMsg.objects.create(stock_symbol=stock_symbol, commit_client=user.id,
-                                                     commit_direction='a',
-                                                     commit_price=price, commit_vol=vol, commit_date=date)
+    risk_view.update_holding(inventory)
+    journal_holding(user.id, stock_symbol, vol)
+    new_commission = SimCommissionMsg(stock_symbol=stock_symbol, commit_client=user.id, commit_direction='a',
+                                      commit_price=price, commit_vol=vol, commit_date=date)
     ok = sim_commission_handler(new_commission)
     return ok
 
 
 def super_user_enter_market(user, stock_symbol, price, vol, date):
     assert isinstance(user, clients.BaseClient)
+    # 之前的委托冻结的资金只写入了数据库，先读入，避免保存时覆盖
+    user.refresh_from_db(fields=['cash', 'frozen_cash', 'flexible_cash'])
     user.cash += float(price * vol)
     user.flexible_cash += float(price * vol)
     user.save()
-    new_commission = SimCommissionMsg.objects.create(stock_symbol=stock_symbol, commit_client=user.id,
-                                                     commit_direction='b',
-                                                     commit_price=price, commit_vol=vol, commit_date=date)
+    risk_view.update_client(user)
+    journal_cash(user.id, float(price * vol))
+    new_commission = SimCommissionMsg(stock_symbol=stock_symbol, commit_client=user.id, commit_direction='b',
+                                      commit_price=price, commit_vol=vol, commit_date=date)
     ok = sim_commission_handler(new_commission)
     return ok
 
 
 def simulator_resetter(superuser_client):
     assert isinstance(superuser_client, clients.BaseClient)
-    clients.BaseClient.objects.filter(driver=None).delete()
-    sim_clients.SimTransactionElem.objects.all().delete()
-    sim_clients.SimHoldingElem.objects.all().delete()
-    sim_clients.SimCommissionElem.objects.all().delete()
-    v_stocks = sim_stocks.SimStock.objects.all()
-    for v_stock in v_stocks:
-        v_stock.reset()
-    superuser_client.cash = 100000000
-    superuser_client.flexible_cash = 100000000
-    superuser_client.frozen_cash = 0
-    superuser_client.save()
+    cost = reset_simulation_data(superuser_client)
+    print('Simulator Reset, Cost {}s'.format(cost))
     return True
 
 
@@ -0,0 +1,96 @@
+# _*_ coding:UTF-8 _*_
+
+import datetime as dt
+import random
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
+
+import numpy as np
+from django.test import TestCase
+
+from .. import action_cache
+from ..calculations import calc_tick_action
+from ..models import sim_stocks
+from ..models.sim_tick_store import get_tick_columns, invalidate_tick_columns
+from .util import SYMBOL, START, TempTickStoreMixin, make_slice_kwargs
+
+
+def create_trading_days(days=3, ticks=8):
+    """
+    每个tick在卖1价买入100股的若干交易日截面，每个tick的交易动作都可以求解
+    """
+    slices = []
+    for day in range(days):
+        kwargs = make_slice_kwargs(SYMBOL, START + dt.timedelta(days=day), Decimal('7.25'))
+        for k in range(ticks):
+            kwargs = dict(kwargs, datetime=START + dt.timedelta(days=day, seconds=3 * k))
+            slices.append(sim_stocks.SimStockSlice.objects.create(**kwargs))
+            kwargs.update(last_price=kwargs['a1'], a1_v=kwargs['a1_v'] - 100, volume=kwargs['volume'] + 100,
+                          amount=kwargs['amount'] + float(kwargs['a1'] * 100))
+    return slices
+
+
+class TickActionCacheTests(TempTickStoreMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        for name, value in (('ACTION_CACHE_PATH', path), ('tick_store', self.tick_store), ('_action_caches', {})):
+            patcher = mock.patch.object(action_cache, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.slices = create_trading_days()
+
+    @staticmethod
+    def read_cache():
+        cache = action_cache.load_action_cache(SYMBOL)
+        fields = [(cache.entries, field) for field in action_cache.ENTRY_FIELDS] + \
+                 [(cache.actions, field) for field in action_cache.ACTION_FIELDS]
+        return dict((field if columns is cache.entries else 'action_' + field, np.array(columns[field]).tolist())
+                    for columns, field in fields)
+
+    def test_merge_same_as_full(self):
+        """
+        分段、重叠地预先计算后合并的缓存与一次计算全部tick的缓存相同
+        """
+        action_cache.precompute_tick_actions(SYMBOL)
+        full = self.read_cache()
+        self.assertEqual(len(full['datetime']), len(self.slices) - 1)
+        # 只有每日最后一个截面到次日第一个截面的tick无法计算
+        unsolved = [index for index, status in enumerate(full['status']) if status != action_cache.STATUS_SOLVED]
+        self.assertEqual(unsolved, [7, 15])
+
+        shutil.rmtree(action_cache.get_cache_path(SYMBOL))
+        second_day = START + dt.timedelta(days=1)
+        action_cache.precompute_tick_actions(SYMBOL, second_day, second_day + dt.timedelta(hours=1))
+        action_cache.precompute_tick_actions(SYMBOL, START + dt.timedelta(seconds=9),
+                                             second_day + dt.timedelta(seconds=6))
+        action_cache.precompute_tick_actions(SYMBOL, START + dt.timedelta(days=2))
+        action_cache.precompute_tick_actions(SYMBOL, START, START + dt.timedelta(seconds=9))
+        self.assertEqual(self.read_cache(), full)
+
+    def test_cached_same_as_calculated(self):
+        action_cache.precompute_tick_actions(SYMBOL)
+        tick_columns = get_tick_columns(SYMBOL)
+        for index in range(len(tick_columns) - 1):
+            cur_slice, next_slice = tick_columns.to_slice(index), tick_columns.to_slice(index + 1)
+            expected = calc_tick_action(SYMBOL, cur_slice.datetime, cur_slice, next_slice, random.Random(index))
+            self.assertEqual(action_cache.get_tick_action(SYMBOL, cur_slice.datetime, rng=random.Random(index)),
+                             expected)
+
+    def test_stale_after_reimport(self):
+        """
+        tick数据重新导出后，已有的缓存不再使用
+        """
+        action_cache.precompute_tick_actions(SYMBOL)
+        self.assertIsNotNone(action_cache.get_action_cache(SYMBOL))
+        last = self.slices[-1]
+        sim_stocks.SimStockSlice.objects.create(**make_slice_kwargs(SYMBOL, last.datetime + dt.timedelta(seconds=3),
+                                                                    last.b1))
+        invalidate_tick_columns(SYMBOL)
+        self.assertIsNone(action_cache.get_action_cache(SYMBOL))
+        cache = action_cache.get_action_cache(SYMBOL, build=True)
+        self.assertEqual(len(cache), len(self.slices))
@@ -0,0 +1,109 @@
+# _*_ coding:UTF-8 _*_
+
+import random
+from decimal import Decimal
+
+from django.test import SimpleTestCase, TestCase
+
+from .. import simulator_main as sm
+from ..models import clients, sim_clients
+from ..models.config import CASH
+from ..models.sim_checkpoint import checkpoint_simulation, restore_simulation
+from ..models.sim_order_book import SimOrderBook, SimBookOrder, get_order_book
+from ..models.sim_trades import sim_open_auction, sim_call_auction
+from .util import SYMBOL, START, create_market, reference_match
+
+
+class SimCallAuctionTests(SimpleTestCase):
+
+    def test_call_auction_same_as_brute_force(self):
+        """
+        集合竞价的成交价与逐个价格枚举的结果一致，全部成交按价格优先、时间优先
+        """
+        rng = random.Random(2)
+        for _ in range(200):
+            book = SimOrderBook(SYMBOL)
+            book.auction = True
+            orders = []
+            for unique_id in range(1, rng.randint(2, 30)):
+                direction = rng.choice('ab')
+                price = Decimal('7.20') + Decimal('0.01') * rng.randint(0, 10)
+                vol = rng.randint(1, 20) * 100
+                book.add_order(SimBookOrder(1, direction, price, vol, START, unique_id=unique_id))
+                orders.append([unique_id, direction, price, vol])
+            reference = Decimal('7.20') + Decimal('0.01') * rng.randint(0, 10)
+
+            best = None
+            for candidate in sorted(set(order[2] for order in orders)):
+                bid_vol = sum(order[3] for order in orders if order[1] == 'b' and order[2] >= candidate)
+                ask_vol = sum(order[3] for order in orders if order[1] == 'a' and order[2] <= candidate)
+                key = (-min(bid_vol, ask_vol), abs(bid_vol - ask_vol), abs(candidate - reference), candidate)
+                if min(bid_vol, ask_vol) > 0 and (best is None or key < best):
+                    best = key
+
+            price, fills = book.call_auction(reference)
+            self.assertFalse(book.auction)
+            if best is None:
+                self.assertEqual(fills, [])
+                continue
+            self.assertEqual(price, best[3])
+            self.assertEqual(sum(traded_vol for _, _, traded_vol in fills), -best[0])
+            bid_fills = {}
+            ask_fills = {}
+            for bid, ask, traded_vol in fills:
+                self.assertGreaterEqual(bid.price_committed, price)
+                self.assertLessEqual(ask.price_committed, price)
+                bid_fills[bid.unique_id] = bid_fills.get(bid.unique_id, 0) + traded_vol
+                ask_fills[ask.unique_id] = ask_fills.get(ask.unique_id, 0) + traded_vol
+            # 成交的挂单是按价格优先、时间优先排列后的前缀
+            for direction, filled in (('b', bid_fills), ('a', ask_fills)):
+                expected = reference_match([list(order) for order in orders], 'a' if direction == 'b' else 'b',
+                                           price, -best[0])
+                self.assertEqual(sorted(filled.items()), sorted(expected))
+            best_ask, best_bid = book.best_level('a'), book.best_level('b')
+            self.assertTrue(best_ask is None or best_bid is None or best_bid.price < best_ask.price)
+
+    def test_snapshot_keeps_auction(self):
+        book = SimOrderBook(SYMBOL)
+        book.add_order(SimBookOrder(1, 'a', Decimal('7.26'), 100, START, unique_id=1))
+        book.auction = True
+        snapshot = book.snapshot()
+        book.call_auction()
+        self.assertTrue(book.restore(snapshot).auction)
+
+
+class SimCallAuctionDBTests(TestCase):
+
+    def setUp(self):
+        self.super_client, self.slices = create_market()
+        sm.simulator_resetter(self.super_client)
+        sm.anchor_one_stock(SYMBOL, self.slices[0], self.super_client)
+
+    def test_orders_wait_for_the_call(self):
+        """
+        集合竞价期间的委托只挂入order book，结束时以成交量最大、剩余量最小的单一价格成交并结算
+        """
+        buyer = clients.BaseClient.objects.create(name='buyer')
+        transactions = sim_clients.SimTransactionElem.objects.count()
+        sim_open_auction(SYMBOL)
+        sm.sim_bid(buyer, SYMBOL, Decimal('7.28'), 2500, START)
+        self.assertEqual(sim_clients.SimTransactionElem.objects.count(), transactions)
+        self.assertEqual(clients.BaseClient.objects.get(id=buyer.id).frozen_cash, float(Decimal('7.28') * 2500))
+
+        # 7.27时买方2500、卖方3000，成交2500，剩余量小于7.28
+        price = sim_call_auction(SYMBOL, self.slices[0].last_price)
+        self.assertEqual(price, Decimal('7.27'))
+        self.assertFalse(get_order_book(SYMBOL).auction)
+        holding = sim_clients.SimHoldingElem.objects.get(owner=buyer.id, stock_symbol=SYMBOL)
+        self.assertEqual((holding.vol, holding.cost), (2500, price))
+        buyer = clients.BaseClient.objects.get(id=buyer.id)
+        self.assertEqual((buyer.cash, buyer.frozen_cash), (CASH - float(price * 2500), 0))
+        self.assertFalse(sim_clients.SimCommissionElem.objects.filter(owner=buyer.id).exists())
+        self.assertEqual(sim_clients.SimTransactionElem.objects.count(), transactions + 2)
+
+    def test_checkpoint_keeps_auction(self):
+        sim_open_auction(SYMBOL)
+        checkpoint = checkpoint_simulation()
+        sim_call_auction(SYMBOL)
+        restore_simulation(checkpoint)
+        self.assertTrue(get_order_book(SYMBOL).auction)
@@ -0,0 +1,102 @@
+# _*_ coding:UTF-8 _*_
+
+import datetime as dt
+import random
+from unittest import skipUnless
+
+from django.test import SimpleTestCase, TestCase
+
+from ..calculations import solve_tick_trades, solve_tick_trades_batch, calc_tick_action
+from ..models import sim_stocks
+from ..models.utils import cents_to_price
+from .util import START, TempTickStoreMixin, create_market, make_slice_kwargs
+
+try:
+    import sympy
+except ImportError:
+    sympy = None
+
+
+@skipUnless(sympy is not None, 'sympy is not installed')
+class SolveTickTradesTests(SimpleTestCase):
+
+    @staticmethod
+    def sympy_solve(prices, amount, volume):
+        """
+        原先的求解方式：以sympy求解 sum(p_i * x_i) = amount, sum(x_i) = volume, x_i >= 0，结果向零取整
+        """
+        a = sympy.Matrix([prices, [1] * len(prices)])
+        b = sympy.Matrix([amount, volume])
+        x = sympy.Matrix(sympy.symarray('x', len(prices), negative=False))
+        result = sympy.solve(a * x - b)
+        if len(result) == 0:
+            return None
+        return [int(result.get(symbol, 0)) for symbol in x]
+
+    def test_same_as_sympy(self):
+        rng = random.Random(3)
+        prices, num_prices, amounts, volumes = [], [], [], []
+        for _ in range(300):
+            low = rng.randint(700, 760)
+            high = low + rng.randint(1, 5)
+            count = rng.choice((1, 2))
+            volume = rng.randint(0, 50) * 100
+            if rng.random() < 0.5:
+                # 恰有非负整数解
+                low_vol = rng.randint(0, volume)
+                amount = low * low_vol + (high * (volume - low_vol) if count == 2 else 0)
+                volume = volume if count == 2 else low_vol
+            else:
+                amount = rng.randint(low * volume - 500, high * volume + 500)
+            prices.append([low, high])
+            num_prices.append(count)
+            amounts.append(amount)
+            volumes.append(volume)
+
+        vols, solved = solve_tick_trades_batch(prices, num_prices, amounts, volumes)
+        for i in range(len(prices)):
+            expected = self.sympy_solve(prices[i][:num_prices[i]], amounts[i], volumes[i])
+            if expected is None:
+                self.assertFalse(solved[i], i)
+            else:
+                self.assertTrue(solved[i], i)
+                self.assertEqual(vols[i, :num_prices[i]].tolist(), expected, i)
+
+
+    def test_single_same_as_batch(self):
+        """
+        单个tick的求解与批量求解一致，价格与成交额以Decimal和元给出
+        """
+        rng = random.Random(4)
+        for _ in range(100):
+            low = rng.randint(700, 760)
+            high = low + rng.randint(1, 5)
+            low_vol, high_vol = rng.randint(0, 30) * 100, rng.randint(0, 30) * 100
+            amount = (low * low_vol + high * high_vol) / 100
+            coefficients = [cents_to_price(low), cents_to_price(high)]
+            self.assertEqual(solve_tick_trades(coefficients, amount, low_vol + high_vol), [low_vol, high_vol])
+            vols, solved = solve_tick_trades_batch([[low, high]], [2], [low * low_vol + high * high_vol],
+                                                   [low_vol + high_vol])
+            self.assertTrue(solved[0])
+            self.assertEqual(vols[0].tolist(), [low_vol, high_vol])
+
+
+class CalcTickActionTests(TempTickStoreMixin, TestCase):
+
+    def test_reads_ticks_of_given_symbol(self):
+        """
+        未给出截面时，从所给股票（而非固定的000009.XSHE）的列式tick数据中读取
+        """
+        symbol = '000010.XSHE'
+        _, slices = create_market(ticks=1, symbols=(symbol, ))
+        # 下一tick在卖1价7.26成交500股
+        kwargs = make_slice_kwargs(symbol, START + dt.timedelta(seconds=3), slices[0].b1, slices[0].volume + 500,
+                                   slices[0].amount + 3630.0)
+        kwargs.update(last_price=slices[0].a1, a1_v=slices[0].a1_v - 500)
+        slices.append(sim_stocks.SimStockSlice.objects.create(**kwargs))
+
+        expected = calc_tick_action(symbol, START, slices[0], slices[1], random.Random(0))
+        self.assertIn(('b', slices[0].a1, 500), expected)
+        self.assertEqual(calc_tick_action(symbol, START, rng=random.Random(0)), expected)
+        self.assertIsNone(calc_tick_action(symbol, slices[1].datetime))
+        self.assertIsNone(calc_tick_action(symbol, START + dt.timedelta(seconds=1)))
@@ -0,0 +1,101 @@
+# _*_ coding:UTF-8 _*_
+
+import random
+from decimal import Decimal
+
+from django.test import SimpleTestCase, TestCase
+
+from .. import simulator_main as sm
+from ..models import clients, sim_clients
+from ..models.sim_order_book import SimOrderBook, SimBookOrder, get_order_book
+from .util import SYMBOL, START, create_market
+
+
+def rebuild_client_orders(book):
+    """
+    从档位队列重建client的挂单索引
+    """
+    client_orders = {}
+    for direction in ('a', 'b'):
+        for level in book.iter_levels(direction):
+            for order in level.orders:
+                client_orders.setdefault((order.client, direction, level.price), []).append(order.unique_id)
+    return client_orders
+
+
+class SimClientOrdersTests(SimpleTestCase):
+
+    def test_index_same_as_levels(self):
+        """
+        随机的委托、撮合、撤单与撤去五档之外的挂单后，client的挂单索引与档位队列一致；
+        cancel_client_vol从最新的挂单开始撤单
+        """
+        rng = random.Random(4)
+        book = SimOrderBook(SYMBOL)
+        for unique_id in range(1, 1501):
+            client = rng.randint(1, 3)
+            price = Decimal('7.15') + Decimal('0.01') * rng.randint(0, 15)
+            operation = rng.random()
+            if operation < 0.2:
+                rebuilt = rebuild_client_orders(book)
+                queue = [book.orders[order_id]
+                         for order_id in rebuilt.get((client, 'a', price), rebuilt.get((client, 'b', price), []))]
+                vol = rng.randint(1, 50) * 100
+                remaining = dict((order.unique_id, order.vol_committed) for order in queue)
+                expected = []
+                left = vol
+                for order in reversed(queue):
+                    if left == 0:
+                        break
+                    cancel_vol = min(left, order.vol_committed)
+                    expected.append((order.unique_id, cancel_vol, remaining[order.unique_id] - cancel_vol))
+                    left -= cancel_vol
+                cancelled = book.cancel_client_vol(client, price, vol)
+                self.assertEqual([(order.unique_id, cancel_vol, order.vol_committed)
+                                  for order, cancel_vol in cancelled], expected)
+            elif operation < 0.25:
+                book.remove_levels_beyond(5, client=client if rng.random() < 0.5 else None)
+            else:
+                direction = rng.choice('ab')
+                vol = rng.randint(1, 20) * 100
+                fills = book.match(direction, price, vol)
+                remaining_vol = vol - sum(traded_vol for _, traded_vol in fills)
+                if remaining_vol > 0:
+                    book.add_order(SimBookOrder(client, direction, price, remaining_vol, START, unique_id=unique_id))
+            index = dict((key, [order.unique_id for order in orders]) for key, orders in book.client_orders.items())
+            self.assertEqual(index, rebuild_client_orders(book), unique_id)
+
+
+class SimCancelTests(TestCase):
+
+    def setUp(self):
+        self.super_client, self.slices = create_market()
+        sm.simulator_resetter(self.super_client)
+        sm.anchor_one_stock(SYMBOL, self.slices[0], self.super_client)
+
+    def test_cancel_newest_first(self):
+        """
+        sim_cancel从最新的委托开始撤单：全部撤去的委托被删除，部分撤去的委托扣减数量，解除相应的冻结持仓
+        """
+        price = Decimal('7.26')
+        super_client = clients.BaseClient.objects.get(id=self.super_client.id)
+        sm.act_according_to_calculated_actions(super_client, [('a', price, 300), ('a', price, 500)])
+        queue = get_order_book(SYMBOL).get_client_orders(super_client.id, price)
+        self.assertEqual([order.vol_committed for order in queue[-2:]], [300, 500])
+        before = [(order.unique_id, order.vol_committed) for order in queue]
+        holding = sim_clients.SimHoldingElem.objects.get(owner=super_client.id, stock_symbol=SYMBOL)
+
+        self.assertTrue(sm.sim_cancel(super_client, SYMBOL, price, 600, START))
+        expected = before[:-2] + [(before[-2][0], 200)]
+        self.assertEqual([(order.unique_id, order.vol_committed)
+                          for order in get_order_book(SYMBOL).get_client_orders(super_client.id, price)], expected)
+        commissions = sim_clients.SimCommissionElem.objects.filter(owner=super_client.id, operation='a',
+                                                                  price_committed=price)
+        self.assertEqual(sorted(commissions.values_list('unique_id', 'vol_committed')), sorted(expected))
+        after = sim_clients.SimHoldingElem.objects.get(owner=super_client.id, stock_symbol=SYMBOL)
+        self.assertEqual((after.frozen_vol, after.available_vol),
+                         (holding.frozen_vol - 600, holding.available_vol + 600))
+
+        # 没有挂单的价格上撤单不做任何修改
+        self.assertTrue(sm.sim_cancel(super_client, SYMBOL, Decimal('7.00'), 100, START))
+        self.assertEqual(sim_clients.SimHoldingElem.objects.get(id=after.id).frozen_vol, after.frozen_vol)
@@ -0,0 +1,59 @@
+# _*_ coding:UTF-8 _*_
+
+import os
+import random
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from .. import simulator_main as sm
+from ..models import clients, sim_market
+from ..models.sim_checkpoint import checkpoint_simulation, restore_simulation, save_checkpoint, load_checkpoint
+from ..models.sim_order_book import peek_next_order_id
+from .util import SYMBOL, create_market, random_actions, db_state
+
+
+class SimCheckpointTests(TestCase):
+
+    def setUp(self):
+        self.super_client, self.slices = create_market()
+        sm.simulator_resetter(self.super_client)
+        sm.anchor_one_stock(SYMBOL, self.slices[0], self.super_client)
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        self.path = os.path.join(path, 'checkpoint.pkl')
+
+    def run_steps(self, rng, steps):
+        """
+        按rng执行若干tick的委托，每个tick后记录模拟器的状态
+        """
+        states = []
+        for step in range(steps):
+            sm.act_according_to_calculated_actions(clients.BaseClient.objects.get(id=self.super_client.id),
+                                                   random_actions(rng))
+            states.append((db_state(self.super_client.id), peek_next_order_id(),
+                           list(clients.BaseClient.objects.order_by('id').values_list(
+                               'id', 'cash', 'frozen_cash', 'flexible_cash'))))
+        return states
+
+    def test_round_trip(self):
+        """
+        从磁盘读回的检查点恢复后，同样的委托序列得到与第一次相同的状态，且可以多次恢复
+        """
+        self.run_steps(random.Random(5), 10)
+        clients.BaseClient.objects.create(name='virtual')
+        sim_market.SimMarket.objects.filter(id=1).update(tick=10)
+        checkpoint = checkpoint_simulation()
+        before = db_state(self.super_client.id)
+        save_checkpoint(checkpoint, self.path)
+        expected = self.run_steps(random.Random(6), 15)
+
+        for _ in range(2):
+            loaded = load_checkpoint(self.path)
+            self.assertEqual(loaded, checkpoint)
+            restore_simulation(loaded)
+            self.assertEqual(db_state(self.super_client.id), before)
+            self.assertEqual(sim_market.SimMarket.objects.get(id=1).tick, 10)
+            self.assertTrue(clients.BaseClient.objects.filter(name='virtual').exists())
+            self.assertEqual(self.run_steps(random.Random(6), 15), expected)
@@ -0,0 +1,105 @@
+# _*_ coding:UTF-8 _*_
+
+import itertools
+import random
+from decimal import Decimal
+
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+
+from ..models import sim_stocks
+from ..models.sim_import import SLICE_FIELDS, filter_tick_records, split_days, import_tick_records
+from .util import SYMBOL
+
+
+def random_int_datetimes(rng, days=3, ticks=400):
+    """
+    若干交易日的整数形式时间，每日从9:15开始，间隔1至40秒
+    """
+    int_datetimes = []
+    for day in range(days):
+        seconds = 9 * 3600 + 15 * 60
+        for _ in range(ticks):
+            seconds += rng.choice((1, 3, 3, 6, 40))
+            hour, rest = divmod(seconds, 3600)
+            int_datetimes.append(((20180102 + day) * 1000000 + hour * 10000 + rest // 60 * 100 + rest % 60) * 1000)
+    return np.array(int_datetimes, dtype=np.int64)
+
+
+class SimImportFilterTests(SimpleTestCase):
+
+    def test_filter_same_as_loop(self):
+        """
+        向量化的过滤与逐条判断的结果一致：跳过9:10-9:29的集合竞价，'m'时只取每分钟的第一条
+        """
+        int_datetimes = random_int_datetimes(random.Random(5))
+        for interval in ('t', 'm'):
+            expected = []
+            prev_minute = None
+            for int_datetime in int_datetimes.tolist():
+                hour_minute = int_datetime // 100000 % 10000
+                minute = int_datetime // 100000
+                selected = not 910 <= hour_minute < 930
+                if interval == 'm':
+                    selected = selected and minute != prev_minute
+                prev_minute = minute
+                expected.append(selected)
+            self.assertEqual(filter_tick_records(int_datetimes, interval).tolist(), expected, interval)
+        with self.assertRaises(ValueError):
+            filter_tick_records(int_datetimes, 'd')
+
+    def test_split_days(self):
+        int_datetimes = random_int_datetimes(random.Random(6))
+        day_first, day_last = split_days(int_datetimes)
+        expected = []
+        index = 0
+        for _, group in itertools.groupby(int_datetimes.tolist(), key=lambda value: value // 1000000000):
+            length = len(list(group))
+            expected.append((index, index + length - 1))
+            index += length
+        self.assertEqual(list(zip(day_first.tolist(), day_last.tolist())), expected)
+
+
+class SimImportTests(TestCase):
+
+    def make_records(self, int_datetimes):
+        dtype = [('datetime', np.int64)] + [(key, np.int64 if key.endswith('_v') or key == 'volume' else np.float64)
+                                            for key in SLICE_FIELDS]
+        records = np.zeros(len(int_datetimes), dtype=dtype)
+        records['datetime'] = int_datetimes
+        steps = np.arange(len(int_datetimes))
+        records['last'] = 7.0 + steps % 50 / 100
+        records['high'] = 7.5
+        records['low'] = 6.9
+        records['volume'] = steps * 100
+        records['amount'] = steps * 725.0
+        for i in range(1, 6):
+            records['a{}'.format(i)] = records['last'] + i / 100
+            records['b{}'.format(i)] = records['last'] - (i - 1) / 100
+            records['a{}_v'.format(i)] = 1000 * i
+            records['b{}_v'.format(i)] = 900 * i
+        return records
+
+    def test_import_tick_records(self):
+        """
+        导入的截面跳过集合竞价，开盘价为当日第一条导入记录的最新价；重复导入时跳过已有的截面与日线
+        """
+        int_datetimes = random_int_datetimes(random.Random(7), days=2, ticks=300)
+        records = self.make_records(int_datetimes)
+        num_slices, num_days = import_tick_records(SYMBOL, records, 't', complete=False, batch_size=50)
+        selected = records[filter_tick_records(int_datetimes, 't')]
+        self.assertEqual((num_slices, num_days), (len(selected), 1))
+        self.assertEqual(sim_stocks.SimStockSlice.objects.filter(stock_symbol=SYMBOL).count(), len(selected))
+
+        day_first, day_last = split_days(selected['datetime'])
+        slices = list(sim_stocks.SimStockSlice.objects.filter(stock_symbol=SYMBOL).order_by('datetime'))
+        for first, last in zip(day_first.tolist(), day_last.tolist()):
+            open_price = Decimal(str(selected['last'][first])).quantize(Decimal('0.01'))
+            self.assertEqual(set(stick.open for stick in slices[first:last + 1]), {open_price})
+        daily_info = sim_stocks.SimStockDailyInfo.objects.get(stock_symbol=SYMBOL)
+        last = day_last[0]
+        self.assertEqual((daily_info.date, daily_info.volume), (slices[last].datetime.date(), slices[last].volume))
+
+        # 最后一日此时已完整，只补上它的日线
+        self.assertEqual(import_tick_records(SYMBOL, records, 't', complete=True), (0, 1))
+        self.assertEqual(import_tick_records(SYMBOL, records, 'm', complete=True), (0, 0))
@@ -0,0 +1,62 @@
+# _*_ coding:UTF-8 _*_
+
+import datetime as dt
+import os
+import random
+import shutil
+import tempfile
+from decimal import Decimal
+
+from django.test import TestCase
+
+from .. import simulator_main as sm
+from ..models import clients, sim_market
+from ..models.sim_journal import open_commission_journal, close_commission_journal, read_journal, replay_journal, \
+    JOURNAL_RECORD, KIND_RESET, KIND_ANCHOR
+from ..sim_session import SimMarketSession
+from .util import SYMBOL, START, TempTickStoreMixin, create_market, random_actions, db_state, session_state
+
+
+class SimJournalTests(TempTickStoreMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.super_client, self.slices = create_market(ticks=4)
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        self.path = os.path.join(path, 'journal.bin')
+        open_commission_journal(self.path)
+        self.addCleanup(close_commission_journal)
+
+    def test_replay_same_as_db(self):
+        """
+        在内存会话上重放日志得到与数据库中的模拟器相同的盘口、持仓、委托、资金与成交；不完整的末尾记录被忽略
+        """
+        sm.simulator_resetter(self.super_client)
+        sm.anchor_one_stock(SYMBOL, START, self.super_client)
+        buyer = clients.BaseClient.objects.create(name='buyer')
+        rng = random.Random(7)
+        cur_datetime = START
+        for step in range(40):
+            sm.act_according_to_calculated_actions(clients.BaseClient.objects.get(id=self.super_client.id),
+                                                   random_actions(rng))
+            if step % 10 == 9:
+                sm.sim_bid(buyer, SYMBOL, Decimal('7.30'), 1000, cur_datetime)
+            cur_datetime += dt.timedelta(seconds=3)
+            sim_market.SimMarket.objects.filter(id=1).update(datetime=cur_datetime, tick=step + 1)
+        close_commission_journal()
+
+        records = read_journal(self.path)
+        self.assertEqual(records['seq'].tolist(), list(range(len(records))))
+        self.assertEqual(records['kind'][:2].tolist(), [KIND_RESET, KIND_ANCHOR])
+        session = replay_journal(self.path, SimMarketSession(self.super_client.id))
+        self.assertEqual(session_state(session), db_state(self.super_client.id))
+        self.assertTrue(session.transactions)
+        buyer = clients.BaseClient.objects.get(id=buyer.id)
+        self.assertAlmostEqual(session.clients[buyer.id].cash, buyer.cash, places=6)
+
+        with open(self.path, 'ab') as f:
+            f.write(b'\0' * (JOURNAL_RECORD.size // 2))
+        self.assertEqual(len(read_journal(self.path)), len(records))
+        session = replay_journal(self.path, SimMarketSession(self.super_client.id))
+        self.assertEqual(session_state(session), db_state(self.super_client.id))
@@ -0,0 +1,65 @@
+# _*_ coding:UTF-8 _*_
+
+import random
+from decimal import Decimal
+
+from django.test import SimpleTestCase, TestCase
+
+from .. import simulator_main as sm
+from ..models.sim_order_book import SimOrderBook, SimBookOrder, get_order_book
+from ..models.sim_trades import SimCommissionMsg, sim_commission_handler
+from ..sim_session import SimMarketSession
+from .util import SYMBOL, START, create_market, reference_match, reference_depth, db_state
+
+
+class SimOrderBookTests(SimpleTestCase):
+
+    def test_match_same_as_reference(self):
+        """
+        随机的委托与撤单序列上，内存order book的成交和盘口与逐笔撮合的参照实现一致
+        """
+        rng = random.Random(1)
+        book = SimOrderBook(SYMBOL)
+        orders = []
+        for unique_id in range(1, 2001):
+            if orders and rng.random() < 0.2:
+                target = rng.choice(orders)
+                vol = rng.randint(1, target[3])
+                book.cancel(target[0], vol)
+                target[3] -= vol
+                orders = [order for order in orders if order[3] > 0]
+            else:
+                direction = rng.choice('ab')
+                price = Decimal('7.15') + Decimal('0.01') * rng.randint(0, 25)
+                vol = rng.randint(1, 30) * 100
+                fills = [(order.unique_id, traded_vol) for order, traded_vol in book.match(direction, price, vol)]
+                self.assertEqual(fills, reference_match(orders, direction, price, vol))
+                remaining_vol = vol - sum(traded_vol for _, traded_vol in fills)
+                if remaining_vol > 0:
+                    book.add_order(SimBookOrder(1, direction, price, remaining_vol, START, unique_id=unique_id))
+                    orders.append([unique_id, direction, price, remaining_vol])
+            self.assertEqual(book.get_order_book_data(level=-1), reference_depth(orders))
+
+
+class SimMatchingTests(TestCase):
+
+    def setUp(self):
+        self.super_client, self.slices = create_market()
+        sm.simulator_resetter(self.super_client)
+        sm.anchor_one_stock(SYMBOL, self.slices[0], self.super_client)
+
+    def test_cancel_unknown_order_fails(self):
+        """
+        撤销不存在或已全部成交的挂单时撤单失败，不影响order book与其他挂单
+        """
+        before = db_state(self.super_client.id)
+        for unique_id in (10 ** 9, get_order_book(SYMBOL).best_level('a').orders[0].unique_id):
+            cancel = SimCommissionMsg(stock_symbol=SYMBOL, commit_client=self.super_client.id + 1,
+                                      commit_direction='c', commit_price=Decimal('7.26'), commit_vol=100,
+                                      commit_date=START, commission_to_cancel=unique_id)
+            self.assertTrue(sim_commission_handler(cancel))
+        self.assertEqual(db_state(self.super_client.id), before)
+
+        session = SimMarketSession(self.super_client.id)
+        session.anchor(SYMBOL, self.slices[0])
+        self.assertTrue(session.commit(self.super_client.id, SYMBOL, 'c', Decimal('7.26'), 100, 10 ** 9))
@@ -0,0 +1,90 @@
+# _*_ coding:UTF-8 _*_
+
+import random
+
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from .. import simulator_main as sm
+from ..models import clients, sim_clients, sim_stocks
+from ..models.sim_order_book import get_order_book
+from ..models.sim_reset import RESET_MODELS, SUPERUSER_CASH, reset_simulation_data
+from .util import SYMBOL, create_market, random_actions
+
+
+def reset_per_row(superuser_client):
+    """
+    原先逐个对象的重置，作为参照
+    """
+    clients.BaseClient.objects.filter(driver=None).delete()
+    sim_clients.SimTransactionElem.objects.all().delete()
+    sim_clients.SimHoldingElem.objects.all().delete()
+    sim_clients.SimCommissionElem.objects.all().delete()
+    for v_stock in sim_stocks.SimStock.objects.all():
+        v_stock.reset()
+    superuser_client.cash = SUPERUSER_CASH
+    superuser_client.flexible_cash = SUPERUSER_CASH
+    superuser_client.frozen_cash = 0
+    superuser_client.save()
+
+
+def simulation_tables():
+    """
+    重置涉及的全部表的内容
+    """
+    rows = dict((model.__name__, model.objects.count()) for model in RESET_MODELS)
+    rows['SimStock'] = list(sim_stocks.SimStock.objects.order_by('symbol').values(
+        'symbol', 'amount', 'volume', 'last_price', 'high', 'low', 'limit_up', 'limit_down'))
+    rows['BaseClient'] = list(clients.BaseClient.objects.order_by('id').values(
+        'id', 'name', 'cash', 'flexible_cash', 'frozen_cash'))
+    rows['SimStockSlice'] = sim_stocks.SimStockSlice.objects.count()
+    return rows
+
+
+class SimResetTests(TestCase):
+
+    def setUp(self):
+        self.super_client, self.slices = create_market(symbols=(SYMBOL, '000010.XSHE'))
+        sm.simulator_resetter(self.super_client)
+
+    def populate(self, steps):
+        for symbol in (SYMBOL, '000010.XSHE'):
+            anchor = sim_stocks.SimStockSlice.objects.filter(stock_symbol=symbol).earliest('datetime')
+            sm.anchor_one_stock(symbol, anchor, self.super_client)
+        buyer = clients.BaseClient.objects.create(name='buyer')
+        rng = random.Random(steps)
+        for _ in range(steps):
+            sm.act_according_to_calculated_actions(clients.BaseClient.objects.get(id=self.super_client.id),
+                                                   random_actions(rng))
+        sm.sim_bid(buyer, SYMBOL, self.slices[0].a5, 3000, self.slices[0].datetime)
+        self.assertTrue(sim_clients.SimTransactionElem.objects.exists())
+        self.assertTrue(sim_stocks.SimTradeHistory.objects.exists())
+
+    def test_same_as_per_row_reset(self):
+        self.populate(20)
+        with transaction.atomic():
+            reset_per_row(clients.BaseClient.objects.get(id=self.super_client.id))
+            expected = simulation_tables()
+            transaction.set_rollback(True)
+        self.assertNotEqual(simulation_tables(), expected)
+
+        super_client = clients.BaseClient.objects.get(id=self.super_client.id)
+        reset_simulation_data(super_client)
+        self.assertEqual(simulation_tables(), expected)
+        self.assertEqual((super_client.cash, super_client.flexible_cash, super_client.frozen_cash),
+                         (SUPERUSER_CASH, SUPERUSER_CASH, 0))
+        # 内存中的order book随之丢弃，重新锚定后与数据库一致
+        self.assertTrue(get_order_book(SYMBOL).is_empty('a'))
+        sm.anchor_one_stock(SYMBOL, self.slices[0], super_client)
+        self.assertEqual(get_order_book(SYMBOL).get_order_book_data(),
+                         sim_stocks.SimStock.objects.get(symbol=SYMBOL).get_order_book_data())
+
+    def test_queries_independent_of_size(self):
+        counts = []
+        for steps in (2, 30):
+            self.populate(steps)
+            with CaptureQueriesContext(connection) as context:
+                reset_simulation_data(clients.BaseClient.objects.get(id=self.super_client.id))
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
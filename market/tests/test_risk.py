@@ -0,0 +1,59 @@
+# _*_ coding:UTF-8 _*_
+
+import datetime as dt
+import random
+from decimal import Decimal
+
+from django.test import TestCase
+
+from .. import simulator_main as sm
+from ..models import clients, sim_clients, sim_market, sim_stocks
+from ..models.sim_risk import risk_view, quantize_limit
+from .util import SYMBOL, START, create_market, random_actions
+
+
+class SimRiskViewTests(TestCase):
+
+    def setUp(self):
+        self.super_client, self.slices = create_market()
+        sm.simulator_resetter(self.super_client)
+        sm.anchor_one_stock(SYMBOL, self.slices[0], self.super_client)
+
+    def assert_view_same_as_db(self, msg=None):
+        """
+        风控视图中已有的数据与数据库一致
+        """
+        for client_id, flexible_cash in risk_view.flexible_cash.items():
+            self.assertAlmostEqual(flexible_cash, clients.BaseClient.objects.get(id=client_id).flexible_cash,
+                                   places=6, msg=msg)
+        for (owner, symbol), available_vol in risk_view.available_vol.items():
+            holding = sim_clients.SimHoldingElem.objects.filter(owner=owner, stock_symbol=symbol).first()
+            self.assertEqual(available_vol, holding.available_vol if holding is not None else None, msg)
+        for symbol, limits in risk_view.limits.items():
+            stock = sim_stocks.SimStock.objects.get(symbol=symbol)
+            self.assertEqual(limits, (quantize_limit(stock.limit_up), quantize_limit(stock.limit_down)), msg)
+
+    def test_synchronous_after_settlement(self):
+        """
+        同一个client对象连续多个tick委托、撮合与结算后，风控视图与数据库一致
+        """
+        buyer = clients.BaseClient.objects.create(name='buyer')
+        super_client = clients.BaseClient.objects.get(id=self.super_client.id)
+        rng = random.Random(3)
+        cur_datetime = START
+        for step in range(30):
+            sm.act_according_to_calculated_actions(super_client, random_actions(rng))
+            # 另一client的委托与超级用户的挂单成交，双方都在结算中更新
+            sm.sim_bid(buyer, SYMBOL, Decimal('7.20') + Decimal('0.01') * rng.randint(0, 15),
+                       rng.randint(1, 10) * 100, cur_datetime)
+            self.assertIn(buyer.id, risk_view.flexible_cash)
+            self.assert_view_same_as_db('step {}'.format(step))
+            cur_datetime += dt.timedelta(seconds=3)
+            sim_market.SimMarket.objects.filter(id=1).update(datetime=cur_datetime, tick=step + 1)
+        self.assertTrue(sim_clients.SimHoldingElem.objects.filter(owner=buyer.id).exists())
+
+    def test_reset_discards_view(self):
+        risk_view.get_flexible_cash(self.super_client.id)
+        self.assertTrue(risk_view.limits)
+        sm.simulator_resetter(self.super_client)
+        self.assertEqual((risk_view.limits, risk_view.flexible_cash, risk_view.available_vol), ({}, {}, {}))
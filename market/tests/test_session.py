@@ -0,0 +1,52 @@
+# _*_ coding:UTF-8 _*_
+
+import datetime as dt
+import random
+
+from django.test import TestCase
+
+from .. import simulator_main as sm
+from ..models import clients, sim_market
+from ..sim_session import SimMarketSession
+from .util import SYMBOL, START, create_market, random_actions, db_state, session_state
+
+
+class SimMarketSessionTests(TestCase):
+
+    def setUp(self):
+        self.super_client, self.slices = create_market()
+        sm.simulator_resetter(self.super_client)
+        sm.anchor_one_stock(SYMBOL, self.slices[0], self.super_client)
+
+    def test_db_path_same_as_session(self):
+        """
+        同一委托序列上，数据库中的模拟器与内存中的SimMarketSession得到相同的盘口、持仓、委托和成交
+        """
+        session = SimMarketSession(self.super_client.id)
+        session.anchor(SYMBOL, self.slices[0])
+        self.assertEqual(db_state(self.super_client.id), session_state(session))
+
+        rng = random.Random(1)
+        cur_datetime = START
+        for step in range(40):
+            actions = random_actions(rng)
+            super_client = clients.BaseClient.objects.get(id=self.super_client.id)
+            sm.act_according_to_calculated_actions(super_client, actions)
+            session.act(actions, SYMBOL)
+            cur_datetime += dt.timedelta(seconds=3)
+            sim_market.SimMarket.objects.filter(id=1).update(datetime=cur_datetime, tick=step + 1)
+            session.advance(cur_datetime)
+            self.assertEqual(db_state(self.super_client.id), session_state(session), 'step {}'.format(step))
+
+    def test_act_without_queries(self):
+        """
+        锚定之后，会话中的委托、撮合与结算不访问数据库
+        """
+        session = SimMarketSession(self.super_client.id)
+        session.anchor(SYMBOL, self.slices[0])
+        rng = random.Random(2)
+        with self.assertNumQueries(0):
+            for step in range(20):
+                session.act(random_actions(rng), SYMBOL)
+                session.advance(START + dt.timedelta(seconds=3 * (step + 1)))
+        self.assertTrue(session.transactions)
@@ -0,0 +1,72 @@
+# _*_ coding:UTF-8 _*_
+
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from .. import simulator_main as sm
+from ..models import clients, sim_clients, sim_stocks
+from ..models.config import CASH, PRICE_QUANTUM
+from .util import SYMBOL, START, create_market
+
+
+class SimSettlementTests(TestCase):
+
+    def setUp(self):
+        self.super_client, self.slices = create_market()
+        sm.simulator_resetter(self.super_client)
+        sm.anchor_one_stock(SYMBOL, self.slices[0], self.super_client)
+
+    def test_sweep_settles_every_fill(self):
+        """
+        一次委托扫过多个价格档位，批量结算的结果与逐笔结算相同：持仓成本逐笔加权，挂单方的委托逐笔扣减
+        """
+        buyer = clients.BaseClient.objects.create(name='buyer')
+        anchor = self.slices[0]
+        super_cash = clients.BaseClient.objects.get(id=self.super_client.id).cash
+        super_holding = sim_clients.SimHoldingElem.objects.get(owner=self.super_client.id, stock_symbol=SYMBOL)
+        fills = [(anchor.a1, anchor.a1_v), (anchor.a2, anchor.a2_v), (anchor.a3, 500)]
+        sm.sim_bid(buyer, SYMBOL, anchor.a3, sum(vol for _, vol in fills), START)
+
+        cost, vol, amount = Decimal(0), 0, 0
+        for price, traded_vol in fills:
+            cost = Decimal((cost * vol + price * traded_vol) / (vol + traded_vol)).quantize(PRICE_QUANTUM)
+            vol += traded_vol
+            amount += float(price * traded_vol)
+        holding = sim_clients.SimHoldingElem.objects.get(owner=buyer.id, stock_symbol=SYMBOL)
+        self.assertEqual((holding.vol, holding.available_vol, holding.cost), (vol, vol, cost))
+        buyer = clients.BaseClient.objects.get(id=buyer.id)
+        self.assertEqual((buyer.cash, buyer.frozen_cash), (CASH - amount, 0))
+        self.assertEqual(clients.BaseClient.objects.get(id=self.super_client.id).cash, super_cash + amount)
+
+        remaining = sim_clients.SimHoldingElem.objects.get(owner=self.super_client.id, stock_symbol=SYMBOL)
+        self.assertEqual(remaining.vol, super_holding.vol - vol)
+        self.assertEqual(remaining.frozen_vol, super_holding.frozen_vol - vol)
+        asks = dict(sim_clients.SimCommissionElem.objects.filter(operation='a').values_list('price_committed',
+                                                                                              'vol_traded'))
+        self.assertNotIn(anchor.a1, asks)
+        self.assertNotIn(anchor.a2, asks)
+        self.assertEqual(asks[anchor.a3], 500)
+        self.assertEqual(sim_clients.SimTransactionElem.objects.filter(one_side=buyer.id).count(), len(fills))
+
+    def test_settlement_queries_independent_of_fills(self):
+        """
+        一次委托产生的全部交易一并结算，扫过多个价格档位与只成交一笔的查询数相同
+        """
+        buyer = clients.BaseClient.objects.create(name='buyer')
+        anchor = self.slices[0]
+        sm.sim_bid(buyer, SYMBOL, anchor.b5 - Decimal('0.01'), 100, START)
+
+        with CaptureQueriesContext(connection) as one_level:
+            sm.sim_bid(buyer, SYMBOL, anchor.a1, anchor.a1_v, START)
+        vol = anchor.a2_v + anchor.a3_v + anchor.a4_v + anchor.a5_v
+        with CaptureQueriesContext(connection) as four_levels:
+            sm.sim_bid(buyer, SYMBOL, anchor.a5, vol, START)
+        self.assertEqual(len(one_level), len(four_levels))
+
+        holding = sim_clients.SimHoldingElem.objects.get(owner=buyer.id, stock_symbol=SYMBOL)
+        self.assertEqual(holding.vol, anchor.a1_v + vol)
+        self.assertEqual(sim_clients.SimTransactionElem.objects.filter(one_side=buyer.id).count(), 5)
+        self.assertTrue(sim_stocks.SimStock.objects.get(symbol=SYMBOL).is_order_book_empty('a'))
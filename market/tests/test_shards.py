@@ -0,0 +1,92 @@
+# _*_ coding:UTF-8 _*_
+
+import datetime as dt
+import random
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from .. import action_cache
+from ..models import sim_stocks
+from ..models.config import TAX_RATE
+from ..sim_session import SimMarketSession
+from ..sim_shards import ShardedMarket, split_ledger, get_ledger, set_ledger
+from .util import START, TempTickStoreMixin, create_market, random_actions
+
+SYMBOLS = ('000100.XSHE', '000101.XSHE')
+
+
+class SplitLedgerTests(SimpleTestCase):
+
+    def test_split_flexible_cash(self):
+        """
+        各份的可用资金之和等于原来的可用资金，总资金与冻结资金不变
+        """
+        ledger = {1: (1000.0, 300.0, 700.0), 2: (101, 0, 101)}
+        parts = split_ledger(ledger, 3)
+        self.assertEqual(len(parts), 3)
+        self.assertEqual([part[2] for part in parts], [(101, 0, 33), (101, 0, 33), (101, 0, 35)])
+        self.assertAlmostEqual(sum(part[1][2] for part in parts), 700.0)
+        self.assertTrue(all(part[1][:2] == (1000.0, 300.0) for part in parts))
+        self.assertEqual(split_ledger(ledger, 1), [ledger])
+
+
+class ShardedMarketTests(TempTickStoreMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        for name, value in (('ACTION_CACHE_PATH', path), ('tick_store', self.tick_store), ('_action_caches', {})):
+            patcher = mock.patch.object(action_cache, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.super_client, _ = create_market(symbols=SYMBOLS)
+        self.anchors = dict((symbol, sim_stocks.SimStockSlice.objects.filter(stock_symbol=symbol).earliest('datetime'))
+                            for symbol in SYMBOLS)
+        self.market = ShardedMarket(self.super_client.id, SYMBOLS, num_workers=2)
+        self.addCleanup(self.market.close)
+        self.initial_ledger = dict(self.market.ledger)
+        self.market.anchor(self.anchors)
+
+    def test_same_as_single_session(self):
+        """
+        资金充足时，分片撮合、汇总总账的结果与单个会话依次执行相同
+        """
+        session = SimMarketSession(self.super_client.id, SYMBOLS)
+        session.datetime = START
+        set_ledger(session, self.initial_ledger)
+        for symbol, anchor in self.anchors.items():
+            session.anchor(symbol, anchor)
+        rng = random.Random(9)
+        cur_datetime = START
+        for step in range(20):
+            actions = dict((symbol, random_actions(rng)) for symbol in SYMBOLS)
+            cur_datetime += dt.timedelta(seconds=3)
+            self.market.act(actions, cur_datetime)
+            for symbol in SYMBOLS:
+                session.act(actions[symbol], symbol)
+            session.advance(cur_datetime)
+            self.assertEqual(self.market.get_order_book_data(level=-1),
+                             dict((symbol, session.get_order_book_data(symbol, level=-1)) for symbol in SYMBOLS))
+            for expected, value in zip(get_ledger(session)[self.super_client.id],
+                                       self.market.ledger[self.super_client.id]):
+                self.assertAlmostEqual(value, expected, places=4)
+        self.assertEqual(len(self.market.get_transactions()), len(session.transactions))
+
+    def test_cash_not_spent_twice(self):
+        """
+        可用资金只够一个进程中挂单的冻结资金时，平分后两个进程的买单都被拒绝，汇总后的可用资金不为负
+        """
+        price, vol = Decimal('7.20'), 1000
+        tax = float(price) * vol * TAX_RATE
+        cash, frozen_cash, flexible_cash = self.market.ledger[self.super_client.id]
+        self.market.ledger[self.super_client.id] = (cash - flexible_cash + tax * 1.5, frozen_cash, tax * 1.5)
+        self.market.act(dict((symbol, [('b', price, vol)]) for symbol in SYMBOLS), START + dt.timedelta(seconds=3))
+        cash, new_frozen_cash, flexible_cash = self.market.ledger[self.super_client.id]
+        self.assertGreaterEqual(flexible_cash, 0)
+        self.assertEqual(new_frozen_cash, frozen_cash)
+        self.assertAlmostEqual(flexible_cash, tax * 1.5 + 2 * float(price) * vol, places=6)
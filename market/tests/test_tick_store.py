@@ -0,0 +1,61 @@
+# _*_ coding:UTF-8 _*_
+
+import datetime as dt
+
+from django.test import TestCase
+
+from ..models import sim_stocks, sim_tick_store
+from ..models.sim_tick_store import PRICE_FIELDS, VOLUME_FIELDS, get_tick_columns, invalidate_tick_columns
+from .util import SYMBOL, START, TempTickStoreMixin, create_market, make_slice_kwargs
+
+
+class SimTickStoreTests(TempTickStoreMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        _, self.slices = create_market(ticks=4)
+
+    def test_round_trip(self):
+        """
+        导出的列式数据按下标还原的截面与数据库中的截面相同
+        """
+        tick_columns = get_tick_columns(SYMBOL)
+        self.assertEqual(len(tick_columns), len(self.slices))
+        for index, origin in enumerate(self.slices):
+            self.assertEqual(tick_columns.index_of(origin.datetime), index)
+            restored = tick_columns.to_slice(index)
+            self.assertEqual(restored.datetime, origin.datetime)
+            for field in PRICE_FIELDS + VOLUME_FIELDS + ['amount']:
+                self.assertEqual(getattr(restored, field), getattr(origin, field), field)
+
+    def test_index_of_and_as_of(self):
+        tick_columns = get_tick_columns(SYMBOL)
+        between = START + dt.timedelta(seconds=4)
+        self.assertIsNone(tick_columns.index_of(between))
+        self.assertEqual(tick_columns.search(between), 2)
+        self.assertEqual(tick_columns.as_of(between), 1)
+        self.assertEqual(tick_columns.as_of(self.slices[1].datetime), 1)
+        self.assertIsNone(tick_columns.as_of(START - dt.timedelta(seconds=1)))
+        self.assertEqual(tick_columns.as_of(START + dt.timedelta(days=1)), len(self.slices) - 1)
+        self.assertEqual(len(tick_columns.range(self.slices[1].datetime, between)), 1)
+
+    def test_rebuilt_when_db_changes(self):
+        """
+        截面被增删后标记改变：invalidate_tick_columns之后，或在新的进程中第一次访问时，重新导出
+        """
+        self.assertEqual(len(get_tick_columns(SYMBOL)), 4)
+        last = self.slices[-1]
+        sim_stocks.SimStockSlice.objects.create(**make_slice_kwargs(SYMBOL, last.datetime + dt.timedelta(seconds=3),
+                                                                    last.b1))
+        # 本进程已核对过，不再访问数据库
+        self.assertEqual(len(get_tick_columns(SYMBOL)), 4)
+        invalidate_tick_columns(SYMBOL)
+        self.assertEqual(len(get_tick_columns(SYMBOL)), 5)
+
+        sim_stocks.SimStockSlice.objects.filter(id=self.slices[0].id).delete()
+        # 新进程中尚未核对过的股票
+        sim_tick_store._checked_symbols.clear()
+        self.tick_store.invalidate()
+        tick_columns = get_tick_columns(SYMBOL)
+        self.assertEqual(len(tick_columns), 4)
+        self.assertEqual(tick_columns.to_slice(0).datetime, self.slices[1].datetime)
@@ -0,0 +1,115 @@
+# _*_ coding:UTF-8 _*_
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+
+import h5py
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..models.utils import TickTable, get_chunk_ranges, prefetch
+from .test_import import random_int_datetimes
+from .util import SYMBOL
+
+
+class GetChunkRangesTests(SimpleTestCase):
+
+    def test_fixed_size(self):
+        self.assertEqual(get_chunk_ranges(None, 3, 11, 4), [(3, 7), (7, 11)])
+        self.assertEqual(get_chunk_ranges(None, 3, 12, 4), [(3, 7), (7, 11), (11, 12)])
+        self.assertEqual(get_chunk_ranges(None, 3, 3, 4), [])
+
+    def test_by_day(self):
+        """
+        按日对齐的块首尾相接地覆盖[left, right)，边界总在两日之间；
+        多日的块不超过chunk_size，且再加入下一日就会超过，单日超过chunk_size时单独成块
+        """
+        dts = random_int_datetimes(random.Random(8), days=6, ticks=50)
+        days = dts // 1000000000
+        for left, right, chunk_size in ((0, len(dts), 120), (30, 260, 60), (0, len(dts), 40), (10, 20, 500)):
+            ranges = get_chunk_ranges(dts, left, right, chunk_size, by_day=True)
+            self.assertEqual(ranges[0][0], left)
+            self.assertEqual(ranges[-1][1], right)
+            for (_, prev_right), (next_left, _) in zip(ranges[:-1], ranges[1:]):
+                self.assertEqual(prev_right, next_left)
+                self.assertNotEqual(days[next_left - 1], days[next_left])
+            for i, (chunk_left, chunk_right) in enumerate(ranges):
+                if days[chunk_left] != days[chunk_right - 1]:
+                    self.assertLessEqual(chunk_right - chunk_left, chunk_size)
+                if i + 1 < len(ranges):
+                    next_day_end = chunk_right
+                    while next_day_end < right and days[next_day_end] == days[chunk_right]:
+                        next_day_end += 1
+                    self.assertGreater(next_day_end - chunk_left, chunk_size)
+
+
+class PrefetchTests(SimpleTestCase):
+
+    def test_same_items(self):
+        self.assertEqual(list(prefetch(iter(range(100)), depth=3)), list(range(100)))
+
+    def test_error_raised_in_caller(self):
+        def items():
+            yield 1
+            raise KeyError('broken')
+
+        result = []
+        with self.assertRaises(KeyError):
+            for item in prefetch(items()):
+                result.append(item)
+        self.assertEqual(result, [1])
+
+    def test_close_stops_reading(self):
+        """
+        调用方提前结束时，后台线程停止读取，并在后台线程中关闭iterator
+        """
+        produced = []
+        closed_in = []
+
+        def items():
+            try:
+                for i in range(1000):
+                    produced.append(i)
+                    yield i
+            finally:
+                closed_in.append(threading.current_thread())
+
+        chunks = prefetch(items(), depth=2)
+        self.assertEqual(next(chunks), 0)
+        chunks.close()
+        self.assertEqual(len(closed_in), 1)
+        self.assertIsNot(closed_in[0], threading.current_thread())
+        self.assertLess(len(produced), 10)
+
+
+class TickTableStreamTests(SimpleTestCase):
+
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        self.path = os.path.join(path, 'ticks.h5')
+        self.dts = random_int_datetimes(random.Random(9), days=4, ticks=60)
+        with h5py.File(self.path, 'w') as h5file:
+            group = h5file.create_group(SYMBOL)
+            group['datetime'] = self.dts
+            group['last'] = np.arange(len(self.dts)) / 100 + 7
+            group['volume'] = np.arange(len(self.dts)) * 100
+
+    def test_stream_same_as_whole_range(self):
+        table = TickTable(self.path)
+        start, end = int(self.dts[20]), int(self.dts[200])
+        for by_day in (False, True):
+            for depth in (0, 2):
+                chunks = list(table.stream(SYMBOL, start, end, keys=['last', 'volume'], chunk_size=50,
+                                           by_day=by_day, prefetch_depth=depth))
+                self.assertTrue(all(code == SYMBOL for code, _ in chunks))
+                records = np.concatenate([chunk for _, chunk in chunks])
+                self.assertEqual(records['datetime'].tolist(), self.dts[20:201].tolist())
+                self.assertEqual(records['volume'].tolist(), (np.arange(20, 201) * 100).tolist())
+                if by_day:
+                    for (_, prev_chunk), (_, chunk) in zip(chunks[:-1], chunks[1:]):
+                        self.assertNotEqual(prev_chunk['datetime'][-1] // 1000000000,
+                                            chunk['datetime'][0] // 1000000000)
@@ -0,0 +1,43 @@
+# _*_ coding:UTF-8 _*_
+
+import datetime as dt
+import random
+from decimal import Decimal
+
+from django.test import TestCase
+
+from ..models.sim_stocks import SimTradeHistory
+from ..models.sim_trade_tape import SimTradeTape
+from .util import SYMBOL, START
+
+
+def history():
+    return list(SimTradeHistory.objects.filter(stock_symbol=SYMBOL).order_by('id').values_list(
+        'tick', 'datetime', 'direction', 'price', 'vol'))
+
+
+class SimTradeTapeTests(TestCase):
+
+    def test_flush_at_capacity(self):
+        """
+        缓冲写满时先将已有的成交写入数据库，环形缓冲绕回后成交顺序不变，写入的价格与记录时相同
+        """
+        rng = random.Random(8)
+        tape = SimTradeTape(SYMBOL, capacity=4)
+        trades = []
+        for tick in range(11):
+            trade = (tick, START + dt.timedelta(seconds=3 * tick), rng.choice('ab'),
+                     Decimal('7.15') + Decimal('0.01') * rng.randint(0, 25), rng.randint(1, 30) * 100)
+            flushed = len(trades) // 4 * 4
+            tape.record(trade[2], trade[3], trade[4], trade[1], trade[0])
+            trades.append(trade)
+            # 只有缓冲已满时记录才会触发写入
+            self.assertEqual(history(), trades[:flushed])
+            self.assertEqual(len(tape), len(trades) - flushed)
+        self.assertEqual(tape.to_array()['tick'].tolist(), [8, 9, 10])
+
+        self.assertTrue(tape.flush())
+        self.assertEqual(history(), trades)
+        self.assertEqual(len(tape), 0)
+        self.assertFalse(tape.flush())
+        self.assertEqual(len(history()), len(trades))
@@ -0,0 +1,55 @@
+# _*_ coding:UTF-8 _*_
+
+from unittest import skipUnless
+
+import numpy as np
+from django.test import SimpleTestCase
+
+try:
+    from ..baselines.baselines.gail import trpo_mpi
+except ImportError:
+    # trpo_mpi依赖tensorflow与mpi4py
+    trpo_mpi = None
+
+
+def single_env_gae(rew, vpred, new, nextvpred, gamma, lam):
+    """
+    单个环境的GAE(lambda)，与ppo1中的add_vtarg_and_adv相同
+    """
+    new = np.append(new, 0)
+    vpred = np.append(vpred, nextvpred)
+    adv = np.empty(len(rew), 'float32')
+    lastgaelam = 0
+    for t in reversed(range(len(rew))):
+        nonterminal = 1 - new[t + 1]
+        delta = rew[t] + gamma * vpred[t + 1] * nonterminal - vpred[t]
+        adv[t] = lastgaelam = delta + gamma * lam * nonterminal * lastgaelam
+    return adv
+
+
+@skipUnless(trpo_mpi is not None, 'tensorflow or mpi4py is not installed')
+class AddVtargAndAdvTests(SimpleTestCase):
+
+    def test_each_env_bootstrapped(self):
+        """
+        多个环境依次拼接的轨迹，每个环境的优势与单独计算的结果相同，被截断的最后一步以各自的nextvpred自举
+        """
+        rng = np.random.RandomState(10)
+        nenvs, horizon, gamma, lam = 4, 16, 0.99, 0.95
+        seg = {"rew": rng.randn(nenvs * horizon).astype('float32'),
+               "vpred": rng.randn(nenvs * horizon).astype('float32'),
+               "new": (rng.rand(nenvs * horizon) < 0.1).astype('int32'),
+               "nextvpred": rng.randn(nenvs).astype('float32')}
+        trpo_mpi.add_vtarg_and_adv(seg, gamma, lam)
+        for e in range(nenvs):
+            part = slice(e * horizon, (e + 1) * horizon)
+            expected = single_env_gae(seg["rew"][part], seg["vpred"][part], seg["new"][part], seg["nextvpred"][e],
+                                      gamma, lam)
+            np.testing.assert_allclose(seg["adv"][part], expected, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(seg["tdlamret"], seg["adv"] + seg["vpred"])
+
+        # 单个环境时nextvpred为标量
+        single = dict((key, value[:horizon]) for key, value in seg.items() if key in ("rew", "vpred", "new"))
+        single["nextvpred"] = seg["nextvpred"][0]
+        trpo_mpi.add_vtarg_and_adv(single, gamma, lam)
+        np.testing.assert_allclose(single["adv"], seg["adv"][:horizon], rtol=1e-5, atol=1e-6)
@@ -0,0 +1,137 @@
+# _*_ coding:UTF-8 _*_
+
+"""
+各测试共用的市场构造与参照实现
+"""
+
+import datetime as dt
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+
+from ..models import clients, sim_clients, sim_market, sim_stocks, sim_tick_store
+
+SYMBOL = '000009.XSHE'
+START = dt.datetime(2018, 1, 2, 9, 30, 3)
+
+
+def make_slice_kwargs(symbol, datetime, base, volume=100000, amount=725000.0):
+    """
+    以base为买1价、base + 0.01为卖1价的五档盘口不交叉的截面
+    """
+    kwargs = dict(stock_symbol=symbol, datetime=datetime, last_price=base, high=base + Decimal('0.05'),
+                  low=Decimal('7.20'), open=Decimal('7.22'), volume=volume, amount=amount)
+    for i in range(1, 6):
+        kwargs['a{}'.format(i)] = base + Decimal('0.01') * i
+        kwargs['a{}_v'.format(i)] = 1000 * i
+        kwargs['b{}'.format(i)] = base - Decimal('0.01') * (i - 1)
+        kwargs['b{}_v'.format(i)] = 900 * i
+    return kwargs
+
+
+def create_market(ticks=3, symbols=(SYMBOL, )):
+    """
+    建立超级用户、市场和股票，每支股票有ticks个五档盘口不交叉的截面
+    :return: (超级用户, 第一支股票的截面列表)
+    """
+    user = User.objects.create(username='root', is_superuser=True)
+    super_client = clients.BaseClient.objects.create(driver=user, name='Amadeus')
+    sim_market.SimMarket.objects.create(id=1, datetime=START)
+    all_slices = []
+    for symbol in symbols:
+        sim_stocks.SimStock.objects.create(symbol=symbol, name=symbol)
+        slices = []
+        for k in range(ticks):
+            kwargs = make_slice_kwargs(symbol, START + dt.timedelta(seconds=3 * k),
+                                       Decimal('7.25') + Decimal('0.01') * k, 100000 + 1000 * k, 725000.0 + 7260 * k)
+            slices.append(sim_stocks.SimStockSlice.objects.create(**kwargs))
+        all_slices.append(slices)
+    return super_client, all_slices[0]
+
+
+class TempTickStoreMixin:
+    """
+    测试期间使用临时目录中的列式tick存储，不读写market/data/ticks
+    """
+
+    def setUp(self):
+        super().setUp()
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        self.tick_store = sim_tick_store.SimTickStore(path)
+        for name, value in (('tick_store', self.tick_store), ('_checked_symbols', set())):
+            patcher = mock.patch.object(sim_tick_store, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+def random_actions(rng):
+    actions = []
+    for _ in range(rng.randint(1, 4)):
+        price = Decimal('7.15') + Decimal('0.01') * rng.randint(0, 25)
+        actions.append((rng.choice('abc'), price, rng.randint(1, 30) * 100))
+    return actions
+
+
+def reference_match(orders, direction, price, vol):
+    """
+    逐笔撮合的参照实现，顺序与原先每次从数据库查询最优挂单相同：价格优先，同价格时编号（时间）优先
+    :param orders: [[unique_id, direction, price, vol]]，成交的挂单在其中扣减
+    :return: 成交列表[(unique_id, 成交量)]
+    """
+    if direction == 'a':
+        candidates = sorted((order for order in orders if order[1] == 'b' and order[2] >= price),
+                            key=lambda order: (-order[2], order[0]))
+    else:
+        candidates = sorted((order for order in orders if order[1] == 'a' and order[2] <= price),
+                            key=lambda order: (order[2], order[0]))
+    fills = []
+    for order in candidates:
+        if vol == 0:
+            break
+        traded_vol = min(vol, order[3])
+        order[3] -= traded_vol
+        vol -= traded_vol
+        fills.append((order[0], traded_vol))
+    orders[:] = [order for order in orders if order[3] > 0]
+    return fills
+
+
+def reference_depth(orders):
+    """
+    与SimOrderBook.get_order_book_data(level=-1)的格式相同，卖方和买方均按价格降序
+    """
+    depth = {'a': {}, 'b': {}}
+    for unique_id, direction, price, vol in orders:
+        depth[direction][price] = depth[direction].get(price, 0) + vol
+    return tuple(sorted(depth[direction].items(), reverse=True) for direction in ('a', 'b'))
+
+
+def db_state(super_client_id, symbol=SYMBOL):
+    """
+    数据库中模拟器的盘口、最新价、成交量、持仓、委托、超级用户资金与成交数
+    """
+    stock = sim_stocks.SimStock.objects.get(symbol=symbol)
+    holdings = sorted(sim_clients.SimHoldingElem.objects.values_list('owner', 'vol', 'frozen_vol', 'available_vol'))
+    commissions = sorted(sim_clients.SimCommissionElem.objects.values_list(
+        'operation', 'price_committed', 'vol_committed', 'vol_traded'))
+    cash = clients.BaseClient.objects.get(id=super_client_id).cash
+    return (stock.get_order_book_data(level=-1), stock.last_price, stock.volume, holdings, commissions,
+            round(cash, 2), sim_clients.SimTransactionElem.objects.count())
+
+
+def session_state(session, symbol=SYMBOL):
+    """
+    与db_state相同，取自SimMarketSession
+    """
+    stock = session.stocks[symbol]
+    holdings = sorted((holding.owner, holding.vol, holding.frozen_vol, holding.available_vol)
+                      for holding in session.holdings.values())
+    commissions = sorted((commission.operation, commission.price_committed, commission.vol_committed,
+                          commission.vol_traded) for commission in session.commissions.values())
+    cash = session.clients[session.super_client_id].cash
+    return (session.get_order_book_data(symbol, level=-1), stock.last_price, stock.volume, holdings,
+            commissions, round(cash, 2), len(session.transactions))
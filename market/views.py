@@ -11,7 +11,10 @@ import time
 import json
 
 from .models import clients, stocks, forms, sim_market, sim_clients, sim_stocks
-from .models import config, utils
+from .models import config
+from .models.sim_tick_store import get_tick_columns, invalidate_tick_columns
+from .models.sim_import import import_stock_data
+from .models.sim_reset import reset_simulation_data
 from .models.trades import CommissionMsg, commission_handler
 from .simulator_main import simulator_main_func, anchor_one_stock
 from .baselines.baselines.gail.dataset.generate_expert_data import generate_expert_data
@@ -221,16 +224,13 @@ def simulator_stock_detail(request, stock_id):
 
     market = sim_market.SimMarket.objects.get(id=1)
     cur_datetime = market.datetime
-    cur_day = cur_datetime.day
-    stock_slices = sim_stocks.SimStockSlice.objects.filter(stock_symbol=this_stock.symbol,
-                                                           datetime__day=cur_day, datetime__lte=cur_datetime)
-    time_log = []
-    price_log = []
-    volume_log = []
-    for each_slice in stock_slices:
-        time_log.append(str(each_slice.datetime)[-9:-3])
-        price_log.append(float(each_slice.last_price))
-        volume_log.append(each_slice.volume)
+    day_start = datetime.datetime.combine(cur_datetime.date(), datetime.time.min)
+    stock_slices = get_tick_columns(this_stock.symbol).range(day_start, cur_datetime)
+    int_datetimes = stock_slices['datetime']
+    time_log = [' {:02d}:{:02d}'.format(hour, minute) for hour, minute in
+                zip((int_datetimes // 10000000 % 100).tolist(), (int_datetimes // 100000 % 100).tolist())]
+    price_log = (stock_slices['last_price'] / 100).tolist()
+    volume_log = stock_slices['volume'].tolist()
 
     # 读取生成数据
     generate_trades = sim_stocks.SimTradeHistory.objects.filter(stock_symbol=this_stock.symbol).order_by('tick','id').reverse()
@@ -290,13 +290,14 @@ def simulator_stock_tick(request, stock_id):
         market.datetime = origin_market.anchored_datetime
         market.save()
     cur_datetime = market.datetime
-    stock_tick_info = sim_stocks.SimStockSlice.objects.filter(stock_symbol=this_stock.symbol, datetime=cur_datetime)
+    tick_columns = get_tick_columns(this_stock.symbol)
+    index = tick_columns.index_of(cur_datetime)
     ask_info = None
     bid_info = None
     tick_info = None
-    if stock_tick_info.exists():
-        ask_info, bid_info = stock_tick_info[0].get_level5_data()
-        tick_info = stock_tick_info[0]
+    if index is not None:
+        tick_info = tick_columns.to_slice(index)
+        ask_info, bid_info = tick_info.get_level5_data()
 
     context = {'stock': this_stock, 'info': tick_info, 'level5_ask': ask_info, 'level5_bid': bid_info, 'time': str(cur_datetime)}
     return render(request, 'market/simulator/v_stock_tick.html', context)
@@ -312,15 +313,16 @@ def simulator_stock_prev_tick(request, stock_id):
     this_stock = sim_stocks.SimStock.objects.get(id=stock_id)
     market = sim_market.SimMarket.objects.get(id=2)
     cur_datetime = market.datetime
-    stock_tick_info = sim_stocks.SimStockSlice.objects.get(stock_symbol=this_stock.symbol, datetime=cur_datetime)
-    prev_info = sim_stocks.SimStockSlice.objects.filter(id=stock_tick_info.id - 1)
+    tick_columns = get_tick_columns(this_stock.symbol)
+    # 当前时间之前最近的截面，当前时间不是该股票的截面时同样适用
+    prev_index = tick_columns.search(cur_datetime) - 1
     ask_info = None
     bid_info = None
     tick_info = None
-    if prev_info.exists():
-        tick_info = prev_info[0]
-        ask_info, bid_info = prev_info[0].get_level5_data()
-        market.datetime = prev_info[0].datetime
+    if prev_index >= 0:
+        tick_info = tick_columns.to_slice(prev_index)
+        ask_info, bid_info = tick_info.get_level5_data()
+        market.datetime = tick_info.datetime
         market.save()
         cur_datetime = market.datetime
 
@@ -338,15 +340,17 @@ def simulator_stock_next_tick(request, stock_id):
     this_stock = sim_stocks.SimStock.objects.get(id=stock_id)
     market = sim_market.SimMarket.objects.get(id=2)
     cur_datetime = market.datetime
-    stock_tick_info = sim_stocks.SimStockSlice.objects.get(stock_symbol=this_stock.symbol, datetime=cur_datetime)
-    next_info = sim_stocks.SimStockSlice.objects.filter(id=stock_tick_info.id + 1)
+    tick_columns = get_tick_columns(this_stock.symbol)
+    # 当前时间之后最近的截面，当前时间早于全部截面时为第一个截面
+    index = tick_columns.as_of(cur_datetime)
+    next_index = 0 if index is None else index + 1
     ask_info = None
     bid_info = None
     tick_info = None
-    if next_info.exists():
-        tick_info = next_info[0]
-        ask_info, bid_info = next_info[0].get_level5_data()
-        market.datetime = next_info[0].datetime
+    if next_index < len(tick_columns):
+        tick_info = tick_columns.to_slice(next_index)
+        ask_info, bid_info = tick_info.get_level5_data()
+        market.datetime = tick_info.datetime
         market.save()
         cur_datetime = market.datetime
 
@@ -446,22 +450,12 @@ def simulator_reset_handler(request, superuser_client):
     assert isinstance(superuser_client, clients.BaseClient)
     market = sim_market.SimMarket.objects.get(id=1)
     sim_market.SimMarket.objects.filter(id=2).delete()
-    clients.BaseClient.objects.filter(driver=None).delete()
-    sim_clients.SimTransactionElem.objects.all().delete()
-    sim_clients.SimHoldingElem.objects.all().delete()
-    sim_clients.SimCommissionElem.objects.all().delete()
+    reset_simulation_data(superuser_client)
 
     market.datetime = market.anchored_datetime
     market.num_v_clients = 0
     market.tick = 0
     market.save()
-    v_stocks = sim_stocks.SimStock.objects.all()
-    for v_stock in v_stocks:
-        v_stock.reset()
-    superuser_client.cash = 100000000
-    superuser_client.flexible_cash = 100000000
-    superuser_client.frozen_cash = 0
-    superuser_client.save()
     time1 = time.time()
     print('Simulator Reset, Cost {}s'.format(time1 - time0))
     return True
@@ -478,6 +472,7 @@ def simulator_reset_all(request):
     simulator_reset_handler(request, superuser_client)
     sim_stocks.SimStockSlice.objects.all().delete()
     sim_stocks.SimTradeHistory.objects.all().delete()
+    invalidate_tick_columns()
     return HttpResponseRedirect(reverse('market:sim_welcome'))
 
 
@@ -506,89 +501,6 @@ def simulator_import_stock_data(request):
     return render(request, 'market/simulator/import_data.html', context)
 
 
-def import_stock_data(symbol, start_date, end_date, interval):
-    import os
-    abs_path = os.path.abspath('utils.py')
-    abs_path = abs_path[:-9]
-    path = os.path.join(abs_path, 'market', 'data', symbol)
-    tb = utils.TickTable(path)
-    data = tb.select(symbol, 10180101093000000, 30191231153000000)
-    num_record = len(data)
-    start_datetime = utils.get_int_from_timestamp(start_date)
-    end_datetime = utils.get_int_from_timestamp(end_date)
-    prev_day = str(data.index[0])[6:8]
-    prev_imported_time = None
-    open_today = 0.0
-    time0 = time.time()
-    count = 0
-
-    sim_stocks.SimStock.objects.get_or_create(symbol=symbol)
-    for i in range(num_record):
-        cur_datetime = data.index[i]
-        if cur_datetime < start_datetime:
-            continue
-        if cur_datetime > end_datetime:
-            break
-
-        if str(data.index[i])[6:8] != prev_day:
-            # 加入前一天的日间截面信息
-            prev_timestamp = utils.get_timestamp_from_int(prev_imported_time)
-            prev_record = data.loc[prev_imported_time]
-            sim_stocks.SimStockDailyInfo.objects.create(stock_symbol=symbol, date=prev_timestamp.date(), open=open_today,
-                                                        high=prev_record.high, low=prev_record.low,
-                                                        close=prev_record['last'],
-                                                        volume=prev_record.volume, amount=prev_record.amount)
-            prev_day = str(data.index[i])[6:8]
-            time1 = time.time()
-            print('{} imported, cost {:.2f} s.'.format(prev_timestamp.date(), time1 - time0))
-            time0 = time.time()
-
-        if str(cur_datetime)[9:11] == '91' or str(cur_datetime)[9:11] == '92':
-            # 集合竞价阶段不导入（开盘）
-            prev_imported_time = None
-            continue
-
-        if interval == 't':
-            pass
-        elif interval == 'm':
-            # 导入每分钟数据，加入偏移，尽量同步每个整分钟
-            if (str(prev_imported_time)[12:14] == '03' or str(prev_imported_time)[12:14] == '06') and \
-                    str(cur_datetime)[12:14] == '00':
-                pass
-            else:
-                if prev_imported_time is not None and cur_datetime - prev_imported_time < 100000:
-                    continue
-
-        data_slice = data.loc[cur_datetime]
-        if prev_imported_time is None:
-            # 开盘价
-            open_today = data_slice['last']
-        cur_timestamp = utils.get_timestamp_from_int(cur_datetime)
-
-        if sim_stocks.SimStockSlice.objects.filter(stock_symbol=symbol, datetime=cur_timestamp).exists():
-            # 该股票该截面已经导入
-            continue
-
-        stick = sim_stocks.SimStockSlice(stock_symbol=symbol, datetime=cur_timestamp, last_price=data_slice['last'],
-                                         high=data_slice.high, low=data_slice.low, open=open_today,
-                                         a1=data_slice.a1, a1_v=data_slice.a1_v, b1=data_slice.b1, b1_v=data_slice.b1_v,
-                                         a2=data_slice.a2, a2_v=data_slice.a2_v, b2=data_slice.b2, b2_v=data_slice.b2_v,
-                                         a3=data_slice.a3, a3_v=data_slice.a3_v, b3=data_slice.b3, b3_v=data_slice.b3_v,
-                                         a4=data_slice.a4, a4_v=data_slice.a4_v, b4=data_slice.b4, b4_v=data_slice.b4_v,
-                                         a5=data_slice.a5, a5_v=data_slice.a5_v, b5=data_slice.b5, b5_v=data_slice.b5_v,
-                                         amount=data_slice.amount, volume=data_slice.volume)
-        stick.save()
-        prev_imported_time = cur_datetime
-
-        # 每导入10条记录，打印下时间
-        count += 1
-        if count == 10:
-            print('{} imported.'.format(cur_timestamp))
-            count = 0
-
-    return True
-
-
 def anchor_in_time_point(request):
     if not request.user.is_superuser:
         return render(request, 'market/invalid/no_permission.html')
@@ -609,21 +521,16 @@ def anchor_in_time_point(request):
             market_for_tick.save()
             v_stocks = sim_stocks.SimStock.objects.all()
             for v_stock in v_stocks:
-                slices = v_stock.get_slices()
-                if not slices.exists():
+                tick_columns = get_tick_columns(v_stock.symbol)
+                if len(tick_columns) == 0:
                     # 股票的slices信息不存在，跳过
                     continue
-                start = slices[0].datetime
-                end = slices[slices.count() - 1].datetime
-                if anchor_datetime < start or anchor_datetime > end:
+                # 找到该股票在anchor time之后的第一个tick截面信息
+                index = tick_columns.search(anchor_datetime)
+                if index == len(tick_columns) or (index == 0 and tick_columns.index_of(anchor_datetime) is None):
                     # anchor time不在slices记录之中，跳过
                     continue
-                anchor_slice = None
-                for anchor_slice in slices:
-                    if anchor_slice.datetime >= anchor_datetime:
-                        # 找到该股票在anchor time之后的第一个tick截面信息
-                        break
-                anchor_one_stock(v_stock, anchor_slice, user_client)
+                anchor_one_stock(v_stock, tick_columns.to_slice(index), user_client)
             return HttpResponseRedirect(reverse('market:sim_welcome'))
         else:
             return render(request, 'market/invalid/import_data_failed.html')